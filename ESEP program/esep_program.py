@@ -12,18 +12,32 @@ import time
 import curses
 from urllib.parse import quote
 import datetime
+import os
 import subprocess
+import sys
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import tracing
 
 CSV_FILE = "esep.csv"
 EPI_BASE_URL_SPEECH = "http://localhost:8000/command/EpiSpeech.say/0/0/"
 EPI_BASE_URL_MOTION = "http://localhost:8000/command/SR.trig/"
 VIDEO_STREAM_URL = "http://righteye.local:8080/stream/video.mjpeg"
+# Name of a running frame bus (python frame_bus.py publish) to record from instead of
+# opening a second connection to the stream, e.g. "epi-camera" (frame_bus.BUS_NAME).
+# None records the stream with ffmpeg.
+FRAME_BUS_NAME = None
+FRAME_BUS_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'frame_bus.py')
 
 def record_video(video_file):
     """
-    Start recording the MJPEG stream at a reduced frame rate.
+    Start recording the MJPEG stream at a reduced frame rate, from the frame bus
+    FRAME_BUS_NAME if it is set.
     Returns the subprocess.Popen object so we can stop it later.
     """
+    if FRAME_BUS_NAME is not None:
+        return record_video_from_bus(video_file, FRAME_BUS_NAME)
     process = subprocess.Popen([
         "ffmpeg",
         "-loglevel", "quiet",
@@ -35,6 +49,18 @@ def record_video(video_file):
     ])
     return process
 
+def record_video_from_bus(video_file, bus_name="epi-camera"):
+    """
+    Record the frames another process already decodes into the frame bus, so the
+    camera is only read once. Same interface as record_video().
+    """
+    process = subprocess.Popen([
+        sys.executable, FRAME_BUS_SCRIPT, "record", video_file,
+        "--name", bus_name,
+        "--fps", "12"
+    ])
+    return process
+
 def load_script(filename):
     """
     Load the script from CSV.
@@ -289,11 +315,17 @@ def main(stdscr, log_file):
     stdscr.getch()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the emotion and stress evoking protocol.")
+    tracing.add_arguments(parser)
+    args = parser.parse_args()
+    # Before the recording starts, so a frame bus recorder is traced into the same file
+    tracing.enable_from_args(args)
+
     log_file = create_log_file_name()
     video_file = create_video_file_name()
 
     # Start the recording process before running your main logic
-    #recording_process = record_video(video_file) #comment out to not record
+    #recording_process = record_video(video_file) #comment out to not record, set FRAME_BUS_NAME to record from a running frame bus
 
     curses.wrapper(main, log_file)
 
@@ -6,13 +6,25 @@
 Program to analyze video frames for emotions using DeepFace.
 
 Usage:
-    python facial_feature_analyzer.py --video <video_path> --frame_skip <number> --detector_backend <backend>
+    python facial_feature_analyzer.py --video <video_path> --frame_skip <number> --detector_backend <backend> --detect_every <number>
 
 Arguments:
     --video: Path to the video file to be analyzed.
     --frame_skip: Number of frames to skip between analyses (default is 10).
     --detector_backend: Face detection model to use ('opencv', 'retinaface', 'mtcnn', etc.).
                        Default is 'retinaface'.
+    --detect_every: Run the face detector on every n:th analyzed frame (default is 1). In between,
+                    emotion is classified on the tracked face boxes only.
+    --batch_frames: Number of analyzed frames whose faces are classified together in one
+                    forward pass (default is 8).
+    --detection_width: Run the face detector on frames downscaled to this width (default is 640,
+                       0 detects at full resolution). Face coordinates in the CSV stay in original pixels.
+    --change_threshold: Mean gray-level difference to the last analyzed frame below which a frame
+                        reuses the previous result instead of being analyzed (default is 4, 0 disables).
+    --metrics_port: Serve per-stage latencies on http://127.0.0.1:<port>/metrics while running.
+    --metrics_interval: Print a metrics summary line every this many seconds.
+    --profile [trace.json]: Record a Chrome trace of the run, see tracing.py. --profile_period and
+                            --profile_window record only a window of every period.
 
 If no arguments are provided, the program will prompt the user for video path and frame skip values.
 
@@ -20,18 +32,69 @@ If no arguments are provided, the program will prompt the user for video path an
 #%%
 
 import cv2
-from deepface import DeepFace
 import pandas as pd
 import argparse
 import os
+import sys
+
+# Shared modules live in the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tracker import FaceTracker
+from pipeline import EmotionPipeline, build_result
+from model_registry import warm_up_models
+from motion_gate import ChangeDetector
+import metrics
+import tracing
 
 #%%
-def analyze_video(video_path, output_csv, frame_skip=10, detector_backend='retinaface'):
+def face_row(frame_idx, video_fps, track_id, face):
+    """
+    Builds one CSV row from a DeepFace.analyze style face dict.
+    """
+    return {
+        "frame": frame_idx,
+        "time_code": round(frame_idx / video_fps, 4),
+        "id": int(track_id),
+        "dominant_emotion": face["dominant_emotion"],
+        "angry": face["emotion"].get("angry", 0),
+        "disgust": face["emotion"].get("disgust", 0),
+        "fear": face["emotion"].get("fear", 0),
+        "happy": face["emotion"].get("happy", 0),
+        "sad": face["emotion"].get("sad", 0),
+        "surprise": face["emotion"].get("surprise", 0),
+        "neutral": face["emotion"].get("neutral", 0),
+        "face_y": face["region"].get("y", 0),
+        "face_x": face["region"].get("x", 0),
+        "face_height": face["region"].get("h", 0),
+        "face_width": face["region"].get("w", 0),
+        "face_confidence": face.get("face_confidence")
+    }
+
+def copy_reused_rows(results, reused_frames, video_fps):
+    """
+    Gives frames that were skipped by the change detector the rows of the frame they repeat.
+    - results: CSV rows of the analyzed frames.
+    - reused_frames: (frame, source frame) tuples.
+    """
+    rows_by_frame = {}
+    for row in results:
+        rows_by_frame.setdefault(row["frame"], []).append(row)
+    for frame_idx, source_idx in reused_frames:
+        for row in rows_by_frame.get(source_idx, []):
+            results.append(dict(row, frame=frame_idx, time_code=round(frame_idx / video_fps, 4)))
+    results.sort(key=lambda row: row["frame"])
+
+def analyze_video(video_path, output_csv, frame_skip=10, detector_backend='retinaface', detect_every=1, batch_frames=8,
+                  change_threshold=4.0, detection_width=640):
     """
     Analyze video frames to detect emotions.
     - video_path: Path to the video file.
     - output_csv: Output CSV file path.
     - frame_skip: Number of frames to skip between analyses.
+    - detect_every: Run the face detector on every n:th analyzed frame.
+    - batch_frames: Number of analyzed frames whose faces are classified in one batch.
+    - change_threshold: Frames that differ less than this from the last analyzed frame reuse its result.
+    - detection_width: Width the detector sees, boxes are mapped back to original pixels. 0/None for full size.
     """
     if not os.path.exists(video_path):
         print(f"Error: The video file '{video_path}' does not exist.")
@@ -48,6 +111,34 @@ def analyze_video(video_path, output_csv, frame_skip=10, detector_backend='retin
 
     results = []
 
+    # Build the models up front instead of on the first frame
+    warm_up_models(detector_backend=detector_backend)
+
+    # Gives each person the same id across frames instead of DeepFace's list order
+    tracker = FaceTracker()
+
+    # Detection and emotion classification run as separate stages
+    pipeline = EmotionPipeline(detector_backend=detector_backend, detect_every=detect_every,
+                               detection_width=detection_width or None)
+
+    # Skips frames that look the same as the last analyzed one
+    gate = ChangeDetector(threshold=change_threshold)
+    reused_frames = []  # (frame, analyzed frame whose result it reuses)
+    last_analyzed_frame = None
+
+    # Faces located but not yet classified: (frame, track id, box, confidence, crop)
+    pending = []
+    pending_frames = 0
+
+    def classify_pending():
+        try:
+            emotions = pipeline.classify([crop for *_, crop in pending])
+            for (frame_idx, track_id, box, confidence, _), emotion in zip(pending, emotions):
+                results.append(face_row(frame_idx, video_fps, track_id, build_result(box, confidence, emotion)))
+        except Exception as e:
+            print(f"Error classifying {len(pending)} faces: {e}")
+        pending.clear()
+
     try:
         while cap.isOpened():
             current_frame = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
@@ -61,57 +152,66 @@ def analyze_video(video_path, output_csv, frame_skip=10, detector_backend='retin
                 break
 
             # Skip frames logic using cap.grab() for better efficiency
-            for _ in range(frame_skip - 1):
-                cap.grab()
+            with metrics.timer('decode'):
+                for _ in range(frame_skip - 1):
+                    cap.grab()
 
-            ret, frame = cap.read()
+                ret, frame = cap.read()
             if not ret:
                 break
+            metrics.inc('frames_processed')
+            tracing.frame(current_frame)
 
             print(f"Analyzing frame {current_frame} of {total_frames}", end='\r')
 
             try:
-                # Use RetinaFace for analysis
-                analysis = DeepFace.analyze(frame, actions=['emotion'], detector_backend=detector_backend, enforce_detection=False)
-                for person_idx, face in enumerate(analysis, start=1):
-                    results.append({
-                        "frame": current_frame,
-                        "time_code": round(current_frame / video_fps, 4),
-                        "id": int(person_idx),
-                        "dominant_emotion": face["dominant_emotion"],
-                        "angry": face["emotion"].get("angry", 0),
-                        "disgust": face["emotion"].get("disgust", 0),
-                        "fear": face["emotion"].get("fear", 0),
-                        "happy": face["emotion"].get("happy", 0),
-                        "sad": face["emotion"].get("sad", 0),
-                        "surprise": face["emotion"].get("surprise", 0),
-                        "neutral": face["emotion"].get("neutral", 0),
-                        "face_y": face["region"].get("y", 0),
-                        "face_x": face["region"].get("x", 0),
-                        "face_height": face["region"].get("h", 0),
-                        "face_width": face["region"].get("w", 0),
-                        "face_confidence": face.get("face_confidence")
-                    })
+                # Reuse the previous result if nothing changed in the picture
+                if not gate.should_analyze(frame):
+                    reused_frames.append((current_frame, last_analyzed_frame))
+                    continue
+                last_analyzed_frame = current_frame
+
+                # Detect with the chosen backend, or crop the tracked boxes in between
+                tracks = tracker.predict(frame)
+                faces = pipeline.locate(frame, boxes=[t.box for t in tracks if t.misses == 0] or None)
+                tracks = tracker.update([(box, None) for box, _, _ in faces])
+                metrics.observe('faces_per_frame', len(faces))
+                for track, (box, crop, confidence) in zip(tracks, faces):
+                    pending.append((current_frame, track.id, box, confidence, crop))
+
+                # Classify the faces of several frames in one forward pass
+                pending_frames += 1
+                if pending_frames >= batch_frames:
+                    classify_pending()
+                    pending_frames = 0
             except Exception as e:
                 print(f"Error analyzing frame {current_frame}: {e}")
+        classify_pending()
     finally:
+        tracing.frame(None)
         cap.release()
 
-    # Write results to CSV
-    df = pd.DataFrame(results)
-    df.to_csv(output_csv, index=False)
+    copy_reused_rows(results, reused_frames, video_fps)
+    pipeline.print_summary()
+    gate.print_stats()
+
+    with metrics.timer('log'):
+        # Write results to CSV
+        df = pd.DataFrame(results)
+        df.to_csv(output_csv, index=False)
 
-    # Add meta data to csv 
-    # Reopen the file to prepend the metadata
-    file_meta = f'# {{"video_path": "{video_path}", "frame_skip": {frame_skip}, "video_fps": {video_fps}}}'
+        # Add meta data to csv 
+        # Reopen the file to prepend the metadata
+        file_meta = f'# {{"video_path": "{video_path}", "frame_skip": {frame_skip}, "video_fps": {video_fps}}}'
 
-    # Read the CSV content
-    with open(output_csv, 'r') as file:
-        csv_content = file.read()
+        # Read the CSV content
+        with open(output_csv, 'r') as file:
+            csv_content = file.read()
 
-    # Write the metadata followed by the original CSV content
-    with open(output_csv, 'w') as file:
-        file.write(file_meta + '\n' + csv_content)
+        # Write the metadata followed by the original CSV content
+        with open(output_csv, 'w') as file:
+            file.write(file_meta + '\n' + csv_content)
+    metrics.print_summary()
 
     print(f"Results saved to {output_csv}")
 
@@ -122,8 +222,19 @@ if __name__ == "__main__":
     parser.add_argument("--detector_backend", type=str, default='retinaface', help="Face detection model to use (e.g., 'opencv', 'retinaface', 'mtcnn', etc.)")
     parser.add_argument("--video", type=str, help="Path to the video file.")
     parser.add_argument("--frame_skip", type=int, default=5, help="Number of frames to skip between analyses.")
+    parser.add_argument("--detect_every", type=int, default=1, help="Run the face detector on every n:th analyzed frame.")
+    parser.add_argument("--batch_frames", type=int, default=8, help="Number of analyzed frames to classify in one batch.")
+    parser.add_argument("--detection_width", type=int, default=640, help="Width frames are downscaled to for face detection (0 = full resolution).")
+    parser.add_argument("--change_threshold", type=float, default=4.0, help="Reuse the previous result for frames that changed less than this (0 disables).")
+    parser.add_argument("--metrics_port", type=int, default=None, help="Serve per-stage latencies on this port (/metrics).")
+    parser.add_argument("--metrics_interval", type=float, default=None, help="Print a metrics summary line every this many seconds.")
+    tracing.add_arguments(parser)
     args, unknown = parser.parse_known_args()
 
+    tracing.enable_from_args(args)
+    if args.metrics_port or args.metrics_interval:
+        metrics.enable(port=args.metrics_port, summary_interval=args.metrics_interval)
+
     # If arguments are not provided, prompt the user for inputs
     if args.video:
         video_path = args.video
@@ -133,4 +244,6 @@ if __name__ == "__main__":
         frame_skip = int(input("Enter the number of frames to skip: "))
 
     output_csv = f"{video_path[:-4]}.csv"
-    analyze_video(video_path, output_csv, frame_skip=frame_skip, detector_backend=args.detector_backend)
\ No newline at end of file
+    analyze_video(video_path, output_csv, frame_skip=frame_skip, detector_backend=args.detector_backend,
+                  detect_every=args.detect_every, batch_frames=args.batch_frames,
+                  change_threshold=args.change_threshold, detection_width=args.detection_width)
\ No newline at end of file
@@ -2,6 +2,13 @@ import argparse
 import csv
 import cv2
 import os
+import sys
+
+# The overlay renderer lives in the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from overlay import EMOTION_ORDER, OverlayRenderer
+import metrics
+import tracing
 
 # Function to parse command-line arguments
 def parse_arguments():
@@ -10,6 +17,9 @@ def parse_arguments():
     parser.add_argument("--csv", required=True, help="Path to the CSV file with face and emotion data.")
     parser.add_argument("--name", default=None, help="Name to overlay above the face. If not provided, the ID from the CSV will be used.")
     parser.add_argument("--output", default="video_overlay.mp4", help="Name of the output video file.")
+    parser.add_argument("--metrics_port", type=int, default=None, help="Serve per-stage latencies on this port (/metrics).")
+    parser.add_argument("--metrics_interval", type=float, default=None, help="Print a metrics summary line every this many seconds.")
+    tracing.add_arguments(parser)
     return parser.parse_args()
 
 # Function to parse the CSV data with metadata
@@ -90,74 +100,45 @@ def process_video(video_path, video_data, name, output_path):
         fidx = row["frame_idx"]
         data_by_frame.setdefault(fidx, []).append(row)
 
+    renderer = OverlayRenderer()
     frame_index = 0
     last_overlay = None
     while True:
-        ret, frame = cap.read()
+        with metrics.timer('decode'):
+            ret, frame = cap.read()
         if not ret:
             break
+        metrics.inc('frames_processed')
+        tracing.frame(frame_index)
 
         if frame_index in data_by_frame:
             last_overlay = data_by_frame[frame_index]
 
         if last_overlay:
-            for person_data in last_overlay:
-                y = person_data["face_y"]
-                x = person_data["face_x"]
-                h = person_data["face_height"]
-                w = person_data["face_width"]
-
-                display_name = name if name else person_data["id"]  # Use the provided name or fallback to ID
-
-                cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-                cv2.putText(frame, display_name, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-
-                dom_emotion = person_data["dominant_emotion"]
-                emotions = {
-                    "angry": person_data["angry"],
-                    "disgust": person_data["disgust"],
-                    "fear": person_data["fear"],
-                    "happy": person_data["happy"],
-                    "sad": person_data["sad"],
-                    "surprise": person_data["surprise"],
-                    "neutral": person_data["neutral"],
-                }
-
-                overlay_x1 = x + w + 10
-                overlay_y1 = y
-                overlay_width = 210  # Increased width
-                overlay_height = 240  # Increased height
-                overlay_x2 = overlay_x1 + overlay_width
-                overlay_y2 = overlay_y1 + overlay_height
-
-                overlay = frame.copy()
-                cv2.rectangle(overlay, (overlay_x1, overlay_y1), (overlay_x2, overlay_y2), (0, 0, 0), -1)
-                frame = cv2.addWeighted(overlay, 0.5, frame, 0.5, 0)
-
-                cv2.putText(frame, f"Dominant: {dom_emotion}", (overlay_x1 + 5, overlay_y1 + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-
-                bar_left = overlay_x1 + 80  # Adjusted position for bars
-                bar_top_start = overlay_y1 + 40
-                bar_height = 12
-                gap = 15
-
-                for i, (emo_name, emo_val) in enumerate(emotions.items()):
-                    bar_length = int(min(emo_val, 100) / 100 * 100)
-                    top_y = bar_top_start + i * (bar_height + gap)
-                    bar_color = (255, 255, 255) if emo_name != dom_emotion.lower() else (0, 255, 255)
-
-                    cv2.putText(frame, f"{emo_name}", (overlay_x1 + 5, top_y + bar_height - 2), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
-                    cv2.rectangle(frame, (bar_left, top_y), (bar_left + bar_length, top_y + bar_height), bar_color, -1)
-
-        out.write(frame)
+            metrics.observe('faces_per_frame', len(last_overlay))
+            with metrics.timer('render'):
+                for person_data in last_overlay:
+                    display_name = name if name else person_data["id"]  # Use the provided name or fallback to ID
+                    box = (person_data["face_x"], person_data["face_y"],
+                           person_data["face_width"], person_data["face_height"])
+                    emotions = {emo_name: person_data[emo_name] for emo_name in EMOTION_ORDER}
+                    renderer.draw_face(frame, box, display_name, emotions, person_data["dominant_emotion"])
+
+        with metrics.timer('encode'):
+            out.write(frame)
         frame_index += 1
 
+    tracing.frame(None)
     cap.release()
     out.release()
+    metrics.print_summary()
     print(f"Done! Output saved to {output_path}")
 
 # Main entry point
 if __name__ == "__main__":
     args = parse_arguments()
+    tracing.enable_from_args(args)
+    if args.metrics_port or args.metrics_interval:
+        metrics.enable(port=args.metrics_port, summary_interval=args.metrics_interval)
     video_data = parse_csv(args.csv)
     process_video(args.video, video_data, args.name, args.output)
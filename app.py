@@ -1,8 +1,10 @@
 from deepface import DeepFace
-from recognition import extract_faces, show_faces, verify_faces, find_faces, analyze_faces, streaming, extract_faces_from_folder, control_epi, control_epi2, get_face_x, temp_main, analyze_emotion_live
+from recognition import extract_faces, show_faces, verify_faces, find_faces, analyze_faces, streaming, extract_faces_from_folder, control_epi, control_epi2, get_face_x, temp_main, analyze_emotion_live, demo_mode
 import matplotlib.pyplot as plt
+import argparse
 import cv2
 import time
+import tracing
 
 
 
@@ -50,4 +52,8 @@ def main():
 
 
 if __name__ == "__main__": #tror detta kör main
+    # python app.py --profile trace.json records a timeline of the run, see tracing.py
+    parser = argparse.ArgumentParser(description="Run what main() is set up to do.")
+    tracing.add_arguments(parser)
+    tracing.enable_from_args(parser.parse_args())
     main()
\ No newline at end of file
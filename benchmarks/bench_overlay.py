@@ -0,0 +1,110 @@
+"""
+Per-frame cost of the emotion overlay versus the number of faces.
+
+Compares the old drawing code (frame.copy() and a full-frame addWeighted per
+face) with OverlayRenderer on a synthetic frame, and checks that both draw
+the same pixels (up to rounding in the panel blend).
+
+Usage:
+    python benchmarks/bench_overlay.py [--width 1280 --height 720 --faces 1 2 4 8 --frames 200]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from overlay import EMOTION_ORDER, OverlayRenderer
+
+
+def legacy_draw_face(frame, box, label, emotions, dom_emotion):
+    # The drawing code demo_mode() and video_overlay.py used before OverlayRenderer
+    x, y, w, h = box
+    cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+    cv2.putText(frame, label, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+
+    overlay_x1 = x + w + 10
+    overlay_y1 = y
+    overlay = frame.copy()
+    cv2.rectangle(overlay, (overlay_x1, overlay_y1), (overlay_x1 + 210, overlay_y1 + 240), (0, 0, 0), -1)
+    frame = cv2.addWeighted(overlay, 0.5, frame, 0.5, 0)
+
+    cv2.putText(frame, f"Dominant: {dom_emotion}", (overlay_x1 + 5, overlay_y1 + 20),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+    for i, emo_name in enumerate(EMOTION_ORDER):
+        bar_length = int(min(emotions.get(emo_name, 0.0), 100) / 100 * 100)
+        top_y = overlay_y1 + 40 + i * 27
+        bar_color = (0, 255, 255) if emo_name == dom_emotion else (255, 255, 255)
+        cv2.putText(frame, emo_name, (overlay_x1 + 5, top_y + 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+        cv2.rectangle(frame, (overlay_x1 + 80, top_y), (overlay_x1 + 80 + bar_length, top_y + 12), bar_color, -1)
+    return frame
+
+
+def synthetic_faces(count, width, height, rng):
+    faces = []
+    for i in range(count):
+        w = h = int(rng.integers(60, 140))
+        x = int(rng.integers(0, width - w))
+        y = int(rng.integers(20, height - h))
+        scores = rng.random(len(EMOTION_ORDER))
+        scores = scores / scores.sum() * 100
+        emotions = dict(zip(EMOTION_ORDER, scores.tolist()))
+        dominant = max(emotions, key=emotions.get)
+        faces.append(((x, y, w, h), f"Person {i + 1}", emotions, dominant))
+    return faces
+
+
+def time_per_frame(draw, background, faces, frames):
+    frame = background.copy()
+    start = time.perf_counter()
+    for _ in range(frames):
+        np.copyto(frame, background)
+        draw(frame, faces)
+    return (time.perf_counter() - start) / frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the emotion overlay drawing.")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--faces", type=int, nargs="+", default=[0, 1, 2, 4, 8])
+    parser.add_argument("--frames", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+    renderer = OverlayRenderer()
+
+    def legacy(frame, faces):
+        result = frame
+        for face in faces:
+            result = legacy_draw_face(result, *face)
+        return result
+
+    def copy_cost(frame, faces):
+        pass  # Only the np.copyto of the background, subtracted below
+
+    print(f"{args.width}x{args.height}, {args.frames} frames per measurement")
+    print(f"{'faces':>5} {'legacy ms':>10} {'renderer ms':>12} {'speedup':>8} {'max diff':>9}")
+    baseline = time_per_frame(copy_cost, background, [], args.frames)
+    for count in args.faces:
+        faces = synthetic_faces(count, args.width, args.height, rng)
+
+        expected = legacy(background.copy(), faces)
+        actual = renderer.draw(background.copy(), faces)
+        max_diff = int(np.abs(expected.astype(np.int16) - actual).max())
+
+        legacy_time = max(time_per_frame(legacy, background, faces, args.frames) - baseline, 0.0)
+        renderer_time = max(time_per_frame(renderer.draw, background, faces, args.frames) - baseline, 0.0)
+        speedup = f"{legacy_time / renderer_time:.1f}x" if renderer_time else "-"
+        print(f"{count:>5} {legacy_time * 1000:>10.3f} {renderer_time * 1000:>12.3f} "
+              f"{speedup:>8} {max_diff:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,485 @@
+"""
+End-to-end benchmark of demo_mode(), analyze_video() and video_overlay.process_video().
+
+Generates a synthetic test video with faces at known boxes and runs each
+pipeline on it in its own process, so peak memory is measured per pipeline.
+The models are either the real DeepFace ones or a stub backend with a fixed
+latency per call, which separates the cost of our own code (capture, tracking,
+overlay, CSV) from the cost of the models.
+
+The stub finds the faces by reading the frame number from a small marker in
+the top-left corner of each frame and looking up the known boxes, so it works
+at any detection width. With --face_image the faces are a real photo instead
+of drawn ellipses, for runs with the real models.
+
+Per pipeline it reports frames/s, p50/p99 frame time, peak RSS and the mean
+time per stage (from metrics.py), and writes everything to a JSON file that
+--compare reads back.
+
+Usage:
+    python benchmarks/bench_pipelines.py [--backend stub|deepface] [--pipelines demo analyze overlay]
+                                         [--frames 300 --width 640 --height 480 --faces 2]
+                                         [--detect_ms 30 --classify_ms 8] [--compare previous.json]
+
+demo_mode() reads the video as fast as it decodes instead of at camera rate,
+so its frames/s is the throughput of the live loop. The window is not shown
+unless --display is given.
+"""
+
+import argparse
+import csv
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(REPO_ROOT)
+import metrics
+from overlay import EMOTION_ORDER
+
+PIPELINES = ("demo", "analyze", "overlay")
+MARKER_BITS = 16
+FACE_COLOR = (140, 170, 215)
+
+
+# -- Synthetic video
+
+def _marker_block(width):
+    return max(8, width // 80)
+
+
+def draw_marker(frame, index):
+    """Writes the frame number as black and white blocks along the top-left edge."""
+    block = _marker_block(frame.shape[1])
+    for bit in range(MARKER_BITS):
+        value = 255 if (index >> bit) & 1 else 0
+        frame[:block, bit * block:(bit + 1) * block] = value
+
+
+def read_marker(image, video_width):
+    """
+    Reads the frame number back, also from a downscaled copy of the frame.
+
+    Returns:
+        int: The frame number.
+    """
+    scale = image.shape[1] / video_width
+    block = _marker_block(video_width) * scale
+    gray = image if image.ndim == 2 else image.mean(axis=2)
+    y = int(block / 2)
+    index = 0
+    for bit in range(MARKER_BITS):
+        if gray[y, int((bit + 0.5) * block)] > 127:
+            index |= 1 << bit
+    return index
+
+
+def face_boxes(index, frames, width, height, faces):
+    """
+    Known face boxes of one frame. Every face moves on its own path within a column,
+    so faces never overlap.
+    """
+    boxes = []
+    column = width / faces
+    w = int(min(column * 0.5, width * 0.2))
+    h = int(w * 1.25)
+    top = 2 * _marker_block(width)
+    for i in range(faces):
+        t = 2 * np.pi * index / max(frames, 1)
+        cx = column * (i + 0.5) + (column - w) * 0.3 * np.sin(t * (i + 1))
+        cy = top + h / 2 + (height - top - h) * (0.5 + 0.4 * np.cos(t * (i + 2)))
+        boxes.append([int(cx - w / 2), int(cy - h / 2), w, h])
+    return boxes
+
+
+def make_video(path, frames=300, width=640, height=480, faces=2, fps=15.0, face_image=None, seed=0):
+    """
+    Writes the synthetic test video.
+
+    Returns:
+        dict: Frame number -> list of (x, y, w, h) face boxes.
+    """
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(40, 90, width, dtype=np.float32)[np.newaxis, :, np.newaxis]
+    noise = rng.normal(0, 6, (height, width, 1)).astype(np.float32)
+    background = np.clip(np.repeat(gradient + noise, 3, axis=2), 0, 255).astype(np.uint8)
+    photo = cv2.imread(face_image) if face_image else None
+    if face_image and photo is None:
+        raise ValueError(f"Could not read face image {face_image}")
+
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    truth = {}
+    for index in range(frames):
+        frame = background.copy()
+        boxes = face_boxes(index, frames, width, height, faces)
+        for x, y, w, h in boxes:
+            if photo is not None:
+                frame[y:y + h, x:x + w] = cv2.resize(photo, (w, h), interpolation=cv2.INTER_AREA)
+            else:
+                center = (x + w // 2, y + h // 2)
+                cv2.ellipse(frame, center, (w // 2, h // 2), 0, 0, 360, FACE_COLOR, -1)
+                for ex in (x + w // 3, x + 2 * w // 3):
+                    cv2.circle(frame, (ex, y + h * 2 // 5), max(2, w // 14), (40, 40, 40), -1)
+                cv2.ellipse(frame, (center[0], y + h * 7 // 10), (w // 5, h // 14), 0, 0, 180, (60, 60, 120), 2)
+        draw_marker(frame, index)
+        out.write(frame)
+        truth[index] = boxes
+    out.release()
+    return truth
+
+
+def write_results_csv(path, video_path, truth, fps):
+    """
+    Writes the known boxes as an offline-emotion-analyzer.py CSV, the input of video_overlay.py.
+    """
+    rng = np.random.default_rng(1)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        f.write(f'# {{"video_path": "{video_path}", "frame_skip": 1, "video_fps": {fps}}}\n')
+        writer = csv.writer(f)
+        writer.writerow(["frame", "time_code", "id", "dominant_emotion", *EMOTION_ORDER,
+                         "face_y", "face_x", "face_height", "face_width", "face_confidence"])
+        for index, boxes in truth.items():
+            for face_id, (x, y, w, h) in enumerate(boxes):
+                scores = rng.random(len(EMOTION_ORDER))
+                scores = 100 * scores / scores.sum()
+                dominant = EMOTION_ORDER[int(np.argmax(scores))]
+                writer.writerow([index, round(index / fps, 4), face_id, dominant,
+                                 *[round(float(s), 2) for s in scores], y, x, h, w, 0.99])
+
+
+# -- Stub model backend
+
+class _StubEmotionModel:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def model(self, batch, training=False):
+        time.sleep(self.latency)
+        # Deterministic scores from the brightness of each crop
+        brightness = batch.reshape(len(batch), -1).mean(axis=1)
+        scores = np.ones((len(batch), len(EMOTION_ORDER)), dtype=np.float32)
+        scores[np.arange(len(batch)), (brightness * 100).astype(int) % len(EMOTION_ORDER)] += 5
+        return scores / scores.sum(axis=1, keepdims=True)
+
+
+class StubDeepFace:
+    """
+    Stands in for the DeepFace module in pipeline.py and model_registry.py. Each call
+    sleeps for a fixed time; face boxes come from the known boxes of the video.
+
+    Args:
+        truth (dict): Frame number -> face boxes, from make_video().
+        video_width (int): Width of the video, to map boxes onto downscaled frames.
+        detect_latency (float): Seconds per extract_faces() call.
+        classify_latency (float): Seconds per emotion model call (one batch).
+    """
+
+    def __init__(self, truth, video_width, detect_latency=0.03, classify_latency=0.008):
+        self.truth = truth
+        self.video_width = video_width
+        self.detect_latency = detect_latency
+        self.classify_latency = classify_latency
+        self.emotion = _StubEmotionModel(classify_latency)
+
+    def build_model(self, model_name, task=None):
+        return self.emotion if task == "facial_attribute" else object()
+
+    def extract_faces(self, img_path, detector_backend=None, enforce_detection=True, align=True, **kwargs):
+        time.sleep(self.detect_latency)
+        image = img_path
+        height, width = image.shape[:2]
+        scale = width / self.video_width
+        faces = []
+        for x, y, w, h in self.truth.get(read_marker(image, self.video_width), []):
+            x, y, w, h = (int(round(v * scale)) for v in (x, y, w, h))
+            crop = image[max(0, y):y + h, max(0, x):x + w]
+            if crop.size == 0:
+                continue
+            faces.append({"face": crop[:, :, ::-1].astype(np.float32) / 255,
+                          "facial_area": {"x": x, "y": y, "w": w, "h": h}, "confidence": 0.99})
+        if not faces:
+            # Like DeepFace with enforce_detection=False: the whole image, confidence 0
+            faces.append({"face": image[:, :, ::-1].astype(np.float32) / 255,
+                          "facial_area": {"x": 0, "y": 0, "w": width, "h": height}, "confidence": 0})
+        return faces
+
+    def analyze(self, img_path, actions=("emotion",), **kwargs):
+        scores = self.emotion.model(_emotion_batch([img_path]))[0]
+        emotion = {label: float(100 * s) for label, s in zip(EMOTION_ORDER, scores)}
+        return [{"emotion": emotion, "dominant_emotion": max(emotion, key=emotion.get)}]
+
+    def represent(self, img_path, model_name=None, **kwargs):
+        time.sleep(self.classify_latency)
+        return [{"embedding": [0.0] * 128}]
+
+
+def _emotion_batch(faces):
+    return np.stack([cv2.resize(cv2.cvtColor(face, cv2.COLOR_BGR2GRAY), (48, 48)) / 255.0
+                     for face in faces])[..., np.newaxis]
+
+
+def install_stub(stub):
+    import model_registry
+    import pipeline
+    pipeline.DeepFace = stub
+    model_registry.DeepFace = stub
+
+
+# -- Running one pipeline
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def _load_offline_module(filename, name):
+    path = os.path.join(REPO_ROOT, "Offline analysis", filename)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def box_recall(csv_path, truth, min_iou=0.5):
+    """Share of the known face boxes that analyze_video() found, at IoU >= min_iou."""
+    found = {}
+    with open(csv_path, newline="") as f:
+        f.readline()  # Metadata line
+        for row in csv.DictReader(f):
+            box = [int(row[k]) for k in ("face_x", "face_y", "face_width", "face_height")]
+            found.setdefault(int(row["frame"]), []).append(box)
+
+    def iou(a, b):
+        ix = max(0, min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0]))
+        iy = max(0, min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1]))
+        inter = ix * iy
+        return inter / (a[2] * a[3] + b[2] * b[3] - inter)
+
+    total = hits = 0
+    for index, boxes in found.items():
+        for known in truth.get(index, []):
+            total += 1
+            hits += any(iou(known, box) >= min_iou for box in boxes)
+    return hits / total if total else 0.0
+
+
+def run_pipeline(name, config, conn):
+    """
+    Runs one pipeline in this (child) process and sends its measurements through conn.
+    """
+    workdir = config["workdir"]
+    truth = {int(k): v for k, v in config["truth"].items()}
+    result = {"pipeline": name}
+    try:
+        with open(os.path.join(workdir, f"{name}.log"), "w") as log, redirect_stdout(log):
+            if config["backend"] == "stub":
+                install_stub(StubDeepFace(truth, config["width"], config["detect_ms"] / 1000,
+                                          config["classify_ms"] / 1000))
+            if not config["display"]:
+                cv2.imshow = lambda *args: None
+                cv2.waitKey = lambda delay=0: -1
+                cv2.destroyAllWindows = lambda: None
+
+            # One tick per frame, from the frames_processed counter every pipeline increments
+            ticks = []
+            count_frame = metrics.inc
+
+            def inc(counter, amount=1, **labels):
+                if counter == "frames_processed":
+                    ticks.append(time.perf_counter())
+                count_frame(counter, amount, **labels)
+
+            metrics.inc = inc
+            metrics.enable()
+            result["peak_rss_before_mb"] = peak_rss_mb()
+
+            if name == "demo":
+                from recognition import demo_mode
+                demo_mode(source=config["video"], detector_backend=config["detector_backend"],
+                          detect_every=config["detect_every"], identify=False)
+            elif name == "analyze":
+                analyzer = _load_offline_module("offline-emotion-analyzer.py", "offline_emotion_analyzer")
+                output_csv = os.path.join(workdir, "analyze.csv")
+                analyzer.analyze_video(config["video"], output_csv, frame_skip=1,
+                                       detector_backend=config["detector_backend"],
+                                       detect_every=config["detect_every"])
+                if os.path.exists(output_csv):
+                    result["box_recall"] = round(box_recall(output_csv, truth), 4)
+            else:
+                sys.path.append(os.path.join(REPO_ROOT, "Offline analysis"))
+                import video_overlay
+                video_overlay.process_video(config["video"], video_overlay.parse_csv(config["csv"]), None,
+                                            os.path.join(workdir, "overlay.mp4"))
+
+        result["peak_rss_mb"] = peak_rss_mb()
+        result.update(summarize(ticks))
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    conn.send(result)
+    conn.close()
+
+
+def summarize(ticks):
+    """
+    Frame rate and frame-time percentiles from the per-frame ticks, plus the mean
+    time per stage and the counters recorded by metrics.py.
+    """
+    summary = {"frames": len(ticks)}
+    if len(ticks) >= 2:
+        intervals = np.diff(ticks) * 1000
+        summary["seconds"] = round(ticks[-1] - ticks[0], 3)
+        summary["fps"] = round((len(ticks) - 1) / (ticks[-1] - ticks[0]), 2)
+        summary["frame_ms"] = {
+            "p50": round(float(np.percentile(intervals, 50)), 3),
+            "p99": round(float(np.percentile(intervals, 99)), 3),
+            "mean": round(float(intervals.mean()), 3),
+            "max": round(float(intervals.max()), 3),
+        }
+    stages, counters = {}, {}
+    for series in metrics.registry.series():
+        if isinstance(series, metrics.Counter):
+            label = "".join(f"[{value}]" for _, value in series.labels)
+            counters[series.name + label] = series.snapshot()
+        elif series.name == "stage_seconds":
+            _, total, count = series.snapshot()
+            if count:
+                stages[dict(series.labels)["stage"]] = {"count": count, "mean_ms": round(1000 * total / count, 3)}
+    summary["stages"] = stages
+    summary["counters"] = counters
+    return summary
+
+
+def run_isolated(name, config):
+    context = multiprocessing.get_context("spawn")
+    parent, child = context.Pipe(duplex=False)
+    process = context.Process(target=run_pipeline, args=(name, config, child), name=f"bench-{name}")
+    process.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = {"pipeline": name, "error": f"process exited with code {process.exitcode}"}
+    process.join()
+    return result
+
+
+# -- Reporting
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print(f"{'pipeline':>9} {'frames':>7} {'fps':>8} {'p50 ms':>8} {'p99 ms':>8} {'peak RSS MB':>12}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['pipeline']:>9} failed: {r['error']}")
+            continue
+        ms = r.get("frame_ms", {})
+        print(f"{r['pipeline']:>9} {r['frames']:>7} {r.get('fps', 0):>8.1f} {ms.get('p50', 0):>8.1f} "
+              f"{ms.get('p99', 0):>8.1f} {r['peak_rss_mb']:>12.0f}")
+        stages = ", ".join(f"{stage} {s['mean_ms']:.1f}" for stage, s in r["stages"].items())
+        if stages:
+            print(f"{'':>9} stage means (ms): {stages}")
+        if "box_recall" in r:
+            print(f"{'':>9} box recall: {r['box_recall']:.1%}")
+
+
+def compare(results, previous_path):
+    with open(previous_path) as f:
+        previous = {r["pipeline"]: r for r in json.load(f)["results"]}
+    print(f"Compared with {previous_path}:")
+    for r in results:
+        old = previous.get(r["pipeline"])
+        if old is None or "fps" not in old or "fps" not in r:
+            continue
+        fps_change = 100 * (r["fps"] / old["fps"] - 1)
+        print(f"{r['pipeline']:>9} fps {old['fps']:.1f} -> {r['fps']:.1f} ({fps_change:+.1f}%), "
+              f"p99 {old['frame_ms']['p99']:.1f} -> {r['frame_ms']['p99']:.1f} ms, "
+              f"peak RSS {old['peak_rss_mb']:.0f} -> {r['peak_rss_mb']:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the live and offline pipelines on a synthetic video.")
+    parser.add_argument("--pipelines", nargs="+", choices=PIPELINES, default=list(PIPELINES))
+    parser.add_argument("--backend", choices=("stub", "deepface"), default="stub",
+                        help="Fixed-latency stub models or the real DeepFace models.")
+    parser.add_argument("--detector_backend", default="opencv", help="DeepFace detector for --backend deepface.")
+    parser.add_argument("--detect_every", type=int, default=3, help="Run the detector every n:th analysis.")
+    parser.add_argument("--detect_ms", type=float, default=30.0, help="Stub latency per detector call.")
+    parser.add_argument("--classify_ms", type=float, default=8.0, help="Stub latency per emotion batch.")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--faces", type=int, default=2)
+    parser.add_argument("--fps", type=float, default=15.0, help="Frame rate written to the test video.")
+    parser.add_argument("--face_image", default=None, help="Photo used for the faces instead of drawn ellipses.")
+    parser.add_argument("--display", action="store_true", help="Show the demo_mode() window.")
+    parser.add_argument("--output", default=None, help="JSON results file, default benchmarks/results/<time>.json.")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare with.")
+    parser.add_argument("--keep", action="store_true", help="Keep the test video and pipeline logs.")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="epi-bench-")
+    video = os.path.join(workdir, "synthetic.avi")
+    start = time.perf_counter()
+    truth = make_video(video, args.frames, args.width, args.height, args.faces, args.fps, args.face_image)
+    results_csv = os.path.join(workdir, "synthetic.csv")
+    write_results_csv(results_csv, video, truth, args.fps)
+    print(f"Test video: {args.frames} frames, {args.width}x{args.height}, {args.faces} faces "
+          f"({time.perf_counter() - start:.1f} s to generate). Backend: {args.backend}")
+
+    config = dict(vars(args), workdir=workdir, video=video, csv=results_csv, truth=truth)
+    results = []
+    for name in args.pipelines:
+        print(f"Running {name}...")
+        results.append(run_isolated(name, config))
+    print_results(results)
+
+    output = args.output or os.path.join(REPO_ROOT, "benchmarks", "results",
+                                         f"pipelines-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    settings = {k: v for k, v in vars(args).items() if k not in ("output", "compare", "keep", "display")}
+    with open(output, "w") as f:
+        json.dump({
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "platform": platform.platform(),
+            "settings": settings,
+            "results": results,
+        }, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+    if args.keep:
+        print(f"Video and logs kept in {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
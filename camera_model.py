@@ -0,0 +1,141 @@
+"""
+Vectorized pixel-to-angle conversion for head control.
+
+coordinate_modification() in recognition.py handles one face at a time and
+has the 640x480 / 62.2x48.8 degree sensor hard-coded. CameraModel holds
+configurable intrinsics, including an optional radial lens-distortion term,
+and a precomputed per-pixel table of pan/tilt offsets.
+coordinate_modification_batch() works on NumPy arrays of face centres (all
+faces of all frames at once). Without distortion it returns exactly the same
+clamped values as the scalar version.
+
+Usage (replaying an offline analysis CSV):
+    python camera_model.py <analysis.csv> --width 1920 --height 1080
+"""
+
+import argparse
+
+import numpy as np
+
+# Epi movement limitations in degrees (min, max), as in coordinate_modification
+PAN_LIMIT = (-35, 40)
+TILT_LIMIT = (-15, 30)
+
+
+class CameraModel:
+    """
+    Camera intrinsics and a pixel-to-angle lookup.
+
+    The angle of a pixel is its offset from the image centre times degrees per
+    pixel, scaled by (1 + k1 * r^2) where r is the distance from the centre in
+    half-image units. k1 > 0 corrects barrel distortion (edges are further out
+    than they look), k1 < 0 pincushion distortion.
+
+    Args:
+        width, height (int): Frame size in pixels.
+        fov_width, fov_height (float): Field of view in degrees.
+        k1 (float): Radial distortion coefficient, 0 for an ideal lens.
+        precompute (bool): Build the per-pixel lookup table now instead of on first use.
+    """
+
+    def __init__(self, width=640, height=480, fov_width=62.2, fov_height=48.8, k1=0.0, precompute=False):
+        self.width = width
+        self.height = height
+        self.fov_width = fov_width
+        self.fov_height = fov_height
+        self.k1 = k1
+        self.horizontal_degrees_per_pixel = fov_width / width
+        self.vertical_degrees_per_pixel = fov_height / height
+        self._pan_table = None
+        self._tilt_table = None
+        if precompute:
+            self._build_tables()
+
+    def _angles(self, x, y):
+        # Same arithmetic as coordinate_modification, so results match exactly when k1 == 0
+        horizontal_offset = x - self.width / 2
+        vertical_offset = y - self.height / 2
+        pan = horizontal_offset * self.horizontal_degrees_per_pixel
+        tilt = vertical_offset * self.vertical_degrees_per_pixel
+        if self.k1:
+            r2 = (horizontal_offset / (self.width / 2)) ** 2 + (vertical_offset / (self.height / 2)) ** 2
+            factor = 1 + self.k1 * r2
+            pan = pan * factor
+            tilt = tilt * factor
+        return pan, tilt
+
+    def _build_tables(self):
+        ys, xs = np.mgrid[0:self.height, 0:self.width]
+        self._pan_table, self._tilt_table = self._angles(xs.astype(np.float64), ys.astype(np.float64))
+
+    def pixel_to_degrees(self, x, y):
+        """
+        Angle offsets from the optical axis for pixel positions.
+
+        Integer positions inside the frame are looked up in the precomputed table,
+        anything else (sub-pixel or outside the frame) is computed directly; both
+        give the same values.
+
+        Args:
+            x, y: Scalars or arrays of pixel coordinates.
+
+        Returns:
+            tuple: (pan, tilt) arrays of unrounded degrees.
+        """
+        x = np.asarray(x)
+        y = np.asarray(y)
+        if (np.issubdtype(x.dtype, np.integer) and np.issubdtype(y.dtype, np.integer)
+                and x.size and x.min() >= 0 and x.max() < self.width
+                and y.min() >= 0 and y.max() < self.height):
+            if self._pan_table is None:
+                self._build_tables()
+            return self._pan_table[y, x], self._tilt_table[y, x]
+        return self._angles(x.astype(np.float64), y.astype(np.float64))
+
+
+DEFAULT_CAMERA = CameraModel()
+
+
+def coordinate_modification_batch(x, y, current_pan, current_tilt, camera=DEFAULT_CAMERA,
+                                  pan_limit=PAN_LIMIT, tilt_limit=TILT_LIMIT):
+    """
+    Vectorized coordinate_modification.
+
+    Args:
+        x, y: Arrays (any shape) of face centres in pixels.
+        current_pan, current_tilt: Epi's current position in degrees, scalars or arrays
+            that broadcast against x and y.
+        camera (CameraModel): Frame size, field of view and distortion.
+        pan_limit, tilt_limit (tuple): (min, max) in degrees.
+
+    Returns:
+        tuple: (target_pan, target_tilt) arrays of absolute degrees, rounded and clamped
+        like coordinate_modification.
+    """
+    pan_adjust, tilt_adjust = camera.pixel_to_degrees(x, y)
+    target_pan = np.asarray(current_pan) + np.round(pan_adjust)
+    target_tilt = np.asarray(current_tilt) + np.round(tilt_adjust)
+    return np.clip(target_pan, *pan_limit), np.clip(target_tilt, *tilt_limit)
+
+
+if __name__ == "__main__":
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Compute head targets for every face in an offline analysis CSV.")
+    parser.add_argument("csv", help="CSV written by offline-emotion-analyzer.py.")
+    parser.add_argument("--width", type=int, default=640, help="Video width in pixels.")
+    parser.add_argument("--height", type=int, default=480, help="Video height in pixels.")
+    parser.add_argument("--k1", type=float, default=0.0, help="Radial distortion coefficient.")
+    parser.add_argument("--output", default=None, help="Where to write the CSV with target_pan/target_tilt columns.")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.csv, comment='#')
+    camera = CameraModel(args.width, args.height, k1=args.k1)
+    centre_x = (df["face_x"] + df["face_width"] // 2).to_numpy()
+    centre_y = (df["face_y"] + df["face_height"] // 2).to_numpy()
+    df["target_pan"], df["target_tilt"] = coordinate_modification_batch(centre_x, centre_y, 0, 0, camera)
+
+    output = args.output or args.csv[:-4] + "_head.csv"
+    df.to_csv(output, index=False)
+    print(f"{len(df)} faces, pan {df['target_pan'].min():.0f}..{df['target_pan'].max():.0f}, "
+          f"tilt {df['target_tilt'].min():.0f}..{df['target_tilt'].max():.0f}. Saved to {output}")
@@ -0,0 +1,187 @@
+"""
+Threaded frame capture for the live loops.
+
+cv2.VideoCapture buffers frames internally, so if the loop that calls
+cap.read() is busy with DeepFace the MJPEG stream backs up and every frame we
+get is already seconds old. LatestFrameReader reads the source on its own
+thread and only keeps the newest frame, dropping the ones nobody asked for.
+"""
+
+import threading
+import time
+
+import cv2
+
+import metrics
+from frame_bus import FrameBusReader
+from mjpeg_client import MJPEGClient
+
+
+class LatestFrameReader:
+    """
+    Reads a video source on a background thread into a single-slot buffer.
+
+    Usage mirrors cv2.VideoCapture:
+
+        reader = LatestFrameReader(0)
+        if reader.start():
+            ret, frame = reader.read()
+            ...
+            cv2.imshow('Live Stream', frame)
+            reader.mark_displayed()
+        reader.release()
+
+    Args:
+        source: Anything cv2.VideoCapture accepts (webcam index, stream URL or file path),
+            or "bus:<name>" to read from a frame bus (frame_bus.py) shared with other processes.
+            http(s) URLs are read with MJPEGClient, which reconnects when the stream drops.
+        reduction (int): For http(s) sources, decode at 1/2, 1/4 or 1/8 size (2, 4 or 8).
+    """
+
+    def __init__(self, source, reduction=1):
+        self.source = source
+        self.reduction = reduction
+        self.cap = None
+
+        self._lock = threading.Lock()
+        self._new_frame = threading.Condition(self._lock)
+        self._thread = None
+        self._running = False
+
+        # Single-slot buffer
+        self._frame = None
+        self._frame_time = 0.0
+        self._seq = 0            # Sequence number of the frame in the slot
+        self._read_seq = 0       # Sequence number of the last frame handed out
+        self._read_frame_time = 0.0
+        self.failed = False
+
+        # Statistics
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        self.frames_displayed = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self._latency_sum = 0.0
+
+    def start(self):
+        """
+        Opens the source and starts the reader thread.
+
+        Returns:
+            bool: True if the source could be opened.
+        """
+        if isinstance(self.source, str) and self.source.startswith("bus:"):
+            self.cap = FrameBusReader(self.source[4:])
+        elif isinstance(self.source, str) and self.source.startswith(("http://", "https://")):
+            self.cap = MJPEGClient(self.source, reduction=self.reduction)
+        else:
+            self.cap = cv2.VideoCapture(self.source)
+        if not self.cap.isOpened():
+            print(f"Could not open video source: {self.source}")
+            return False
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="frame-reader", daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self):
+        while self._running:
+            start = time.perf_counter()
+            ret, frame = self.cap.read()
+            if not ret:
+                print("Failed to retrieve frame from the video source.")
+                with self._lock:
+                    self.failed = True
+                    self._new_frame.notify_all()
+                return
+
+            captured_at = time.time()
+            # Waiting for the source, plus decoding for cv2.VideoCapture sources
+            metrics.observe_stage('capture', time.perf_counter() - start)
+            metrics.inc('frames_captured')
+            with self._lock:
+                # The previous frame was overwritten before anyone read it
+                if self._seq > self._read_seq:
+                    self.frames_dropped += 1
+                    metrics.inc('frames_dropped', where='reader')
+                self._frame = frame
+                self._frame_time = captured_at
+                self._seq += 1
+                self.frames_captured += 1
+                self._new_frame.notify_all()
+
+    def read(self, timeout=None):
+        """
+        Returns the newest frame that has not been returned before, waiting for
+        the reader thread if no new frame has arrived yet.
+
+        Args:
+            timeout (float): Seconds to wait for a new frame, None waits forever.
+
+        Returns:
+            tuple: (ret, frame) like cv2.VideoCapture.read(). ret is False when the
+            source failed, the reader was released or the timeout ran out.
+        """
+        with self._lock:
+            self._new_frame.wait_for(
+                lambda: self._seq > self._read_seq or self.failed or not self._running,
+                timeout
+            )
+            if self._seq == self._read_seq:
+                return False, None
+
+            self._read_seq = self._seq
+            self._read_frame_time = self._frame_time
+            return True, self._frame
+
+    @property
+    def frame_time(self):
+        """time.time() when the frame last returned by read() was captured."""
+        return self._read_frame_time
+
+    def mark_displayed(self):
+        """
+        Records the capture-to-display latency of the frame last returned by read().
+        Call this right after cv2.imshow.
+        """
+        latency = time.time() - self._read_frame_time
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self._latency_sum += latency
+        self.frames_displayed += 1
+        metrics.observe('frame_latency_seconds', latency, metrics.LATENCY_BUCKETS)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Captured, dropped and displayed frame counts plus latencies in seconds.
+        """
+        displayed = self.frames_displayed
+        return {
+            "frames_captured": self.frames_captured,
+            "frames_dropped": self.frames_dropped,
+            "frames_displayed": displayed,
+            "last_latency": self.last_latency,
+            "mean_latency": self._latency_sum / displayed if displayed else 0.0,
+            "max_latency": self.max_latency,
+        }
+
+    def print_stats(self):
+        s = self.stats()
+        print(f"Frames captured: {s['frames_captured']}, dropped: {s['frames_dropped']}, "
+              f"displayed: {s['frames_displayed']}. Capture-to-display latency "
+              f"mean: {s['mean_latency'] * 1000:.1f} ms, max: {s['max_latency'] * 1000:.1f} ms")
+
+    def release(self):
+        """
+        Stops the reader thread and releases the underlying capture.
+        """
+        with self._lock:
+            self._running = False
+            self._new_frame.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+        if self.cap is not None:
+            self.cap.release()
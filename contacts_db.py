@@ -0,0 +1,217 @@
+"""
+Contact registry: contact id -> name, in SQLite.
+
+contacts.csv was re-opened and scanned line by line for every id lookup, and
+with 4 hex characters per id, collisions (and rescans) became more likely the
+more people were enrolled. The registry keeps the contacts in a SQLite table
+with indexes on id and name:
+
+    contacts.db     contacts(id PRIMARY KEY, name, creation_time), index on name
+
+New ids are 12 hex characters (48 random bits). The primary key makes an
+insert fail rather than reuse an id, in which case a new id is drawn, so ids
+are unique even when several enrollments (mov-to-db.py) run at the same time.
+Concurrent writers wait for each other (WAL journal, busy timeout).
+
+An existing contacts.csv is imported the first time the registry is opened,
+keeping the old 4-character ids. The CSV file itself is left untouched.
+
+Usage:
+    python contacts_db.py list
+    python contacts_db.py find <name>
+    python contacts_db.py export contacts.csv
+"""
+
+import argparse
+import csv
+import os
+import secrets
+import sqlite3
+import threading
+from datetime import datetime
+
+DB_FILE = "./contacts.db"
+CSV_FILE = "./contacts.csv"
+ID_BYTES = 6  # 12 hex characters
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS contacts (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    creation_time TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS contacts_name ON contacts (name);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class ContactRegistry:
+    """
+    Args:
+        path (str): SQLite database file, created if missing.
+        csv_file (str): contacts.csv to import once, None to skip the import.
+        timeout (float): Seconds to wait for another process that is writing.
+    """
+
+    def __init__(self, path=DB_FILE, csv_file=CSV_FILE, timeout=30.0):
+        self.path = path
+        self._lock = threading.Lock()
+        # Autocommit; transactions are opened explicitly where several statements belong together
+        self._conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        if csv_file:
+            self._import_csv(csv_file)
+
+    def _import_csv(self, csv_file):
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM meta WHERE key = 'csv_imported'").fetchone():
+                return
+            # The write lock makes sure only one process imports
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._conn.execute("SELECT 1 FROM meta WHERE key = 'csv_imported'").fetchone() is None:
+                    imported = 0
+                    if os.path.exists(csv_file):
+                        with open(csv_file, mode='r', newline='') as file:
+                            reader = csv.reader(file)
+                            next(reader, None)  # Skip the header row
+                            rows = [(row[0], row[1], row[2] if len(row) > 2 else "")
+                                    for row in reader if len(row) >= 2]
+                        imported = self._conn.executemany(
+                            "INSERT OR IGNORE INTO contacts (id, name, creation_time) VALUES (?, ?, ?)", rows
+                        ).rowcount
+                        print(f"Imported {imported} contacts from {csv_file} into {self.path}")
+                    self._conn.execute("INSERT INTO meta (key, value) VALUES ('csv_imported', ?)",
+                                       (f"{csv_file}: {imported}",))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def add(self, name, contact_id=None):
+        """
+        Adds a contact with the current time as creation time.
+
+        Args:
+            name (str): Name of the contact.
+            contact_id (str): Id to use, None for a new random one.
+
+        Returns:
+            str: The contact's id.
+
+        Raises:
+            sqlite3.IntegrityError: If `contact_id` is given and already taken.
+        """
+        creation_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        while True:
+            new_id = contact_id or secrets.token_hex(ID_BYTES)
+            try:
+                with self._lock:
+                    self._conn.execute("INSERT INTO contacts (id, name, creation_time) VALUES (?, ?, ?)",
+                                       (new_id, name, creation_time))
+                return new_id
+            except sqlite3.IntegrityError:
+                if contact_id:
+                    raise
+                # Taken, draw another id
+
+    def remove(self, contact_id):
+        """
+        Returns:
+            bool: True if the contact existed.
+        """
+        with self._lock:
+            return self._conn.execute("DELETE FROM contacts WHERE id = ?", (contact_id,)).rowcount > 0
+
+    def get(self, contact_id):
+        """
+        Returns:
+            dict: 'id', 'name' and 'creation_time', or None if there is no such contact.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT id, name, creation_time FROM contacts WHERE id = ?",
+                                     (contact_id,)).fetchone()
+        return None if row is None else dict(zip(("id", "name", "creation_time"), row))
+
+    def name(self, contact_id):
+        """
+        Returns:
+            str: The contact's name, or None if there is no such contact.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT name FROM contacts WHERE id = ?", (contact_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def exists(self, contact_id):
+        return self.name(contact_id) is not None
+
+    def find(self, name):
+        """
+        Returns:
+            list: Contacts with exactly this name, oldest first, as dicts like get().
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT id, name, creation_time FROM contacts WHERE name = ? "
+                                      "ORDER BY creation_time", (name,)).fetchall()
+        return [dict(zip(("id", "name", "creation_time"), row)) for row in rows]
+
+    def names(self):
+        """
+        Returns:
+            dict: Contact id -> name for all contacts.
+        """
+        with self._lock:
+            return dict(self._conn.execute("SELECT id, name FROM contacts").fetchall())
+
+    def contacts(self):
+        """
+        Returns:
+            list: All contacts as dicts like get(), oldest first.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT id, name, creation_time FROM contacts "
+                                      "ORDER BY creation_time").fetchall()
+        return [dict(zip(("id", "name", "creation_time"), row)) for row in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM contacts").fetchone()[0]
+
+    def export_csv(self, csv_file):
+        """Writes the contacts in the old contacts.csv format."""
+        with open(csv_file, mode='w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(["id", "name", "creation_time"])
+            for contact in self.contacts():
+                writer.writerow([contact["id"], contact["name"], contact["creation_time"]])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List, search or export the contact registry.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="Show all contacts.")
+    find_parser = subparsers.add_parser("find", help="Show the contacts with a name.")
+    find_parser.add_argument("name")
+    export_parser = subparsers.add_parser("export", help="Write the contacts to a CSV file.")
+    export_parser.add_argument("csv_file")
+    parser.add_argument("--db", default=DB_FILE, help="Registry database file.")
+    args = parser.parse_args()
+
+    registry = ContactRegistry(args.db)
+    if args.command == "export":
+        registry.export_csv(args.csv_file)
+        print(f"Exported {len(registry)} contacts to {args.csv_file}")
+    else:
+        contacts = registry.contacts() if args.command == "list" else registry.find(args.name)
+        for contact in contacts:
+            print(f"{contact['id']}  {contact['name']}  {contact['creation_time']}")
+        print(f"{len(contacts)} contacts")
+    registry.close()
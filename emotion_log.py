@@ -0,0 +1,233 @@
+"""
+Append-only log of live emotion results.
+
+write_to_json() reloads and rewrites all of people.json on every call, so
+each write costs as much as the whole history. EmotionLog writes JSON Lines
+instead: one record per line, appended from an in-memory buffer that a
+background thread flushes every `flush_interval` seconds, also when no new
+records arrive. The file is rotated when it grows past
+`max_bytes` or gets older than `max_age`, and tail_records() reads the newest
+records from the end of the files without parsing the rest.
+
+File layout, for path='people.jsonl':
+
+    people.jsonl                    current file
+    people.20241210-141503.jsonl    rotated files, named after their rotation time
+    people.20241210-141503-1.jsonl  rotated later in the same second
+"""
+
+import glob
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+import metrics
+
+
+class EmotionLog:
+    """
+    Buffered, rotating JSON Lines writer.
+
+    Args:
+        path (str): Path of the current log file.
+        flush_interval (float): Seconds between writes to disk. 0 writes on every append.
+        max_bytes (int): Rotate when the current file grows beyond this size. None disables.
+        max_age (float): Rotate when the current file is older than this many seconds. None disables.
+        max_files (int): Number of rotated files to keep, older ones are deleted. None keeps all.
+    """
+
+    def __init__(self, path="people.jsonl", flush_interval=1.0, max_bytes=10 * 1024 * 1024,
+                 max_age=24 * 3600, max_files=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_files = max_files
+
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._last_flush = time.time()
+        self._file = None
+        self._opened_at = None
+        self._size = 0
+        self._closed = threading.Event()
+        self._flusher = None
+        if flush_interval > 0:
+            self._flusher = threading.Thread(target=self._run_flusher, name="emotion-log-flush", daemon=True)
+            self._flusher.start()
+
+    def _run_flusher(self):
+        # Writes what append() buffered once it is due, even if no more records come in
+        while not self._closed.wait(self.flush_interval):
+            with self._lock:
+                if self._buffer and time.time() - self._last_flush >= self.flush_interval:
+                    self._flush_locked()
+
+    def _open(self):
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._size = self._file.tell()
+        # Age counts from the first record in the file, so restarts don't reset it
+        self._opened_at = _first_record_time(self.path) if self._size else time.time()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        base, ext = os.path.splitext(self.path)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        target = f"{base}.{stamp}{ext}"
+        counter = 1
+        while os.path.exists(target):
+            target = f"{base}.{stamp}-{counter}{ext}"
+            counter += 1
+        os.replace(self.path, target)
+
+        if self.max_files is not None:
+            for old in rotated_files(self.path)[self.max_files:]:
+                os.remove(old)
+        self._open()
+
+    def _rotation_due(self):
+        if self._size == 0:
+            return False
+        if self.max_bytes is not None and self._size >= self.max_bytes:
+            return True
+        return self.max_age is not None and time.time() - self._opened_at >= self.max_age
+
+    def append(self, records):
+        """
+        Adds records to the log. Each record gets a "Time" field (seconds since the epoch)
+        unless it already has one.
+
+        Args:
+            records (list): Dicts that can be serialised to JSON.
+        """
+        now = time.time()
+        lines = []
+        for record in records:
+            if "Time" not in record:
+                record = dict(record, Time=round(now, 3))
+            lines.append(json.dumps(record, separators=(",", ":")) + "\n")
+
+        with self._lock:
+            self._buffer.extend(lines)
+            if now - self._last_flush >= self.flush_interval:
+                self._flush_locked()
+
+    def flush(self):
+        """
+        Writes buffered records to disk.
+        """
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self._last_flush = time.time()
+        if not self._buffer:
+            return
+        with metrics.timer('log'):
+            try:
+                if self._file is None:
+                    self._open()
+                if self._rotation_due():  # Also a file that was already due before a restart
+                    self._rotate()
+                data = "".join(self._buffer)
+                self._file.write(data)
+                self._file.flush()
+                self._size += len(data.encode("utf-8"))
+                self._buffer.clear()
+            except OSError as e:
+                print(f"An error occurred while writing to the emotion log: {e}")
+
+    def close(self):
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        with self._lock:
+            self._flush_locked()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _first_record_time(path):
+    """
+    Returns:
+        float: "Time" of the first record in the file, or its modification time if that can't be read.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            first = json.loads(f.readline())
+        if isinstance(first.get("Time"), (int, float)):
+            return first["Time"]
+    except (OSError, ValueError, AttributeError):
+        pass
+    return os.path.getmtime(path)
+
+
+def rotated_files(path):
+    """
+    Returns:
+        list: Rotated log files belonging to path, newest first.
+    """
+    base, ext = os.path.splitext(path)
+    # <base>.<stamp><ext>, then <base>.<stamp>-1<ext>, -2, ... for rotations within the same second
+    pattern = re.compile(re.escape(base) + r"\.(\d{8}-\d{6})(?:-(\d+))?" + re.escape(ext) + "$")
+    rotated = []
+    for name in glob.glob(f"{glob.escape(base)}.*{glob.escape(ext)}"):
+        match = pattern.match(name)
+        if match:
+            rotated.append(((match.group(1), int(match.group(2) or 0)), name))
+    return [name for _, name in sorted(rotated, reverse=True)]
+
+
+def _reverse_lines(path, block_size=64 * 1024):
+    """
+    Yields the non-empty lines of a file from the last to the first, reading it in blocks
+    from the end.
+    """
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        remainder = b""
+        while position > 0:
+            start = max(0, position - block_size)
+            f.seek(start)
+            lines = (f.read(position - start) + remainder).split(b"\n")
+            position = start
+            # The first piece may be the end of a line in the previous block
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line.strip():
+                    yield line
+        if remainder.strip():
+            yield remainder
+
+
+def tail_records(path="people.jsonl", n=10, predicate=None):
+    """
+    Reads the most recent records, including rotated files if needed.
+
+    Args:
+        path (str): Path of the current log file.
+        n (int): Number of records to return.
+        predicate (callable): Optional filter, only records where predicate(record) is true count.
+
+    Returns:
+        list: Up to n records, oldest first.
+    """
+    records = []
+    files = [path] if os.path.exists(path) else []
+    for file_path in files + rotated_files(path):
+        for line in _reverse_lines(file_path):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Partially written line
+            if predicate is None or predicate(record):
+                records.append(record)
+                if len(records) >= n:
+                    return records[::-1]
+    return records[::-1]
@@ -0,0 +1,463 @@
+"""
+Face embedding index over the db/<id>/ folders written by mov-to-db.py.
+
+DeepFace.find scans the image folder on every call, keeps its representations
+in a pickle that is rebuilt whenever the folder changes, and compares the
+query against every image in a Python-level loop. FaceIndex stores one
+L2-normalised embedding per enrolled image in a contiguous float32 file that
+is memory-mapped for searching, with the identity of every row in a JSON
+Lines file next to it:
+
+    db/.index/Facenet.f32           float32 rows, (count, dim)
+    db/.index/Facenet.labels.jsonl  {"id": ..., "source": ...} per row
+    db/.index/Facenet.json          {"model": ..., "dim": ...}
+    db/.index/Facenet.lock          held while a process changes the index
+
+A lookup is one matrix-vector product. With use_centroids=True the query is
+compared against one mean embedding per identity instead, which keeps lookups
+well under a millisecond for thousands of enrolled people.
+
+Several processes can change the index at the same time (e.g. enrollments
+running in parallel): add() and remove() hold an exclusive lock on the lock
+file and work from what is on disk, not from what this process loaded. Rows
+another process has mapped are never truncated; remove() replaces the files,
+so readers keep their old mapping until they refresh(). load() and refresh()
+hold a shared lock, so they never see the new matrix with the old labels.
+
+Usage:
+    python face_index.py sync [--db ./db] [--model Facenet]
+    python face_index.py find <image> [--db ./db] [--model Facenet]
+"""
+
+import argparse
+import json
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+from deepface import DeepFace
+from deepface.modules.verification import find_threshold
+
+DB_PATH = "./db"
+INDEX_DIR = ".index"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def _normalize(embeddings):
+    embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def represent_face(face, model_name="Facenet"):
+    """
+    Embedding of an already cropped face.
+
+    Args:
+        face: BGR uint8 crop, e.g. from pipeline.detect_faces or crop_faces.
+        model_name (str): DeepFace recognition model.
+
+    Returns:
+        np.ndarray: float32 embedding.
+    """
+    result = DeepFace.represent(img_path=face, model_name=model_name, detector_backend='skip',
+                                enforce_detection=False)
+    return np.asarray(result[0]['embedding'], dtype=np.float32)
+
+
+def embed_image(img, model_name="Facenet", detector_backend="retinaface"):
+    """
+    Embedding of the largest face in an image.
+
+    Args:
+        img: Image path or BGR array.
+        model_name (str): DeepFace recognition model.
+        detector_backend (str): DeepFace detector.
+
+    Returns:
+        np.ndarray: float32 embedding, or None if no face was found.
+    """
+    try:
+        faces = DeepFace.represent(img_path=img, model_name=model_name, detector_backend=detector_backend,
+                                   enforce_detection=False)
+    except Exception as e:
+        print(f"Could not compute embedding for {img if isinstance(img, str) else 'frame'}: {e}")
+        return None
+    # With enforce_detection=False DeepFace returns the whole image when nothing is found
+    faces = [f for f in faces if f.get('face_confidence', 0) > 0]
+    if not faces:
+        return None
+    largest = max(faces, key=lambda f: f['facial_area']['w'] * f['facial_area']['h'])
+    return np.asarray(largest['embedding'], dtype=np.float32)
+
+
+@contextmanager
+def _file_lock(path, shared=False):
+    """
+    Holds a lock on `path` (created if missing), across processes. Shared locks only
+    exclude exclusive ones; on Windows every lock is exclusive.
+    """
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)  # Gives up after 10 s, so retry
+                    break
+                except OSError:
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def indexed_models(db_path=DB_PATH):
+    """
+    Returns:
+        list: Names of the models that have an index in db_path.
+    """
+    index_dir = os.path.join(db_path, INDEX_DIR)
+    if not os.path.isdir(index_dir):
+        return []
+    return sorted(name[:-5] for name in os.listdir(index_dir) if name.endswith(".json"))
+
+
+class FaceIndex:
+    """
+    Memory-mapped embedding matrix with vectorized nearest-neighbour search.
+
+    Args:
+        db_path (str): Database folder with one subfolder per identity.
+        model_name (str): DeepFace recognition model the embeddings come from.
+        metric (str): 'cosine' or 'euclidean_l2', both on normalised embeddings.
+    """
+
+    def __init__(self, db_path=DB_PATH, model_name="Facenet", metric="cosine"):
+        if metric not in ("cosine", "euclidean_l2"):
+            raise ValueError(f"Unsupported metric: {metric}")
+        self.db_path = db_path
+        self.model_name = model_name
+        self.metric = metric
+
+        index_dir = os.path.join(db_path, INDEX_DIR)
+        self.matrix_path = os.path.join(index_dir, f"{model_name}.f32")
+        self.labels_path = os.path.join(index_dir, f"{model_name}.labels.jsonl")
+        self.meta_path = os.path.join(index_dir, f"{model_name}.json")
+        self.lock_path = os.path.join(index_dir, f"{model_name}.lock")
+
+        self.dim = None
+        self._matrix = None      # (count, dim) float32, memory-mapped
+        self._ids = []           # Identity of every row
+        self._sources = []       # Image every row was computed from
+        self._row_ids = None     # self._ids as an array, for masking
+        self._centroids = None   # (identities, centroid matrix), built on demand
+        self._stamp = None
+        self.load()
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def identities(self):
+        """Enrolled identities, in order of enrollment."""
+        return list(dict.fromkeys(self._ids))
+
+    def threshold(self):
+        """DeepFace's verification threshold for this model and metric."""
+        return find_threshold(self.model_name, self.metric)
+
+    # -- Storage
+
+    def _file_stamp(self):
+        try:
+            labels = os.stat(self.labels_path)
+            return os.path.getsize(self.matrix_path), labels.st_size, labels.st_mtime_ns, labels.st_ino
+        except OSError:
+            return None
+
+    @contextmanager
+    def _locked(self, shared=False):
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        with _file_lock(self.lock_path, shared):
+            yield
+
+    def load(self):
+        """
+        (Re)reads the index from disk. The matrix is memory-mapped, not copied.
+        """
+        if not os.path.isdir(os.path.dirname(self.lock_path)):
+            self._load()  # Nothing indexed yet
+            return
+        # remove() replaces the matrix and the labels one after the other, never read them in between
+        with self._locked(shared=True):
+            self._load()
+
+    def _load(self):
+        self._matrix = None
+        self._ids, self._sources = [], []
+        self._centroids = None
+        self._stamp = self._file_stamp()
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+        if os.path.exists(self.labels_path):
+            with open(self.labels_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break  # Still being written by another process
+                    if line.strip():
+                        label = json.loads(line)
+                        self._ids.append(label["id"])
+                        self._sources.append(label.get("source"))
+
+        rows = 0
+        if self.dim and os.path.exists(self.matrix_path):
+            rows = os.path.getsize(self.matrix_path) // (4 * self.dim)
+        # An interrupted append can leave one file longer than the other
+        rows = min(rows, len(self._ids))
+        self._ids, self._sources = self._ids[:rows], self._sources[:rows]
+        if rows:
+            self._matrix = np.memmap(self.matrix_path, dtype="<f4", mode="r", shape=(rows, self.dim))
+        else:
+            self._matrix = np.empty((0, self.dim or 0), dtype=np.float32)
+        self._row_ids = np.array(self._ids, dtype=object)
+
+    def refresh(self):
+        """
+        Reloads the index if another process (e.g. mov-to-db.py) changed it. The new
+        rows are mapped afresh; the old mapping stays valid until it is dropped.
+
+        Returns:
+            bool: True if the index was reloaded.
+        """
+        if self._file_stamp() == self._stamp:
+            return False
+        self.load()
+        return True
+
+    def add(self, identity, embeddings, sources=None):
+        """
+        Appends embeddings for one identity. Only the new rows are written.
+
+        Args:
+            identity (str): Contact id, i.e. the db/<id>/ folder name.
+            embeddings: One embedding or an (n, dim) array.
+            sources (list): Image path per embedding, optional.
+
+        Returns:
+            int: Number of rows added.
+        """
+        embeddings = _normalize(embeddings)
+        if len(embeddings) == 0:
+            return 0
+        if sources is None:
+            sources = [None] * len(embeddings)
+
+        with self._locked():
+            # Another process may have appended since we loaded, start from the files
+            self._load()
+            if self.dim is None:
+                self.dim = embeddings.shape[1]
+                with open(self.meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"model": self.model_name, "dim": self.dim}, f)
+            elif embeddings.shape[1] != self.dim:
+                raise ValueError(f"Embedding size {embeddings.shape[1]} does not match the index ({self.dim})")
+
+            # Rows first, labels last: a row without a label is ignored on load. Rows
+            # beyond the labels on disk are left by an interrupted append; nobody maps
+            # them, so they can be cut off.
+            self._matrix = None  # Release the map before the file changes
+            with open(self.matrix_path, "ab") as f:
+                if f.tell() > len(self._ids) * 4 * self.dim:
+                    f.truncate(len(self._ids) * 4 * self.dim)
+                f.write(embeddings.astype("<f4").tobytes())
+            with open(self.labels_path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps({"id": identity, "source": source}) + "\n" for source in sources))
+            self._load()
+        return len(embeddings)
+
+    def remove(self, identity):
+        """
+        Deletes all rows of an identity. The remaining rows are copied, not recomputed.
+
+        Returns:
+            int: Number of rows removed.
+        """
+        with self._locked():
+            self._load()
+            keep = self._row_ids != identity
+            removed = int(len(keep) - keep.sum())
+            if not removed:
+                return 0
+
+            matrix = np.array(self._matrix[keep], dtype="<f4")
+            labels = [(i, s) for i, s, k in zip(self._ids, self._sources, keep) if k]
+            self._matrix = None  # Release the map so the file can be replaced
+
+            # New files instead of rewriting in place, readers keep their mapping of the old ones
+            tmp_matrix, tmp_labels = self.matrix_path + ".tmp", self.labels_path + ".tmp"
+            with open(tmp_matrix, "wb") as f:
+                f.write(matrix.tobytes())
+            with open(tmp_labels, "w", encoding="utf-8") as f:
+                for i, s in labels:
+                    f.write(json.dumps({"id": i, "source": s}) + "\n")
+            os.replace(tmp_matrix, self.matrix_path)
+            os.replace(tmp_labels, self.labels_path)
+            self._load()
+        return removed
+
+    # -- Search
+
+    def _distances(self, queries, matrix):
+        similarity = queries @ matrix.T
+        if self.metric == "cosine":
+            return 1.0 - similarity
+        return np.sqrt(np.maximum(2.0 - 2.0 * similarity, 0.0))
+
+    def centroids(self):
+        """
+        Returns:
+            tuple: (identities, (n_identities, dim) matrix of normalised mean embeddings).
+        """
+        if self._centroids is None:
+            identities, inverse = np.unique(self._row_ids, return_inverse=True)
+            sums = np.zeros((len(identities), self._matrix.shape[1]), dtype=np.float32)
+            np.add.at(sums, inverse, self._matrix)
+            self._centroids = (list(identities), _normalize(sums) if len(identities) else sums)
+        return self._centroids
+
+    def search(self, embeddings, k=1, use_centroids=False):
+        """
+        Nearest enrolled faces for one or more query embeddings.
+
+        Args:
+            embeddings: One embedding or a (q, dim) array.
+            k (int): Matches per query.
+            use_centroids (bool): Compare against one centroid per identity instead of every image.
+
+        Returns:
+            list: One list of (identity, distance) per query, closest first.
+        """
+        queries = _normalize(embeddings)
+        if len(self) == 0:
+            return [[] for _ in queries]
+        if use_centroids:
+            labels, matrix = self.centroids()
+        else:
+            labels, matrix = self._ids, self._matrix
+
+        distances = self._distances(queries, matrix)
+        k = min(k, distances.shape[1])
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in zip(distances, nearest):
+            candidates = candidates[np.argsort(row[candidates])]
+            results.append([(labels[c], float(row[c])) for c in candidates])
+        return results
+
+    def identify(self, embedding, threshold=None, use_centroids=False):
+        """
+        Best matching identity for one face.
+
+        Args:
+            embedding: Query embedding.
+            threshold (float): Largest distance that counts as a match, defaults to DeepFace's.
+            use_centroids (bool): See search().
+
+        Returns:
+            tuple: (identity or None, distance). distance is None for an empty index.
+        """
+        matches = self.search(embedding, k=1, use_centroids=use_centroids)[0]
+        if not matches:
+            return None, None
+        identity, distance = matches[0]
+        if distance > (self.threshold() if threshold is None else threshold):
+            return None, distance
+        return identity, distance
+
+    # -- Building from the image folders
+
+    def enroll_folder(self, identity, detector_backend="retinaface"):
+        """
+        Computes and adds embeddings for the images in db/<identity>/.
+
+        Returns:
+            int: Number of rows added.
+        """
+        folder = os.path.join(self.db_path, identity)
+        embeddings, sources = [], []
+        for filename in sorted(os.listdir(folder)):
+            if not filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            path = os.path.join(folder, filename)
+            embedding = embed_image(path, self.model_name, detector_backend)
+            if embedding is None:
+                print(f"No face found in {path}")
+                continue
+            embeddings.append(embedding)
+            sources.append(path)
+        if not embeddings:
+            return 0
+        return self.add(identity, np.stack(embeddings), sources)
+
+    def sync(self, detector_backend="retinaface"):
+        """
+        Brings the index in line with the identity folders: folders that are not
+        indexed yet are embedded and added, identities whose folder is gone are
+        removed. Already indexed identities are left alone.
+
+        Returns:
+            tuple: (identities added, identities removed).
+        """
+        folders = [name for name in sorted(os.listdir(self.db_path))
+                   if not name.startswith(".") and os.path.isdir(os.path.join(self.db_path, name))]
+        indexed = set(self._ids)
+        added = [name for name in folders if name not in indexed and self.enroll_folder(name, detector_backend)]
+        removed = [identity for identity in self.identities if identity not in folders]
+        for identity in removed:
+            self.remove(identity)
+        return added, removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the face embedding index.")
+    parser.add_argument("command", choices=["sync", "find"])
+    parser.add_argument("image", nargs="?", help="Image to look up (find).")
+    parser.add_argument("--db", default=DB_PATH, help="Database folder.")
+    parser.add_argument("--model", default="Facenet", help="DeepFace recognition model.")
+    parser.add_argument("--detector_backend", default="retinaface", help="DeepFace face detector.")
+    parser.add_argument("--centroids", action="store_true", help="Search per-identity centroids.")
+    args = parser.parse_args()
+
+    index = FaceIndex(args.db, args.model)
+    if args.command == "sync":
+        added, removed = index.sync(args.detector_backend)
+        print(f"Added {len(added)} and removed {len(removed)} identities; "
+              f"{len(index)} embeddings of {len(index.identities)} identities in the index.")
+    else:
+        embedding = embed_image(args.image, args.model, args.detector_backend)
+        if embedding is None:
+            print(f"No face found in {args.image}")
+        else:
+            start = time.perf_counter()
+            matches = index.search(embedding, k=5, use_centroids=args.centroids)[0]
+            elapsed = time.perf_counter() - start
+            for identity, distance in matches:
+                print(f"{identity}: {distance:.4f}")
+            print(f"Searched {len(index)} embeddings in {elapsed * 1000:.2f} ms "
+                  f"(threshold {index.threshold():.2f})")
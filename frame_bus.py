@@ -0,0 +1,332 @@
+"""
+One camera, many consumers: a shared-memory ring buffer of decoded frames.
+
+Display, recording, emotion analysis and head tracking each used to open
+their own connection to Epi's MJPEG stream and decode every frame again.
+With the frame bus one process decodes the camera into a
+multiprocessing.shared_memory ring buffer and any number of consumer
+processes attach to it by name. Frames are never pickled or sent through a
+pipe; a consumer gets a NumPy view straight into shared memory, or one copy
+if it wants to draw on the frame.
+
+Every frame gets a sequence number. Slot `seq % slots` holds it until the
+writer comes around again, so a consumer has `slots - 1` frame periods to use
+a view before it is overwritten; still_valid(seq) tells whether that happened.
+
+    # Process 1
+    python frame_bus.py publish --source stream --name epi-camera
+
+    # Process 2, 3, ...
+    reader = LatestFrameReader("bus:epi-camera")    # or demo_mode(source="bus:epi-camera")
+    python frame_bus.py record session.mkv --name epi-camera --fps 12
+"""
+
+import argparse
+import os
+import signal
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import cv2
+import numpy as np
+
+from mjpeg_client import MJPEGClient
+
+BUS_NAME = "epi-camera"
+CAMERA_URL = 'http://righteye.local:8080/stream/video.mjpeg'
+
+_MAGIC = 0x45504942  # "EPIB"
+_HEADER_FIELDS = 8   # magic, height, width, channels, slots, write_seq, closed, reserved
+_ALIGN = 64
+
+_created_here = set()  # Buses written by this process, their memory is tracked already
+
+
+def _header_size(slots):
+    size = 8 * _HEADER_FIELDS + 16 * slots  # int64 fields, then int64 seq and float64 time per slot
+    return (size + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class _Layout:
+    """NumPy views onto the shared memory block."""
+
+    def __init__(self, buf, height, width, channels, slots):
+        self.header = np.ndarray((_HEADER_FIELDS,), dtype=np.int64, buffer=buf)
+        self.slot_seq = np.ndarray((slots,), dtype=np.int64, buffer=buf, offset=8 * _HEADER_FIELDS)
+        self.slot_time = np.ndarray((slots,), dtype=np.float64, buffer=buf,
+                                    offset=8 * _HEADER_FIELDS + 8 * slots)
+        self.frames = np.ndarray((slots, height, width, channels), dtype=np.uint8, buffer=buf,
+                                 offset=_header_size(slots))
+
+
+class FrameBusWriter:
+    """
+    Creates the ring buffer and publishes frames into it.
+
+    Args:
+        name (str): Shared memory name the consumers attach to.
+        shape (tuple): (height, width, channels) of the frames.
+        slots (int): Number of frames kept.
+    """
+
+    def __init__(self, name=BUS_NAME, shape=(480, 640, 3), slots=8):
+        height, width, channels = shape
+        size = _header_size(slots) + slots * height * width * channels
+        self.name = name
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        _created_here.add(name)
+        self._layout = _Layout(self.shm.buf, height, width, channels, slots)
+        self._layout.header[:] = [_MAGIC, height, width, channels, slots, 0, 0, 0]
+        self._layout.slot_seq[:] = 0
+        self.seq = 0
+
+    def write(self, frame, frame_time=None):
+        """
+        Copies a frame into the next slot.
+
+        Returns:
+            int: The frame's sequence number.
+        """
+        if frame.shape != self.shape:
+            raise ValueError(f"Frame shape {frame.shape} does not match the bus {self.shape}")
+        self.seq += 1
+        slot = self.seq % self.slots
+        layout = self._layout
+        # Readers check the slot's sequence number before and after using it
+        layout.slot_seq[slot] = 0
+        np.copyto(layout.frames[slot], frame)
+        layout.slot_time[slot] = time.time() if frame_time is None else frame_time
+        layout.slot_seq[slot] = self.seq
+        layout.header[5] = self.seq
+        return self.seq
+
+    def close(self):
+        """Tells the readers the stream ended and removes the shared memory."""
+        self._layout.header[6] = 1
+        self._layout = None
+        self.shm.close()
+        self.shm.unlink()
+        _created_here.discard(self.name)
+
+
+class FrameBusReader:
+    """
+    Attaches to a running bus. Also usable in place of cv2.VideoCapture
+    (isOpened/read/release), e.g. by LatestFrameReader for "bus:<name>" sources.
+
+    Args:
+        name (str): Name the writer was created with.
+        poll_interval (float): Seconds between checks for a new frame while waiting.
+    """
+
+    def __init__(self, name=BUS_NAME, poll_interval=0.002):
+        self.name = name
+        self.poll_interval = poll_interval
+        self.shm = None
+        self._layout = None
+        self.last_seq = 0
+
+        # Statistics
+        self.frames_read = 0
+        self.frames_skipped = 0
+
+        try:
+            self.shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            print(f"No frame bus named {name}. Start it with: python frame_bus.py publish --name {name}")
+            return
+        # The writer owns the memory; don't let this process' resource tracker remove it on exit
+        if os.name == "posix" and name not in _created_here:
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+
+        header = np.ndarray((_HEADER_FIELDS,), dtype=np.int64, buffer=self.shm.buf)
+        if header[0] != _MAGIC:
+            print(f"Shared memory {name} is not a frame bus")
+            self.release()
+            return
+        _, height, width, channels, slots = (int(v) for v in header[:5])
+        self.shape = (height, width, channels)
+        self.slots = slots
+        self._layout = _Layout(self.shm.buf, height, width, channels, slots)
+
+    def isOpened(self):
+        return self._layout is not None
+
+    @property
+    def closed(self):
+        """True when the writer has stopped."""
+        return self._layout is None or bool(self._layout.header[6])
+
+    def latest_seq(self):
+        return int(self._layout.header[5])
+
+    def get(self, seq):
+        """
+        Zero-copy access to one frame.
+
+        Returns:
+            tuple: (frame view, capture time), or (None, None) if the frame was overwritten
+            or hasn't been written. Check still_valid(seq) after using the view.
+        """
+        slot = seq % self.slots
+        if seq <= 0 or self._layout.slot_seq[slot] != seq:
+            return None, None
+        return self._layout.frames[slot], float(self._layout.slot_time[slot])
+
+    def still_valid(self, seq):
+        """True if the frame with this sequence number has not been overwritten (yet)."""
+        return self._layout is not None and self._layout.slot_seq[seq % self.slots] == seq
+
+    def wait(self, after_seq=None, timeout=None):
+        """
+        Waits for a frame newer than `after_seq` (default: the last one read).
+
+        Returns:
+            int: Newest sequence number, or None on timeout or when the writer stopped.
+        """
+        after_seq = self.last_seq if after_seq is None else after_seq
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            seq = self.latest_seq()
+            if seq > after_seq:
+                return seq
+            if self.closed or (deadline is not None and time.time() >= deadline):
+                return None
+            time.sleep(self.poll_interval)
+
+    def read(self, timeout=None, copy=True):
+        """
+        Newest frame since the last read, like cv2.VideoCapture.read().
+
+        Args:
+            timeout (float): Seconds to wait for a new frame, None waits until the writer stops.
+            copy (bool): Return a private copy. With False the frame is a view into shared
+                memory that must not be drawn on and is only valid for `slots - 1` frame periods.
+
+        Returns:
+            tuple: (ret, frame).
+        """
+        if self._layout is None:
+            return False, None
+        while True:
+            seq = self.wait(timeout=timeout)
+            if seq is None:
+                return False, None
+            frame, _ = self.get(seq)
+            if frame is not None:
+                if copy:
+                    frame = frame.copy()
+                if copy and not self.still_valid(seq):
+                    continue  # Overwritten while copying, take the next one
+                break
+        if self.last_seq:
+            self.frames_skipped += seq - self.last_seq - 1
+        self.last_seq = seq
+        self.frames_read += 1
+        return True, frame
+
+    def release(self):
+        self._layout = None
+        if self.shm is not None:
+            try:
+                self.shm.close()
+            except BufferError:
+                pass  # Frame views are still in use, the mapping goes away with them
+            self.shm = None
+
+
+def publish(source=CAMERA_URL, name=BUS_NAME, slots=8):
+    """
+    Decodes a video source into the frame bus until the source ends or Ctrl+C.
+
+    Args:
+        source: Anything cv2.VideoCapture accepts.
+        name (str): Bus name for the consumers.
+        slots (int): Ring buffer size in frames.
+    """
+    if isinstance(source, str) and source.startswith(("http://", "https://")):
+        cap = MJPEGClient(source)  # Reconnects instead of ending the bus on a hiccup
+    else:
+        cap = cv2.VideoCapture(source)
+    ret, frame = cap.read()
+    if not ret:
+        print(f"Could not read from video source: {source}")
+        return
+
+    writer = FrameBusWriter(name, frame.shape, slots)
+    print(f"Publishing {frame.shape[1]}x{frame.shape[0]} frames from {source} on frame bus '{name}'")
+    start = time.time()
+    try:
+        while ret:
+            writer.write(frame)
+            ret, frame = cap.read()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cap.release()
+        writer.close()
+    elapsed = time.time() - start
+    print(f"Published {writer.seq} frames ({writer.seq / elapsed if elapsed else 0:.1f} fps)")
+
+
+def record(output, name=BUS_NAME, fps=12.0):
+    """
+    Writes the bus to a video file at a fixed frame rate until the writer stops or Ctrl+C.
+    Frames are taken from shared memory without copying.
+    """
+    reader = FrameBusReader(name)
+    if not reader.isOpened():
+        return
+    height, width, _ = reader.shape
+    fourcc = cv2.VideoWriter_fourcc(*"MJPG")
+    out = cv2.VideoWriter(output, fourcc, fps, (width, height))
+    period = 1.0 / fps
+    next_time = time.time()
+    try:
+        while True:
+            ret, frame = reader.read(copy=False)
+            if not ret:
+                break
+            # Keep the frame rate of the file, dropping frames that come too soon
+            if time.time() < next_time:
+                continue
+            next_time = max(next_time + period, time.time())
+            out.write(frame)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        out.release()
+        reader.release()
+    print(f"Recorded {reader.frames_read} frames to {output}")
+
+
+def _stop(signum, frame):
+    # Popen.terminate() from another program (e.g. esep_program.py) ends the loop cleanly
+    raise KeyboardInterrupt
+
+
+if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, _stop)
+
+    parser = argparse.ArgumentParser(description="Share one camera between several processes.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    publish_parser = subparsers.add_parser("publish", help="Decode a camera into the frame bus.")
+    publish_parser.add_argument("--source", default="stream",
+                                help="'stream' for Epi's camera, 'webcam', or a URL/file.")
+    publish_parser.add_argument("--name", default=BUS_NAME, help="Frame bus name.")
+    publish_parser.add_argument("--slots", type=int, default=8, help="Frames kept in the ring buffer.")
+
+    record_parser = subparsers.add_parser("record", help="Record the frame bus to a video file.")
+    record_parser.add_argument("output", help="Video file to write, e.g. session.mkv.")
+    record_parser.add_argument("--name", default=BUS_NAME, help="Frame bus name.")
+    record_parser.add_argument("--fps", type=float, default=12.0, help="Frame rate of the recording.")
+
+    args = parser.parse_args()
+    if args.command == "publish":
+        source = {'stream': CAMERA_URL, 'webcam': 0}.get(args.source, args.source)
+        publish(source, args.name, args.slots)
+    else:
+        record(args.output, args.name, args.fps)
@@ -0,0 +1,236 @@
+"""
+Closed-loop head tracking for Epi.
+
+temp_main() moved the head every 5 seconds from raw pixel values. Here the
+face tracker runs at camera rate and the centre of the followed face goes
+through coordinate_modification() on every frame. HeadController keeps the
+pan/tilt it last commanded (Epi doesn't report its position, so that is our
+proprioception), smooths the movement and only sends SR.positions when the
+face is outside a dead band and the rate limit allows.
+
+Usage:
+    python head_tracking.py [--source webcam|stream|bus:<name>] [--stub] [--no-display]
+
+--stub starts a local stand-in for the Ikaros server and sends the commands
+there, to measure loop latency and command rate without the robot.
+"""
+
+import argparse
+import time
+
+import cv2
+
+from capture import LatestFrameReader
+from ikaros import IkarosDispatcher, IkarosStubServer, get_dispatcher
+from inference import InferenceWorker
+from pipeline import detect_faces
+from recognition import coordinate_modification
+from tracker import FaceTracker
+
+# SR.positions rows for Epi's neck, as used by temp_main()
+PAN_SERVO = 1
+TILT_SERVO = 0
+
+CAMERA_URL = 'http://righteye.local:8080/stream/video.mjpeg'
+
+
+class HeadController:
+    """
+    Turns face positions into smoothed, rate-limited pan/tilt commands.
+
+    Args:
+        dispatcher (IkarosDispatcher): Where the SR.positions commands are queued.
+        smoothing (float): Share of the remaining distance to the target moved per command (0-1].
+        max_step (float): Largest change in degrees per command and axis.
+        dead_band (float): Don't move if the target is closer than this many degrees on both axes.
+        max_rate (float): Maximum number of position updates per second.
+    """
+
+    def __init__(self, dispatcher, smoothing=0.5, max_step=8.0, dead_band=2.0, max_rate=10.0):
+        self.dispatcher = dispatcher
+        self.smoothing = smoothing
+        self.max_step = max_step
+        self.dead_band = dead_band
+        self.min_period = 1.0 / max_rate
+
+        # Proprioception: where we believe the head is, in degrees
+        self.pan = 0.0
+        self.tilt = 0.0
+        self._last_command = 0.0
+
+        # Statistics
+        self.updates = 0
+        self.commands = 0
+        self.in_dead_band = 0
+        self.rate_limited = 0
+        self._first_command = None
+        self._latency_sum = 0.0
+        self.max_latency = 0.0
+
+    def _step(self, current, target):
+        step = self.smoothing * (target - current)
+        return current + max(-self.max_step, min(self.max_step, step))
+
+    def home(self):
+        """Moves the head to the centre position."""
+        self.pan, self.tilt = 0.0, 0.0
+        self.dispatcher.set_position(PAN_SERVO, 0, 0)
+        self.dispatcher.set_position(TILT_SERVO, 0, 0)
+
+    def update(self, x, y, frame_width, frame_height, frame_time=None, now=None):
+        """
+        Feeds the tracked face centre of one frame into the controller.
+
+        Args:
+            x, y: Face centre in pixels.
+            frame_width, frame_height: Size of the frame the centre was measured in.
+            frame_time (float): time.time() when the frame was captured, for latency statistics.
+            now (float): Current time, defaults to time.time().
+
+        Returns:
+            bool: True if a command was sent.
+        """
+        now = time.time() if now is None else now
+        self.updates += 1
+
+        target_pan, target_tilt = coordinate_modification(x, y, self.pan, self.tilt,
+                                                          frame_width, frame_height)
+        if abs(target_pan - self.pan) < self.dead_band and abs(target_tilt - self.tilt) < self.dead_band:
+            self.in_dead_band += 1
+            return False
+        if now - self._last_command < self.min_period:
+            self.rate_limited += 1
+            return False
+
+        self.pan = self._step(self.pan, target_pan)
+        self.tilt = self._step(self.tilt, target_tilt)
+        self.dispatcher.set_position(PAN_SERVO, 0, round(self.pan))
+        self.dispatcher.set_position(TILT_SERVO, 0, round(self.tilt))
+
+        self._last_command = now
+        self.commands += 1
+        if self._first_command is None:
+            self._first_command = now
+        if frame_time is not None:
+            latency = now - frame_time
+            self._latency_sum += latency
+            self.max_latency = max(self.max_latency, latency)
+        return True
+
+    def command_rate(self):
+        """Commands per second since the first command."""
+        if self.commands < 2:
+            return 0.0
+        return (self.commands - 1) / (self._last_command - self._first_command)
+
+    def print_stats(self):
+        mean_latency = self._latency_sum / self.commands if self.commands else 0.0
+        print(f"Head tracking: {self.updates} updates, {self.commands} commands "
+              f"({self.command_rate():.1f}/s), {self.in_dead_band} in dead band, "
+              f"{self.rate_limited} rate limited. Frame-to-command latency mean "
+              f"{mean_latency * 1000:.1f} ms, max {self.max_latency * 1000:.1f} ms")
+
+
+def head_tracking_mode(source='stream', detector_backend='opencv', detect_interval=0.2,
+                       detection_width=320, ikaros_url=None, display=True):
+    """
+    Follows a face with Epi's head at camera rate.
+
+    The detector runs on a worker thread about every `detect_interval` seconds;
+    in between the tracker moves the boxes with optical flow. The head follows
+    the face it followed before as long as it is tracked, otherwise the largest one.
+
+    Args:
+        source (str): 'stream' for Epi's camera, 'webcam', or "bus:<name>" for a frame bus.
+        detector_backend (str): DeepFace detector, a fast one is best here.
+        detect_interval (float): Seconds between detections.
+        detection_width (int): Frames are downscaled to this width for detection.
+        ikaros_url (str): Ikaros server to send to, defaults to the shared dispatcher.
+        display (bool): Show the video with the followed face. Stop with 'q', or Ctrl+C
+            without display.
+    """
+    video_source = {'webcam': 0, 'stream': CAMERA_URL}.get(source, source)
+    dispatcher = IkarosDispatcher(ikaros_url).start() if ikaros_url else get_dispatcher()
+    controller = HeadController(dispatcher)
+    tracker = FaceTracker()
+    worker = InferenceWorker(
+        lambda img: detect_faces(img, detector_backend, align=False, detection_width=detection_width)
+    ).start()
+
+    # Without a window nobody looks at the full-size frame, so decode the stream at half size
+    reader = LatestFrameReader(video_source, reduction=1 if display else 2)
+    if not reader.start():
+        return
+
+    controller.home()
+    last_detection = 0.0
+    last_result = None
+    followed_id = None
+
+    try:
+        while True:
+            ret, frame = reader.read()
+            if not ret:
+                break
+            now = time.time()
+            height, width = frame.shape[:2]
+
+            tracker.predict(frame)
+            if now - last_detection >= detect_interval and worker.submit(frame.copy()):
+                last_detection = now
+            latest = worker.latest()
+            if latest is not None and latest is not last_result:
+                last_result = latest
+                tracker.update([(d['box'], None) for d in latest.result])
+
+            visible = [t for t in tracker.tracks if t.misses == 0]
+            target = next((t for t in visible if t.id == followed_id), None)
+            if target is None and visible:
+                target = max(visible, key=lambda t: t.box[2] * t.box[3])
+
+            if target is not None:
+                followed_id = target.id
+                x, y, w, h = target.box
+                controller.update(x + w / 2, y + h / 2, width, height, frame_time=reader.frame_time, now=now)
+
+            if display:
+                for track in visible:
+                    x, y, w, h = track.int_box()
+                    color = (0, 255, 255) if track is target else (0, 255, 0)
+                    cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
+                cv2.putText(frame, f"pan {controller.pan:.0f} tilt {controller.tilt:.0f}", (10, 25),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+                cv2.imshow('Head Tracking', frame)
+                reader.mark_displayed()
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.stop()
+        reader.release()
+        if display:
+            cv2.destroyAllWindows()
+
+    controller.print_stats()
+    dispatcher.print_stats()
+    if ikaros_url:
+        dispatcher.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Follow faces with Epi's head.")
+    parser.add_argument("--source", default="stream",
+                        help="Video source: 'stream', 'webcam' or bus:<name> for a frame bus.")
+    parser.add_argument("--detector_backend", default="opencv", help="DeepFace face detector.")
+    parser.add_argument("--stub", action="store_true", help="Send commands to a local stub Ikaros server.")
+    parser.add_argument("--stub_port", type=int, default=8001, help="Port for the stub server.")
+    parser.add_argument("--no-display", dest="display", action="store_false", help="Run without a window.")
+    args = parser.parse_args()
+
+    stub = IkarosStubServer(port=args.stub_port).start() if args.stub else None
+    head_tracking_mode(source=args.source, detector_backend=args.detector_backend,
+                       ikaros_url=stub.url if stub else None, display=args.display)
+    if stub:
+        print(f"Stub server received {len(stub.requests)} requests ({stub.command_rate():.1f}/s)")
+        stub.stop()
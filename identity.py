@@ -0,0 +1,196 @@
+"""
+Names for tracked faces in the live demo.
+
+Recognising every face on every frame would cost an embedding per face per
+frame. TrackIdentifier identifies each track once, on a background thread,
+and caches the answer for as long as the tracker keeps the track. A cached
+identity is re-verified every `reverify_interval` seconds, or sooner when the
+match was weak or no match was found. When every visible track has a fresh
+identity, update() costs a few dictionary lookups.
+
+    identifier = TrackIdentifier().start()
+    ...
+    identifier.update(frame, visible_tracks)
+    label = identifier.label(track, f"Person {track.id}")
+"""
+
+import time
+
+import metrics
+from contacts_db import DB_FILE, ContactRegistry
+from face_index import DB_PATH, FaceIndex, represent_face
+from inference import InferenceWorker
+from pipeline import crop_faces
+
+
+def load_contact_names(contacts_file=DB_FILE):
+    """
+    Returns:
+        dict: Contact id -> name from the contact registry, see contacts_db.py.
+    """
+    registry = ContactRegistry(contacts_file)
+    try:
+        return registry.names()
+    finally:
+        registry.close()
+
+
+class TrackIdentity:
+    """
+    Cached identification of one track.
+
+    Attributes:
+        identity (str): Contact id, or None if the face didn't match anyone.
+        distance (float): Distance to the closest enrolled face.
+        checked_at (float): time.time() of the last identification attempt.
+        verified_at (float): time.time() when the identity was last confirmed.
+    """
+
+    def __init__(self):
+        self.identity = None
+        self.distance = None
+        self.checked_at = 0.0
+        self.verified_at = 0.0
+
+
+class TrackIdentifier:
+    """
+    Identifies tracked faces against the face index and caches the result per track.
+
+    Args:
+        db_path (str): Database folder with the face index.
+        model_name (str): Recognition model the index was built with.
+        contacts_file (str): Contact registry with the names of the contact ids, see contacts_db.py.
+        reverify_interval (float): Seconds before a confident identity is checked again.
+        retry_interval (float): Seconds before an unknown face or a weak match is checked again.
+        strong_match (float): A match counts as confident when its distance is below this
+            share of the model's threshold.
+        margin (float): Extra border around the tracked box for the crop, relative to its size.
+    """
+
+    def __init__(self, db_path=DB_PATH, model_name="Facenet", contacts_file=DB_FILE, reverify_interval=5.0,
+                 retry_interval=1.0, strong_match=0.7, margin=0.1):
+        self.index = FaceIndex(db_path, model_name)
+        self.model_name = model_name
+        self.contacts = ContactRegistry(contacts_file)
+        self.reverify_interval = reverify_interval
+        self.retry_interval = retry_interval
+        self.strong_match = strong_match
+        self.margin = margin
+
+        self.names = self.contacts.names()
+        self._threshold = self.index.threshold()
+        self._cache = {}  # track id -> TrackIdentity
+        self._last_result = None
+        self.worker = InferenceWorker(self._identify)
+
+        # Statistics
+        self.lookups = 0
+        self.cache_hits = 0
+        self.identity_changes = 0
+
+    def start(self):
+        self.worker.start()
+        return self
+
+    def _identify(self, face, track_id):
+        # Runs on the worker thread. Picks up contacts enrolled while we are running.
+        with metrics.timer('identify'):
+            self.index.refresh()
+            return self.index.identify(represent_face(face, self.model_name), self._threshold)
+
+    def _due(self, entry, now):
+        if entry.identity is not None and entry.distance <= self.strong_match * self._threshold:
+            return now - entry.checked_at >= self.reverify_interval
+        return now - entry.checked_at >= self.retry_interval
+
+    def _collect(self):
+        latest = self.worker.latest()
+        if latest is None or latest is self._last_result:
+            return
+        self._last_result = latest
+        entry = self._cache.get(latest.meta['track_id'])
+        if entry is None:
+            return  # Track ended while it was being identified
+        identity, distance = latest.result
+        if identity is not None and identity not in self.names:
+            # Possibly a contact enrolled while we are running, one indexed lookup
+            name = self.contacts.name(identity)
+            if name is not None:
+                self.names[identity] = name
+        if (identity is None and entry.identity is not None
+                and latest.frame_time - entry.verified_at < 2 * self.reverify_interval):
+            # A single failed check (blur, turned head) doesn't drop a known identity,
+            # but it is checked again after retry_interval. _due() waits reverify_interval
+            # for a strong match, so move checked_at back by the difference then.
+            entry.distance = distance if distance is not None else entry.distance
+            entry.checked_at = latest.frame_time
+            if entry.distance <= self.strong_match * self._threshold:
+                entry.checked_at -= self.reverify_interval - self.retry_interval
+            return
+        if entry.identity is not None and identity != entry.identity:
+            self.identity_changes += 1
+        entry.identity, entry.distance = identity, distance
+        if identity is not None:
+            entry.verified_at = latest.frame_time
+
+    def update(self, frame, tracks, now=None):
+        """
+        Call once per frame with the visible tracks. Collects finished identifications,
+        forgets tracks that are gone and hands at most one face to the worker.
+
+        Args:
+            frame: The current BGR frame.
+            tracks (list): Tracks from FaceTracker that are visible in this frame.
+            now (float): Current time, defaults to time.time().
+        """
+        now = time.time() if now is None else now
+        self._collect()
+
+        active = {track.id for track in tracks}
+        for track_id in list(self._cache):
+            if track_id not in active:
+                del self._cache[track_id]
+
+        # The track that has waited longest gets identified next
+        due = []
+        for track in tracks:
+            entry = self._cache.setdefault(track.id, TrackIdentity())
+            self.lookups += 1
+            if self._due(entry, now):
+                due.append((entry.checked_at, track, entry))
+            else:
+                self.cache_hits += 1
+        if not due or self.worker.busy:
+            return
+
+        _, track, entry = min(due, key=lambda d: d[0])
+        crops = crop_faces(frame, [track.box], margin=self.margin)
+        if crops and self.worker.submit(crops[0][1].copy(), track_id=track.id):
+            entry.checked_at = now
+
+    def identity(self, track):
+        """
+        Returns:
+            TrackIdentity: Cached identification of the track, or None if it hasn't been seen.
+        """
+        return self._cache.get(track.id)
+
+    def label(self, track, default=None):
+        """
+        Name of the contact the track was identified as, the contact id if it has no
+        name in the contact registry, or `default` if the track is not identified.
+        """
+        entry = self._cache.get(track.id)
+        if entry is None or entry.identity is None:
+            return default
+        return self.names.get(entry.identity, entry.identity)
+
+    def print_stats(self):
+        hit_rate = self.cache_hits / self.lookups if self.lookups else 0.0
+        print(f"Identity cache: {self.lookups} lookups, {hit_rate:.1%} served from cache, "
+              f"{self.worker.completed} identifications, {self.identity_changes} identity changes")
+
+    def stop(self):
+        self.worker.stop()
+        self.contacts.close()
@@ -0,0 +1,272 @@
+"""
+Non-blocking command dispatch to the Ikaros server that drives Epi.
+
+Every requests.get used to open a new connection on the render thread, and a
+slow Ikaros made the video freeze. IkarosDispatcher keeps one keep-alive
+session and sends commands from a background thread. Servo position commands
+are coalesced: if several positions for the same servo are queued before
+they can be sent, only the newest one goes out.
+
+    dispatcher = get_dispatcher()
+    dispatcher.trigger_motion(12)
+    dispatcher.set_position(1, 0, 15)
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+import tracing
+
+IKAROS_URL = "http://127.0.0.1:8000"
+
+
+class CommandStats:
+    """
+    Round-trip statistics for one kind of command.
+    """
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record(self, latency, ok):
+        self.sent += 1
+        if not ok:
+            self.failed += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def as_dict(self):
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "mean_latency": self.total_latency / self.sent if self.sent else 0.0,
+            "max_latency": self.max_latency,
+        }
+
+
+class IkarosDispatcher:
+    """
+    Sends Ikaros commands from a background thread over one pooled session.
+
+    Args:
+        base_url (str): Ikaros web server, e.g. 'http://127.0.0.1:8000'.
+        timeout (float): Seconds to wait for each response.
+        max_queue (int): Commands waiting to be sent; when full the oldest is dropped.
+    """
+
+    def __init__(self, base_url=IKAROS_URL, timeout=2.0, max_queue=50):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        self.session.mount("http://", adapter)
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._commands = deque()
+        self._max_queue = max_queue
+        self._positions = OrderedDict()  # (servo, position) -> (path, queued_at)
+        self._running = False
+        self._thread = None
+        self._last_was_position = False
+        self.stats = {}
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="ikaros-dispatcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def _stats(self, kind):
+        if kind not in self.stats:
+            self.stats[kind] = CommandStats()
+        return self.stats[kind]
+
+    def send(self, path, kind="command"):
+        """
+        Queues a GET request for base_url + path without waiting for it.
+
+        Args:
+            path (str): e.g. '/command/SR.trig/12/0/0'.
+            kind (str): Name the command is counted under in the statistics.
+        """
+        with self._lock:
+            if len(self._commands) >= self._max_queue:
+                _, dropped_kind, _ = self._commands.popleft()
+                self._stats(dropped_kind).dropped += 1
+            self._commands.append((path, kind, time.time()))
+            self._wakeup.notify()
+
+    def set_position(self, servo, position, value):
+        """
+        Queues an SR.positions command. A position for the same servo that has not been
+        sent yet is replaced.
+        """
+        path = f"/control/SR.positions/{servo}/{position}/{value}"
+        with self._lock:
+            key = (servo, position)
+            if key in self._positions:
+                self._stats("position").coalesced += 1
+                del self._positions[key]
+            self._positions[key] = (path, time.time())
+            self._wakeup.notify()
+
+    def trigger_motion(self, sequence_number):
+        self.send(f"/command/SR.trig/{sequence_number}/0/0", kind="motion")
+
+    def say(self, text):
+        # Spaces are not allowed in the path
+        self.send(f"/command/EpiSpeech.say/0/0/{text.replace(' ', '_')}", kind="speech")
+
+    def pending(self):
+        with self._lock:
+            return len(self._commands) + len(self._positions)
+
+    def _next(self):
+        # Positions first, they are the most time critical, but alternate with
+        # other commands so a steady stream of positions can't starve them
+        if self._positions and not (self._last_was_position and self._commands):
+            self._last_was_position = True
+            _, (path, queued_at) = self._positions.popitem(last=False)
+            return path, "position", queued_at
+        self._last_was_position = False
+        return self._commands.popleft()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                self._wakeup.wait_for(lambda: self._commands or self._positions or not self._running)
+                if not self._running and not (self._commands or self._positions):
+                    return
+                path, kind, _ = self._next()
+
+            url = self.base_url + path
+            start = time.perf_counter()
+            ok = False
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                ok = response.status_code == 200
+                if not ok:
+                    print(f"Ikaros returned status {response.status_code} for {url}")
+            except requests.exceptions.RequestException as e:
+                print(f"Error sending {kind} command to Ikaros ({url}): {e}")
+            latency = time.perf_counter() - start
+            tracing.complete(f"ikaros {kind}", start, latency, ok=ok)
+            metrics.observe('ikaros_request_seconds', latency, metrics.LATENCY_BUCKETS, kind=kind)
+            if not ok:
+                metrics.inc('ikaros_errors', kind=kind)
+            with self._lock:
+                self._stats(kind).record(latency, ok)
+
+    def print_stats(self):
+        for kind, stats in self.stats.items():
+            s = stats.as_dict()
+            print(f"Ikaros {kind}: {s['sent']} sent, {s['failed']} failed, {s['dropped']} dropped, "
+                  f"{s['coalesced']} coalesced, round trip mean {s['mean_latency'] * 1000:.0f} ms, "
+                  f"max {s['max_latency'] * 1000:.0f} ms")
+
+    def close(self, timeout=2.0):
+        """
+        Sends what is still queued (for at most `timeout` seconds) and stops the thread.
+        """
+        with self._lock:
+            self._running = False
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+        self.session.close()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """
+    Returns the process-wide dispatcher, starting it on first use.
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = IkarosDispatcher().start()
+        return _dispatcher
+
+
+class IkarosStubServer:
+    """
+    Stand-in for the Ikaros web server when Epi isn't around. Answers every GET
+    with 200 and '{}' and remembers what it was sent, so command rates and
+    round trips can be measured locally.
+
+        stub = IkarosStubServer(port=8001).start()
+        dispatcher = IkarosDispatcher(stub.url).start()
+
+    Args:
+        port (int): Port to listen on, on 127.0.0.1.
+        delay (float): Seconds to wait before answering, to simulate a slow server.
+    """
+
+    def __init__(self, port=8000, delay=0.0):
+        self.port = port
+        self.delay = delay
+        self.requests = []  # (time.time(), path)
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests.append((time.time(), self.path))
+                if stub.delay:
+                    time.sleep(stub.delay)
+                body = b"{}"
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Keep the console quiet
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="ikaros-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def command_rate(self, window=None):
+        """
+        Returns:
+            float: Requests per second over the last `window` seconds, or over the whole run.
+        """
+        times = [t for t, _ in self.requests]
+        if window is not None:
+            times = [t for t in times if t >= time.time() - window]
+        if len(times) < 2:
+            return 0.0
+        return (len(times) - 1) / (times[-1] - times[0])
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
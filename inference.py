@@ -0,0 +1,166 @@
+"""
+Out-of-band inference for the live loops.
+
+DeepFace.analyze takes hundreds of milliseconds on a CPU, so calling it from
+the render loop freezes the display. InferenceWorker runs the analysis on a
+background thread: the loop submits frames and draws whatever result finished
+last. Submissions are bounded, and when the worker is busy new frames are
+skipped instead of queued, so slow inference never causes a backlog.
+"""
+
+import queue
+import threading
+import time
+
+import metrics
+import tracing
+
+
+class InferenceResult:
+    """
+    A finished analysis.
+
+    Attributes:
+        result: Whatever the analysis function returned.
+        frame_time (float): time.time() when the analysed frame was submitted.
+        duration (float): Seconds the analysis took.
+        meta (dict): The keyword arguments passed to submit().
+    """
+
+    def __init__(self, result, frame_time, duration, meta):
+        self.result = result
+        self.frame_time = frame_time
+        self.duration = duration
+        self.meta = meta
+
+
+class InferenceWorker:
+    """
+    Runs an analysis function on frames in a background thread.
+
+    Args:
+        analyze_fn (callable): Called as analyze_fn(frame, **kwargs) with the keyword arguments
+            given to submit(), e.g. a wrapper around DeepFace.analyze.
+        max_pending (int): Size of the submit queue.
+        skip_if_busy (bool): If True, frames submitted while an analysis is running are
+            dropped even if the queue has room, so results are always for the newest frame.
+    """
+
+    def __init__(self, analyze_fn, max_pending=1, skip_if_busy=True):
+        self.analyze_fn = analyze_fn
+        self.skip_if_busy = skip_if_busy
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._busy = False
+        self._latest = None
+
+        # Statistics
+        self.submitted = 0
+        self.skipped = 0
+        self.completed = 0
+        self.errors = 0
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="inference-worker", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while self._running:
+            item = self._queue.get()
+            if item is None:
+                break
+            frame, frame_time, meta = item
+
+            with self._lock:
+                self._busy = True
+            start = time.perf_counter()
+            try:
+                result = self.analyze_fn(frame, **meta)
+                duration = time.perf_counter() - start
+                tracing.complete("inference", start, duration)
+                with self._lock:
+                    self._latest = InferenceResult(result, frame_time, duration, meta)
+                    self.completed += 1
+            except Exception as e:
+                # Keep the previous result if an error occurs
+                print(f"An error occurred during inference: {e}")
+                metrics.inc('inference_errors')
+                with self._lock:
+                    self.errors += 1
+            finally:
+                with self._lock:
+                    self._busy = False
+
+    @property
+    def busy(self):
+        """True while an analysis is running or waiting in the queue."""
+        with self._lock:
+            return self._busy or not self._queue.empty()
+
+    def submit(self, frame, **meta):
+        """
+        Hands a frame to the worker without blocking.
+
+        Args:
+            frame: The image to analyse. The worker keeps a reference, so don't draw on it afterwards.
+            **meta: Passed on to analyze_fn and stored with the result.
+
+        Returns:
+            bool: True if the frame was accepted, False if it was skipped.
+        """
+        if self.skip_if_busy and self.busy:
+            self.skipped += 1
+            metrics.inc('inferences_skipped', reason='busy')
+            return False
+        try:
+            self._queue.put_nowait((frame, time.time(), meta))
+        except queue.Full:
+            self.skipped += 1
+            metrics.inc('inferences_skipped', reason='busy')
+            return False
+        self.submitted += 1
+        metrics.inc('inferences_submitted')
+        return True
+
+    def latest(self):
+        """
+        Returns:
+            InferenceResult: The most recently finished analysis, or None.
+        """
+        with self._lock:
+            return self._latest
+
+    def stats(self):
+        latest = self.latest()
+        return {
+            "submitted": self.submitted,
+            "skipped": self.skipped,
+            "completed": self.completed,
+            "errors": self.errors,
+            "last_duration": latest.duration if latest else 0.0,
+        }
+
+    def print_stats(self):
+        s = self.stats()
+        print(f"Inference submitted: {s['submitted']}, skipped: {s['skipped']}, "
+              f"completed: {s['completed']}, errors: {s['errors']}, "
+              f"last duration: {s['last_duration'] * 1000:.0f} ms")
+
+    def stop(self):
+        """
+        Stops the worker. A running analysis is allowed to finish in the background.
+        """
+        self._running = False
+        # Make room for the stop signal
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout=0.1)
@@ -0,0 +1,399 @@
+"""
+Where does the time go? Latency histograms and counters for the live loop
+and the offline scripts.
+
+Stages (capture, decode, detect, classify, render, Ikaros requests, logging)
+report their durations here, and the loops count dropped frames, skipped
+inferences and faces per frame. Everything is kept in memory and can be
+read in two ways: as Prometheus text on http://127.0.0.1:<port>/metrics, and
+as a summary line printed every few seconds.
+
+Metrics are off by default. While they are off, every call below returns
+after checking a flag, so the instrumentation can stay in the hot paths.
+Stage timings are also the spans of a trace when tracing.py is recording.
+
+    import metrics
+    metrics.enable(port=9108, summary_interval=10)
+
+    with metrics.timer('detect'):
+        ...
+    metrics.inc('frames_dropped', where='reader')
+    metrics.observe('faces_per_frame', len(faces))
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import tracing
+
+METRICS_PORT = 9108
+PREFIX = "epi_"
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.15, 0.25, 0.35, 0.5,
+                   0.75, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 8, 12, 20)
+
+HELP = {
+    "stage_seconds": "Time spent in each pipeline stage.",
+    "frame_latency_seconds": "Time from capture until the frame was displayed.",
+    "faces_per_frame": "Faces shown per processed frame.",
+    "ikaros_request_seconds": "Round trip of the HTTP commands sent to Ikaros.",
+    "frames_captured": "Frames read from the video source.",
+    "frames_processed": "Frames that went through the main loop.",
+    "frames_dropped": "Frames that were replaced by a newer one before anyone used them.",
+    "inferences_submitted": "Analyses handed to the inference worker.",
+    "inferences_skipped": "Analyses that were due but dropped or delayed, by reason (busy, unchanged).",
+    "frames_not_analyzed": "Frames shown without starting an analysis.",
+    "inference_errors": "Analyses that raised an exception.",
+    "ikaros_errors": "Ikaros commands that failed or returned an error status.",
+}
+
+enabled = False
+
+_NULL_TIMER = nullcontext()
+
+
+def _label_text(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+class Counter:
+    """
+    A value that only goes up.
+    """
+
+    def __init__(self, name, labels=()):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    """
+    Counts observations in fixed buckets, plus their sum.
+
+    Args:
+        name (str): Metric name without the prefix.
+        buckets (tuple): Increasing upper bounds; larger values go in a +Inf bucket.
+        labels (tuple): (key, value) pairs that tell this series apart.
+    """
+
+    def __init__(self, name, buckets=LATENCY_BUCKETS, labels=()):
+        self.name = name
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        """
+        Returns:
+            tuple: (bucket counts, sum, count), the counts are not cumulative.
+        """
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q, counts):
+        """
+        Estimates a quantile from bucket counts by interpolating inside the bucket,
+        like Prometheus' histogram_quantile().
+        """
+        total = sum(counts)
+        if total == 0:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if seen + count >= rank and count > 0:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Registry:
+    """
+    All counters and histograms of the process, created on first use.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}  # (name, labels) -> Counter or Histogram
+        self.started_at = time.time()
+
+    def _get(self, cls, name, labels, *args):
+        key = (name, labels)
+        series = self._series.get(key)
+        if series is None:
+            with self._lock:
+                series = self._series.get(key)
+                if series is None:
+                    series = cls(name, *args, labels=labels)
+                    self._series[key] = series
+        return series
+
+    def counter(self, name, **labels):
+        return self._get(Counter, name, tuple(sorted(labels.items())))
+
+    def histogram(self, name, buckets=LATENCY_BUCKETS, **labels):
+        return self._get(Histogram, name, tuple(sorted(labels.items())), buckets)
+
+    def series(self):
+        with self._lock:
+            return sorted(self._series.values(), key=lambda s: (s.name, s.labels))
+
+    def render(self):
+        """
+        Returns:
+            str: All metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        previous = None
+        for series in self.series():
+            is_counter = isinstance(series, Counter)
+            name = PREFIX + series.name + ("_total" if is_counter else "")
+            if series.name != previous:
+                previous = series.name
+                lines.append(f"# HELP {name} {HELP.get(series.name, series.name)}")
+                lines.append(f"# TYPE {name} {'counter' if is_counter else 'histogram'}")
+            if is_counter:
+                lines.append(f"{name}{_label_text(series.labels)} {series.snapshot()}")
+                continue
+            counts, total, count = series.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(series.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_label_text(series.labels, ('le', bound))} {cumulative}")
+            lines.append(f"{name}_sum{_label_text(series.labels)} {total}")
+            lines.append(f"{name}_count{_label_text(series.labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+# -- Hot path. Each call is a flag check while metrics and tracing are disabled.
+
+def inc(name, amount=1, **labels):
+    """Adds to the counter `name`, e.g. inc('frames_dropped', where='reader')."""
+    if enabled:
+        registry.counter(name, **labels).inc(amount)
+
+
+def observe(name, value, buckets=COUNT_BUCKETS, **labels):
+    """Records a value in the histogram `name`, e.g. observe('faces_per_frame', 2)."""
+    if enabled:
+        registry.histogram(name, buckets, **labels).observe(value)
+
+
+def observe_stage(stage, seconds):
+    """Records how long a stage took, for when the duration is measured anyway."""
+    if enabled:
+        registry.histogram("stage_seconds", LATENCY_BUCKETS, stage=stage).observe(seconds)
+    if tracing.active:
+        tracing.complete(stage, time.perf_counter() - seconds, seconds)
+
+
+class _StageTimer:
+    __slots__ = ("histogram", "stage", "start")
+
+    def __init__(self, histogram, stage):
+        self.histogram = histogram
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start
+        if self.histogram is not None:
+            self.histogram.observe(duration)
+        if tracing.active:
+            tracing.complete(self.stage, self.start, duration)
+        return False
+
+
+def timer(stage):
+    """
+    Times a block as one stage:
+
+        with metrics.timer('render'):
+            ...
+    """
+    if enabled:
+        return _StageTimer(registry.histogram("stage_seconds", LATENCY_BUCKETS, stage=stage), stage)
+    if tracing.active:
+        return _StageTimer(None, stage)
+    return _NULL_TIMER
+
+
+# -- Reporting
+
+class SummaryPrinter:
+    """
+    Prints one line with what happened since the previous line: frame rate, mean and
+    95th percentile per stage, and the counters that changed.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._previous = {}
+        self._previous_time = registry.started_at
+
+    def line(self, since_start=False):
+        now = time.time()
+        elapsed = max(now - (self.registry.started_at if since_start else self._previous_time), 1e-9)
+        self._previous_time = now
+
+        stages, values, counters = [], [], []
+        for series in self.registry.series():
+            key = (series.name, series.labels)
+            current = series.snapshot()
+            previous = None if since_start else self._previous.get(key)
+            self._previous[key] = current
+            label = " ".join(str(value) for _, value in series.labels)
+
+            if isinstance(series, Counter):
+                delta = current - (previous or 0)
+                if series.name == "frames_processed":
+                    stages.insert(0, f"{delta / elapsed:.1f} fps")
+                elif delta:
+                    counters.append(f"{series.name.replace('_', ' ')}{' ' + label if label else ''} {delta}")
+                continue
+
+            counts, total, count = current
+            if previous is not None:
+                counts = [c - p for c, p in zip(counts, previous[0])]
+                total, count = total - previous[1], count - previous[2]
+            if count == 0:
+                continue
+            if series.name == "stage_seconds":
+                p95 = series.quantile(0.95, counts)
+                stages.append(f"{label} {1000 * total / count:.1f} ms (p95 {1000 * p95:.0f})")
+            elif series.name.endswith("_seconds"):
+                name = series.name[:-len("_seconds")].replace("_", " ")
+                values.append(f"{name}{' ' + label if label else ''} {1000 * total / count:.0f} ms")
+            else:
+                values.append(f"{series.name.replace('_', ' ')} {total / count:.2f}")
+
+        parts = [", ".join(group) for group in (stages, values, counters) if group]
+        return f"Metrics ({elapsed:.0f} s): " + (" | ".join(parts) if parts else "nothing recorded")
+
+
+class _Reporter:
+    def __init__(self):
+        self.server = None
+        self.summary = None
+        self._summary_thread = None
+        self._stop = threading.Event()
+
+
+_reporter = _Reporter()
+
+
+def start_server(port=METRICS_PORT, host="127.0.0.1"):
+    """
+    Serves the metrics as Prometheus text on http://host:port/metrics.
+
+    Returns:
+        ThreadingHTTPServer: The server, or None if the port could not be opened.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Keep the console quiet
+
+    try:
+        server = ThreadingHTTPServer((host, port), Handler)
+    except OSError as e:
+        print(f"Could not start the metrics endpoint on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Metrics on http://{host}:{port}/metrics")
+    return server
+
+
+def _print_summaries(interval):
+    while not _reporter._stop.wait(interval):
+        print(_reporter.summary.line())
+
+
+def enable(port=None, summary_interval=None):
+    """
+    Turns metrics on, optionally with the HTTP endpoint and a summary line every
+    `summary_interval` seconds. Calling it again only starts what isn't running yet.
+
+    Args:
+        port (int): Port for the /metrics endpoint on 127.0.0.1, None for no endpoint.
+        summary_interval (float): Seconds between summary lines, None for none.
+    """
+    global enabled
+    if not enabled:
+        registry.started_at = time.time()
+        _reporter.summary = SummaryPrinter(registry)
+    enabled = True
+    if port and _reporter.server is None:
+        _reporter.server = start_server(port)
+    if summary_interval and _reporter._summary_thread is None:
+        _reporter._stop.clear()
+        _reporter._summary_thread = threading.Thread(target=_print_summaries, args=(summary_interval,),
+                                                     name="metrics-summary", daemon=True)
+        _reporter._summary_thread.start()
+
+
+def print_summary():
+    """Prints the totals since enable(), if metrics are on."""
+    if enabled:
+        print(SummaryPrinter(registry).line(since_start=True))
+
+
+def shutdown():
+    """Stops the endpoint and the summary line. Metrics keep being recorded."""
+    _reporter._stop.set()
+    if _reporter._summary_thread is not None:
+        _reporter._summary_thread.join(timeout=1.0)
+        _reporter._summary_thread = None
+    if _reporter.server is not None:
+        _reporter.server.shutdown()
+        _reporter.server.server_close()
+        _reporter.server = None
@@ -0,0 +1,453 @@
+"""
+MJPEG-over-HTTP client for Epi's camera.
+
+cv2.VideoCapture on the MJPEG URL gives up on the first network hiccup, and
+demo_mode() and analyze_emotion_live() then just leave their loop.
+MJPEGClient reads the multipart stream itself, reconnects with exponential
+backoff when the connection drops or stalls, and decodes the JPEGs on a small
+thread pool (cv2.imdecode releases the GIL). Consumers that only analyse the
+frames can ask for a reduced-size decode (cv2.IMREAD_REDUCED_COLOR_2/4/8),
+which is several times cheaper than decoding at full size and resizing.
+
+It has the same isOpened/read/release interface as cv2.VideoCapture, and
+LatestFrameReader uses it for http(s) sources.
+
+    client = MJPEGClient('http://righteye.local:8080/stream/video.mjpeg', reduction=2)
+    ret, frame = client.read()
+
+MJPEGStubServer serves a synthetic MJPEG stream locally for testing:
+
+    python mjpeg_client.py --stub [--disconnect_after 100]
+"""
+
+import argparse
+import http.client
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import cv2
+import numpy as np
+
+import metrics
+
+CAMERA_URL = 'http://righteye.local:8080/stream/video.mjpeg'
+
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def parse_boundary(content_type):
+    """
+    Returns:
+        bytes: The part delimiter from a multipart Content-Type header, or None.
+    """
+    for param in content_type.split(";")[1:]:
+        key, _, value = param.strip().partition("=")
+        if key.lower() == "boundary" and value:
+            boundary = value.strip('"')
+            # Some cameras already put the leading dashes into the parameter
+            return boundary.encode() if boundary.startswith("--") else b"--" + boundary.encode()
+    return None
+
+
+class MultipartParser:
+    """
+    Incremental parser for multipart/x-mixed-replace bodies. Feed it whatever the
+    socket returned; it hands back the complete parts. Parts with a
+    Content-Length header are cut by length, others at the next delimiter.
+
+    Args:
+        delimiter (bytes): e.g. b'--frame', see parse_boundary().
+    """
+
+    def __init__(self, delimiter):
+        self.delimiter = delimiter
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """
+        Returns:
+            list: Bodies (bytes) of the parts completed by this data.
+        """
+        buf = self._buffer
+        buf += data
+        parts = []
+        while True:
+            start = buf.find(self.delimiter)
+            if start < 0:
+                # Nothing but filler; keep a tail that may hold the start of a delimiter
+                del buf[:max(0, len(buf) - len(self.delimiter))]
+                break
+            header_end = buf.find(b"\r\n\r\n", start)
+            if header_end < 0:
+                del buf[:start]
+                break
+
+            length = None
+            for line in bytes(buf[start + len(self.delimiter):header_end]).split(b"\r\n"):
+                key, _, value = line.partition(b":")
+                if key.strip().lower() == b"content-length":
+                    try:
+                        length = int(value.strip())
+                    except ValueError:
+                        pass
+
+            body_start = header_end + 4
+            if length is not None:
+                body_end = body_start + length
+                if len(buf) < body_end:
+                    del buf[:start]
+                    break
+            else:
+                body_end = buf.find(self.delimiter, body_start)
+                if body_end < 0:
+                    del buf[:start]
+                    break
+                # The CRLF before the next delimiter belongs to the delimiter
+                while body_end > body_start and buf[body_end - 1] in b"\r\n":
+                    body_end -= 1
+
+            parts.append(bytes(buf[body_start:body_end]))
+            del buf[:body_end]
+        return parts
+
+
+class MJPEGClient:
+    """
+    Reads an MJPEG stream on a background thread and decodes frames in a thread pool.
+
+    Args:
+        url (str): Stream URL.
+        reduction (int): 1 for full size, or 2, 4 or 8 to decode at 1/2, 1/4 or 1/8 size.
+        workers (int): Decode threads. When all are busy, new JPEGs are dropped.
+        timeout (float): Seconds before a connect or a stalled stream counts as a failure.
+        backoff_initial, backoff_max (float): Reconnect delay, doubling after each failure.
+        max_retries (int): Give up after this many failed connections in a row, None never does.
+        start (bool): Connect right away.
+    """
+
+    def __init__(self, url=CAMERA_URL, reduction=1, workers=2, timeout=5.0, backoff_initial=0.5,
+                 backoff_max=10.0, max_retries=None, start=True):
+        if reduction not in REDUCED_DECODE_FLAGS:
+            raise ValueError(f"reduction must be one of {sorted(REDUCED_DECODE_FLAGS)}")
+        self.url = url
+        self.reduction = reduction
+        self.workers = workers
+        self.timeout = timeout
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.max_retries = max_retries
+        self._flags = REDUCED_DECODE_FLAGS[reduction]
+
+        self._lock = threading.Lock()
+        self._new_frame = threading.Condition(self._lock)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mjpeg-decode")
+        self._thread = None
+        self._running = False
+        self._connection = None
+        self.failed = False
+        self.connected = False
+
+        self._in_flight = 0
+        self._next_seq = 0      # Sequence number of the next JPEG received
+        self._frame = None
+        self._frame_seq = 0     # Sequence number of the newest decoded frame
+        self._read_seq = 0
+        self.frame_time = 0.0   # time.time() when the newest decoded frame was received
+
+        # Statistics
+        self.frames_received = 0
+        self.frames_decoded = 0
+        self.frames_dropped = 0
+        self.decode_errors = 0
+        self.reconnects = 0
+        self.bytes_received = 0
+        self._decode_time = 0.0
+
+        if start:
+            self.start()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="mjpeg-reader", daemon=True)
+        self._thread.start()
+        return self
+
+    def isOpened(self):
+        return self._running and not self.failed
+
+    def _connect(self):
+        parts = urlsplit(self.url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        connection = connection_class(parts.hostname, parts.port, timeout=self.timeout)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        connection.request("GET", path)
+        response = connection.getresponse()
+        if response.status != 200:
+            connection.close()
+            raise ConnectionError(f"HTTP {response.status} {response.reason}")
+        delimiter = parse_boundary(response.getheader("Content-Type", ""))
+        if delimiter is None:
+            connection.close()
+            raise ConnectionError(f"Not a multipart stream: {response.getheader('Content-Type')}")
+        return connection, response, delimiter
+
+    def _run(self):
+        backoff = self.backoff_initial
+        failures = 0
+        while self._running:
+            try:
+                connection, response, delimiter = self._connect()
+                with self._lock:
+                    self._connection = connection
+                    self.connected = True
+                parser = MultipartParser(delimiter)
+                while self._running:
+                    data = response.read1(65536)
+                    if not data:
+                        raise ConnectionError("stream ended")
+                    self.bytes_received += len(data)
+                    for jpeg in parser.feed(data):
+                        self._submit(jpeg)
+                        # The connection works again
+                        backoff = self.backoff_initial
+                        failures = 0
+            except Exception as e:
+                if not self._running:
+                    break
+                failures += 1
+                if self.max_retries is not None and failures > self.max_retries:
+                    print(f"Giving up on MJPEG stream {self.url}: {e}")
+                    with self._lock:
+                        self.failed = True
+                        self._new_frame.notify_all()
+                    break
+                print(f"MJPEG stream {self.url} failed ({e}), reconnecting in {backoff:.1f} s")
+            finally:
+                with self._lock:
+                    if self._connection is not None:
+                        self._connection.close()
+                        self._connection = None
+                    self.connected = False
+            if not self._running:
+                break
+
+            with self._lock:
+                # Wait for the backoff, or until release() wakes us up
+                self._new_frame.wait_for(lambda: not self._running, backoff)
+            backoff = min(backoff * 2, self.backoff_max)
+            self.reconnects += 1
+
+    def _submit(self, jpeg):
+        with self._lock:
+            self.frames_received += 1
+            if self._in_flight >= self.workers:
+                self.frames_dropped += 1
+                metrics.inc('frames_dropped', where='decoder')
+                return
+            self._in_flight += 1
+            self._next_seq += 1
+            seq = self._next_seq
+        self._pool.submit(self._decode, seq, jpeg, time.time())
+
+    def _decode(self, seq, jpeg, received_at):
+        start = time.perf_counter()
+        frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), self._flags)
+        duration = time.perf_counter() - start
+        metrics.observe_stage('decode', duration)
+        with self._lock:
+            self._in_flight -= 1
+            self._decode_time += duration
+            if frame is None:
+                self.decode_errors += 1
+                return
+            self.frames_decoded += 1
+            # A later JPEG may have finished first; never go back in time
+            if seq > self._frame_seq:
+                self._frame = frame
+                self._frame_seq = seq
+                self.frame_time = received_at
+                self._new_frame.notify_all()
+
+    def read(self, timeout=None):
+        """
+        Returns the newest decoded frame not returned before, waiting for one if needed.
+        Blocks through reconnects.
+
+        Args:
+            timeout (float): Seconds to wait, None waits until a frame arrives or the client stops.
+
+        Returns:
+            tuple: (ret, frame) like cv2.VideoCapture.read().
+        """
+        with self._lock:
+            self._new_frame.wait_for(
+                lambda: self._frame_seq > self._read_seq or self.failed or not self._running,
+                timeout
+            )
+            if self._frame_seq == self._read_seq:
+                return False, None
+            self._read_seq = self._frame_seq
+            return True, self._frame
+
+    def stats(self):
+        decoded = self.frames_decoded
+        return {
+            "frames_received": self.frames_received,
+            "frames_decoded": decoded,
+            "frames_dropped": self.frames_dropped,
+            "decode_errors": self.decode_errors,
+            "reconnects": self.reconnects,
+            "bytes_received": self.bytes_received,
+            "mean_decode_ms": 1000 * self._decode_time / decoded if decoded else 0.0,
+        }
+
+    def print_stats(self):
+        s = self.stats()
+        print(f"MJPEG: {s['frames_received']} received, {s['frames_decoded']} decoded, "
+              f"{s['frames_dropped']} dropped, {s['decode_errors']} decode errors, "
+              f"{s['reconnects']} reconnects, decode mean {s['mean_decode_ms']:.1f} ms")
+
+    def release(self):
+        """Stops reading and closes the connection."""
+        with self._lock:
+            self._running = False
+            if self._connection is not None:
+                # Unblocks the reader thread if it is waiting for data
+                self._connection.close()
+            self._new_frame.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+        self._pool.shutdown(wait=False)
+
+
+def synthetic_frames(count=30, width=640, height=480):
+    """
+    JPEG-encoded test frames: a moving bright square on a gradient, numbered.
+    """
+    background = np.tile(np.linspace(40, 200, width, dtype=np.uint8)[None, :, None], (height, 1, 3))
+    frames = []
+    for i in range(count):
+        frame = background.copy()
+        x = int((width - 100) * i / max(1, count - 1))
+        cv2.rectangle(frame, (x, height // 2 - 50), (x + 100, height // 2 + 50), (255, 255, 255), -1)
+        cv2.putText(frame, str(i), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 255), 2)
+        frames.append(cv2.imencode(".jpg", frame)[1].tobytes())
+    return frames
+
+
+class MJPEGStubServer:
+    """
+    Local stand-in for Epi's camera, serving JPEGs as multipart/x-mixed-replace.
+
+        stub = MJPEGStubServer(port=8081).start()
+        client = MJPEGClient(stub.url)
+
+    Args:
+        port (int): Port to listen on, on 127.0.0.1.
+        fps (float): Frame rate of the stream.
+        frames (list): JPEG bytes to loop over, defaults to synthetic_frames().
+        disconnect_after (int): Close each connection after this many frames, to test reconnects.
+        content_length (bool): Send a Content-Length header with every part.
+    """
+
+    def __init__(self, port=8081, fps=25.0, frames=None, disconnect_after=None, content_length=True):
+        self.port = port
+        self.fps = fps
+        self.frames = frames if frames is not None else synthetic_frames()
+        self.disconnect_after = disconnect_after
+        self.content_length = content_length
+        self.connections = 0
+        self.frames_sent = 0
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}/stream/video.mjpeg"
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.connections += 1
+                self.send_response(200)
+                self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+                self.end_headers()
+                sent = 0
+                try:
+                    while stub.disconnect_after is None or sent < stub.disconnect_after:
+                        jpeg = stub.frames[stub.frames_sent % len(stub.frames)]
+                        headers = b"--frame\r\nContent-Type: image/jpeg\r\n"
+                        if stub.content_length:
+                            headers += f"Content-Length: {len(jpeg)}\r\n".encode()
+                        self.wfile.write(headers + b"\r\n" + jpeg + b"\r\n")
+                        sent += 1
+                        stub.frames_sent += 1
+                        time.sleep(1.0 / stub.fps)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # Client went away
+
+            def log_message(self, format, *args):
+                pass  # Keep the console quiet
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mjpeg-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read an MJPEG stream and print its statistics.")
+    parser.add_argument("--url", default=CAMERA_URL, help="Stream URL.")
+    parser.add_argument("--reduction", type=int, default=1, choices=sorted(REDUCED_DECODE_FLAGS),
+                        help="Decode at 1/reduction of the full size.")
+    parser.add_argument("--seconds", type=float, default=10.0, help="How long to read.")
+    parser.add_argument("--stub", action="store_true", help="Read from a local stub stream instead.")
+    parser.add_argument("--stub_port", type=int, default=8081, help="Port for the stub stream.")
+    parser.add_argument("--disconnect_after", type=int, default=None,
+                        help="Stub drops the connection after this many frames.")
+    parser.add_argument("--display", action="store_true", help="Show the frames.")
+    args = parser.parse_args()
+
+    stub = MJPEGStubServer(args.stub_port, disconnect_after=args.disconnect_after).start() if args.stub else None
+    client = MJPEGClient(stub.url if stub else args.url, reduction=args.reduction)
+    frames = 0
+    shape = None
+    end = time.time() + args.seconds
+    try:
+        while time.time() < end:
+            ret, frame = client.read(timeout=1.0)
+            if not ret:
+                continue
+            frames += 1
+            shape = frame.shape
+            if args.display:
+                cv2.imshow("MJPEG", frame)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+    except KeyboardInterrupt:
+        pass
+    client.release()
+    if stub:
+        stub.stop()
+    if args.display:
+        cv2.destroyAllWindows()
+    print(f"Read {frames} frames of shape {shape} in {args.seconds:.0f} s")
+    client.print_stats()
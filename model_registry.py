@@ -0,0 +1,132 @@
+"""
+Preloaded DeepFace models.
+
+DeepFace builds its detector, emotion and recognition models lazily on the
+first analyze/extract_faces/verify call, which puts a multi-second stall into
+the first live frame. warm_up_models() builds the chosen models once at
+startup and runs a dummy inference through each of them, so TensorFlow has
+traced its graphs before the first real frame arrives. DeepFace caches built
+models internally, so every later DeepFace call in this process (recognition.py,
+pipeline.py and the offline scripts) reuses them.
+"""
+
+import time
+
+import numpy as np
+from deepface import DeepFace
+
+
+class ModelRegistry:
+    """
+    Keeps the built models and how long they took to load.
+
+    Attributes:
+        models (dict): (task, model_name) -> model object returned by DeepFace.build_model.
+        build_times (dict): (task, model_name) -> seconds spent building the model.
+        first_inference_times (dict): (task, model_name) -> seconds for the warm-up inference.
+    """
+
+    def __init__(self):
+        self.models = {}
+        self.build_times = {}
+        self.first_inference_times = {}
+
+    def get(self, task, model_name):
+        """
+        Returns the model, building it if it has not been loaded yet.
+        """
+        key = (task, model_name)
+        if key not in self.models:
+            start = time.perf_counter()
+            self.models[key] = DeepFace.build_model(model_name=model_name, task=task)
+            self.build_times[key] = time.perf_counter() - start
+        return self.models[key]
+
+    def detector(self, detector_backend):
+        return self.get("face_detector", detector_backend)
+
+    def emotion_model(self):
+        return self.get("facial_attribute", "Emotion")
+
+    def recognition_model(self, model_name):
+        return self.get("facial_recognition", model_name)
+
+    def _first_inference(self, key, fn):
+        if key in self.first_inference_times:
+            return
+        start = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            print(f"Warm-up of {key[1]} failed: {e}")
+        self.first_inference_times[key] = time.perf_counter() - start
+
+    def warm_up(self, detector_backend='retinaface', emotion=True, recognition_model=None):
+        """
+        Builds the given models and runs one dummy inference through each.
+        Models that are already warm are skipped.
+
+        Args:
+            detector_backend (str): DeepFace detector to load, None to skip.
+            emotion (bool): Load the emotion classifier.
+            recognition_model (str): Face recognition model to load, e.g. 'Facenet', None to skip.
+        """
+        dummy_frame = np.zeros((480, 640, 3), dtype=np.uint8)
+        dummy_face = np.full((224, 224, 3), 128, dtype=np.uint8)
+
+        if detector_backend and detector_backend != 'skip':
+            self.detector(detector_backend)
+            self._first_inference(
+                ("face_detector", detector_backend),
+                lambda: DeepFace.extract_faces(img_path=dummy_frame, detector_backend=detector_backend,
+                                               enforce_detection=False)
+            )
+
+        if emotion:
+            self.emotion_model()
+            self._first_inference(
+                ("facial_attribute", "Emotion"),
+                lambda: DeepFace.analyze(img_path=dummy_face, actions=['emotion'], detector_backend='skip',
+                                         enforce_detection=False, silent=True)
+            )
+
+        if recognition_model:
+            self.recognition_model(recognition_model)
+            self._first_inference(
+                ("facial_recognition", recognition_model),
+                lambda: DeepFace.represent(img_path=dummy_face, model_name=recognition_model,
+                                           detector_backend='skip', enforce_detection=False)
+            )
+        return self
+
+    def print_report(self):
+        for key in self.models:
+            task, model_name = key
+            build_ms = 1000 * self.build_times.get(key, 0.0)
+            first_ms = 1000 * self.first_inference_times.get(key, 0.0)
+            print(f"{model_name} ({task}): startup {build_ms:.0f} ms, first inference {first_ms:.0f} ms")
+
+
+_registry = ModelRegistry()
+
+
+def get_registry():
+    """
+    Returns the process-wide model registry.
+    """
+    return _registry
+
+
+def warm_up_models(detector_backend='retinaface', emotion=True, recognition_model=None, report=True):
+    """
+    Loads and warms up models in the shared registry, see ModelRegistry.warm_up.
+
+    Returns:
+        ModelRegistry: The shared registry.
+    """
+    start = time.perf_counter()
+    registry = _registry.warm_up(detector_backend, emotion, recognition_model)
+    if report:
+        registry.print_report()
+        print(f"Models ready in {time.perf_counter() - start:.1f} s")
+    return registry
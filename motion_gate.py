@@ -0,0 +1,77 @@
+"""
+Cheap change detection in front of face analysis.
+
+Epi often looks at a static room. ChangeDetector compares a tiny, blurred
+grayscale copy of each frame with the frame that was last analysed, and only
+lets a new analysis through when the picture changed enough. Otherwise the
+caller reuses its previous result.
+"""
+
+import cv2
+import numpy as np
+
+import metrics
+
+
+class ChangeDetector:
+    """
+    Downsampled frame differencing.
+
+    Args:
+        size (tuple): (width, height) frames are shrunk to before comparing.
+        threshold (float): Mean absolute difference in gray levels (0-255) that counts as a change.
+        max_skips (int): Force an analysis after this many skipped ones in a row, so results
+            never get arbitrarily old. None disables the limit.
+    """
+
+    def __init__(self, size=(64, 48), threshold=4.0, max_skips=10):
+        self.size = size
+        self.threshold = threshold
+        self.max_skips = max_skips
+        self.reference = None
+        self.last_difference = 0.0
+        self._skips_in_row = 0
+
+        # Statistics
+        self.checked = 0
+        self.skipped = 0
+
+    def _thumbnail(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        small = cv2.resize(gray, self.size, interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(small, (3, 3), 0)
+
+    def should_analyze(self, frame):
+        """
+        Decides whether the frame needs a new analysis. If it does, the frame becomes the
+        new reference, so call this only when you are going to analyse the frame.
+
+        Returns:
+            bool: True if the frame changed enough (or was never analysed), False if the
+            previous result can be reused.
+        """
+        self.checked += 1
+        thumbnail = self._thumbnail(frame)
+        if self.reference is not None:
+            self.last_difference = float(np.mean(cv2.absdiff(thumbnail, self.reference)))
+            forced = self.max_skips is not None and self._skips_in_row >= self.max_skips
+            if self.last_difference < self.threshold and not forced:
+                self.skipped += 1
+                self._skips_in_row += 1
+                metrics.inc('inferences_skipped', reason='unchanged')
+                return False
+
+        self.reference = thumbnail
+        self._skips_in_row = 0
+        return True
+
+    def reset(self):
+        self.reference = None
+        self._skips_in_row = 0
+
+    def stats(self):
+        return {"checked": self.checked, "skipped": self.skipped}
+
+    def print_stats(self):
+        saved = 100 * self.skipped / self.checked if self.checked else 0.0
+        print(f"Change detector: {self.skipped} of {self.checked} analyses skipped ({saved:.0f}% saved)")
@@ -6,16 +6,22 @@ Created on Tue Oct 29 23:53:38 2024
 
 import os
 import cv2
-import csv
-import uuid
-from datetime import datetime
+import shutil
 import sys
+import numpy as np
+from contacts_db import ContactRegistry
+from face_index import FaceIndex, embed_image, indexed_models
 
 #%%
 
 # Path to save the database
 DB_PATH = "./db"
-CSV_FILE = "./contacts.csv"
+# Contact ids and names, imported from contacts.csv on first use
+CONTACTS_DB = "./contacts.db"
+
+# Embeddings are computed at enrollment with this model and detector
+MODEL_NAME = "Facenet"
+DETECTOR_BACKEND = "retinaface"
 
 #%%
 
@@ -23,78 +29,117 @@ CSV_FILE = "./contacts.csv"
 if not os.path.exists(DB_PATH):
     os.makedirs(DB_PATH)
 
-# Create CSV file if it doesn't exist
-if not os.path.exists(CSV_FILE):
-    with open(CSV_FILE, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        # Write the header row to the CSV file
-        writer.writerow(["id", "name", "creation_time"])
-        
 #%% 
 
-def generate_unique_id():
-    """
-    Generate a unique 4-character ID.
-    The function will keep generating until it finds an ID that is not already in use.
-    """
-    while True:
-        new_id = str(uuid.uuid4().hex[:4])  # Generate a 4-character unique ID
-        if not is_id_in_csv(new_id):  # Ensure the ID is unique
-            return new_id
+# Seek instead of grabbing when the next frame to keep is more than this many seconds ahead.
+# Seeking decodes from the previous keyframe, phone videos have one every 1-2 seconds.
+SEEK_SECONDS = 2.0
 
-def is_id_in_csv(contact_id):
-    """
-    Check if a given contact ID already exists in the CSV file.
-    :param contact_id: The ID to check for existence.
-    :return: True if the ID exists, False otherwise.
-    """
-    with open(CSV_FILE, mode='r', newline='') as file:
-        reader = csv.reader(file)
-        next(reader)  # Skip the header row
-        for row in reader:
-            if row[0] == contact_id:  # Check if the ID matches
-                return True
-    return False
-
-def add_contact_to_csv(contact_id, name):
+def _ends_after(cap, count):
+    """True if frame count-1 can be read and nothing after it."""
+    return count > 0 and cap.set(cv2.CAP_PROP_POS_FRAMES, count - 1) and cap.grab() and not cap.grab()
+
+def count_video_frames(video_path):
     """
-    Add a new contact to the CSV file with the current timestamp.
-    :param contact_id: The unique ID of the contact.
-    :param name: The name of the contact.
+    Number of frames in a video. CAP_PROP_FRAME_COUNT comes from the container header
+    and is wrong for some files (0, or an estimate from the bitrate), so it is checked
+    by seeking to the last frame it claims. If that fails, the length is taken from
+    the stream by seeking to its end, and checked the same way. Counting the frames
+    with grab(), which decodes all of them, is the last resort.
+    :param video_path: Path to the video file.
+    :return: Number of frames that can actually be read, 0 if the file can't be opened.
     """
-    creation_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # Get the current date and time
-    with open(CSV_FILE, mode='a', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow([contact_id, name, creation_time])  # Write the contact information to the CSV file
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return 0
+    reported = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if _ends_after(cap, reported):
+        cap.release()
+        return reported
+
+    # Seek to the end of the stream and see where we are
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    estimate = 0
+    if cap.set(cv2.CAP_PROP_POS_AVI_RATIO, 1):
+        estimate = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+        if estimate <= 0 and fps > 0:
+            estimate = round(cap.get(cv2.CAP_PROP_POS_MSEC) * fps / 1000) + 1
+    if estimate != reported and _ends_after(cap, estimate):
+        cap.release()
+        print(f"{video_path} reports {reported} frames but has {estimate}")
+        return estimate
+
+    # Start over, seeking back is not reliable either in such files
+    cap.release()
+    print(f"Warning: the length of {video_path} is unknown, reading the whole video to count its frames")
+    cap = cv2.VideoCapture(video_path)
+    count = 0
+    while cap.grab():
+        count += 1
+    cap.release()
+    return count
 
 def extract_frames_from_video(video_path, output_folder, num_frames=10):
     """
-    Extract a specified number of frames from a video file.
+    Extract a specified number of frames from a video file, evenly spaced over the video.
+    Only the kept frames are decoded: the frames in between are skipped with grab(), or
+    by seeking when the next frame to keep is far enough ahead.
     :param video_path: Path to the video file.
     :param output_folder: Folder where the frames will be saved.
     :param num_frames: Number of frames to extract from the video.
+    :return: List of (filename, frame) tuples for the saved frames.
     """
-    cap = cv2.VideoCapture(video_path)  # Open the video file
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))  # Get the total number of frames in the video
+    total_frames = count_video_frames(video_path)
     frame_interval = max(1, total_frames // num_frames)  # Calculate the interval between frames to extract
+    targets = range(0, min(total_frames, frame_interval * num_frames), frame_interval)
 
-    frame_count = 0
-    extracted_count = 0
-
-    while cap.isOpened() and extracted_count < num_frames:
-        ret, frame = cap.read()  # Read the next frame from the video
-        if not ret:  # If no frame is returned, end of video is reached
+    cap = cv2.VideoCapture(video_path)  # Open the video file
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    seek_frames = SEEK_SECONDS * fps if fps > 0 else frame_interval
+    position = 0  # Index of the frame the next grab() returns
+    extracted = []
+
+    for target in targets:
+        if target - position > seek_frames and cap.set(cv2.CAP_PROP_POS_FRAMES, target):
+            position = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+        # Skip to the target without decoding the frames in between to images
+        while position < target and cap.grab():
+            position += 1
+        if position < target:  # The video ended early
             break
+        # A seek that lands past the target (on an inexact keyframe) keeps the frame it landed on
 
-        # Save the frame if it matches the extraction interval
-        if frame_count % frame_interval == 0:
-            frame_filename = f"{output_folder}_{extracted_count+1:02d}.jpg"  # Generate filename for the frame
-            cv2.imwrite(frame_filename, frame)  # Save the frame as a JPEG image
-            extracted_count += 1  # Increment the count of extracted frames
-
-        frame_count += 1  # Increment the total frame count
+        ret, frame = cap.read()
+        if not ret:
+            break
+        position += 1
+        frame_filename = f"{output_folder}_{len(extracted)+1:02d}.jpg"  # Generate filename for the frame
+        cv2.imwrite(frame_filename, frame)  # Save the frame as a JPEG image
+        extracted.append((frame_filename, frame))
 
     cap.release()  # Release the video capture object
+    return extracted
+
+def add_embeddings_to_index(contact_id, frames):
+    """
+    Compute face embeddings for a contact's frames and append them to the index.
+    Only this contact's frames are processed, the rest of the index is left as is.
+    :param contact_id: The unique ID of the contact.
+    :param frames: List of (filename, frame) tuples from extract_frames_from_video.
+    :return: Number of embeddings added.
+    """
+    embeddings, sources = [], []
+    for filename, frame in frames:
+        embedding = embed_image(frame, MODEL_NAME, DETECTOR_BACKEND)  # Largest face in the frame
+        if embedding is None:
+            print(f"No face found in {filename}")
+            continue
+        embeddings.append(embedding)
+        sources.append(filename)
+
+    if not embeddings:
+        return 0
+    return FaceIndex(DB_PATH, MODEL_NAME).add(contact_id, np.stack(embeddings), sources)
 
 def process_video(video_path, name):
     """
@@ -102,21 +147,68 @@ def process_video(video_path, name):
     :param video_path: Path to the video file.
     :param name: Name of the person in the video.
     """
-    # Generate a unique ID for the new contact
-    contact_id = generate_unique_id()
+    # Register the contact first, so enrollments running in parallel never get the same ID.
+    # The registry and the face index both lock, so several enrollments can run at once.
+    registry = ContactRegistry(CONTACTS_DB)
+    contact_dir = None
+    try:
+        contact_id = registry.add(name)
+
+        # Create a directory for the contact
+        contact_dir = os.path.join(DB_PATH, contact_id)
+        if not os.path.exists(contact_dir):
+            os.makedirs(contact_dir)
+
+        # Extract frames from the video and save them to the contact's folder
+        frames = extract_frames_from_video(video_path, os.path.join(contact_dir, contact_id))
+        if not frames:
+            raise ValueError(f"No frames could be read from {video_path}")
+
+        # Embed the faces now, so recognition never has to rebuild the database
+        added = add_embeddings_to_index(contact_id, frames)
+        if not added:
+            raise ValueError(f"No faces found in {video_path}")
+    except Exception as e:
+        # Don't leave a contact behind that can never be recognized
+        if contact_dir is not None:
+            registry.remove(contact_id)
+            shutil.rmtree(contact_dir, ignore_errors=True)
+        print(f"Could not add {name}: {e}")
+        return
+    finally:
+        registry.close()
+
+    print(f"Added {name} with ID {contact_id} ({added} embeddings)")
+
+def delete_contact(contact_id):
+    """
+    Delete a contact: its registry entry, its image folder and its embeddings in every index.
+    :param contact_id: The ID of the contact to delete.
+    """
+    registry = ContactRegistry(CONTACTS_DB)
+    found = registry.remove(contact_id)
+    registry.close()
 
-    # Create a directory for the contact
     contact_dir = os.path.join(DB_PATH, contact_id)
-    if not os.path.exists(contact_dir):
-        os.makedirs(contact_dir)
+    if os.path.isdir(contact_dir):
+        shutil.rmtree(contact_dir)
+        found = True
 
-    # Extract frames from the video and save them to the contact's folder
-    extract_frames_from_video(video_path, os.path.join(contact_dir, contact_id))
+    for model_name in indexed_models(DB_PATH):
+        if FaceIndex(DB_PATH, model_name).remove(contact_id):
+            found = True
 
-    # Add contact details to the CSV file
-    add_contact_to_csv(contact_id, name)
+    if found:
+        print(f"Deleted contact {contact_id}")
+    else:
+        print(f"No contact with ID {contact_id}")
   
 def main():
+    # Delete a contact: python mov-to-db.py --delete <id>
+    if len(sys.argv) > 2 and sys.argv[1] == "--delete":
+        delete_contact(sys.argv[2])
+        return
+
     # Check if command-line arguments are provided
     if len(sys.argv) > 2:
         # Get arguments from the command line
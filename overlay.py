@@ -0,0 +1,135 @@
+"""
+Face and emotion overlay drawing, shared by demo_mode() and video_overlay.py.
+
+The old drawing code did `overlay = frame.copy()` plus a full-frame
+cv2.addWeighted for every face, i.e. two full-frame passes per person.
+OverlayRenderer draws into the frame in place: the translucent panel is
+blended only inside its own rectangle through a preallocated scratch buffer,
+and the panel text (emotion names and the "Dominant: ..." line) is rendered
+once per dominant emotion and then composited into the frame.
+"""
+
+import cv2
+import numpy as np
+
+EMOTION_ORDER = ["angry", "disgust", "fear", "happy", "sad", "surprise", "neutral"]
+
+BOX_COLOR = (0, 255, 0)
+TEXT_COLOR = (255, 255, 255)
+BAR_COLOR = (255, 255, 255)
+DOMINANT_BAR_COLOR = (0, 255, 255)
+
+
+class OverlayRenderer:
+    """
+    Draws face boxes, name labels and emotion bar panels onto frames in place.
+
+    Args:
+        panel_width, panel_height (int): Size of the emotion panel next to each face.
+        alpha (float): Opacity of the black panel background.
+    """
+
+    def __init__(self, panel_width=210, panel_height=240, alpha=0.5):
+        self.panel_width = panel_width
+        self.panel_height = panel_height
+        self.alpha = alpha
+
+        # Layout, same as the original overlay code
+        self.bar_left = 80
+        self.bar_top = 40
+        self.bar_height = 12
+        self.bar_gap = 15
+        self.bar_max_length = 100
+
+        # Reused for every panel
+        self._scratch = np.empty((panel_height, panel_width, 3), dtype=np.uint8)
+        self._text_cache = {}
+
+    def _panel_text(self, dominant_emotion):
+        """
+        White-on-black image with all static panel text for one dominant emotion.
+        """
+        text = self._text_cache.get(dominant_emotion)
+        if text is None:
+            text = np.zeros((self.panel_height, self.panel_width, 3), dtype=np.uint8)
+            cv2.putText(text, f"Dominant: {dominant_emotion}", (5, 20),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, TEXT_COLOR, 1)
+            for i, emo_name in enumerate(EMOTION_ORDER):
+                top_y = self.bar_top + i * (self.bar_height + self.bar_gap)
+                cv2.putText(text, emo_name, (5, top_y + self.bar_height - 2),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.4, TEXT_COLOR, 1)
+            self._text_cache[dominant_emotion] = text
+        return text
+
+    def draw_face(self, frame, box, label, emotions, dominant_emotion):
+        """
+        Draws one face: box, label above it and the emotion panel to its right.
+
+        Args:
+            frame: BGR image, modified in place.
+            box (tuple): (x, y, w, h) in pixels.
+            label (str): Text above the box, e.g. a name or track id.
+            emotions (dict): Emotion name -> score in percent.
+            dominant_emotion (str): Shown in the panel and highlighted in the bars.
+        """
+        x, y, w, h = (int(v) for v in box)
+        cv2.rectangle(frame, (x, y), (x + w, y + h), BOX_COLOR, 2)
+        cv2.putText(frame, str(label), (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, BOX_COLOR, 2)
+
+        # Panel rectangle, clipped to the frame
+        panel_x, panel_y = x + w + 10, y
+        frame_h, frame_w = frame.shape[:2]
+        x1, y1 = max(0, panel_x), max(0, panel_y)
+        x2 = min(frame_w, panel_x + self.panel_width + 1)
+        y2 = min(frame_h, panel_y + self.panel_height + 1)
+        if x2 <= x1 or y2 <= y1:
+            return
+
+        # Translucent black background: blend only the panel ROI
+        roi = frame[y1:y2, x1:x2]
+        scratch = self._scratch_for(y2 - y1, x2 - x1)
+        cv2.convertScaleAbs(roi, dst=scratch, alpha=1 - self.alpha)
+        roi[...] = scratch
+
+        # Cached text, cut to the visible part of the panel. Its pixel values are
+        # the text coverage, so roi += (255 - roi) * coverage / 255 paints it white
+        # (putText may anti-alias, so a plain OR isn't enough).
+        text = self._panel_text(dominant_emotion)
+        tx, ty = x1 - panel_x, y1 - panel_y
+        visible_text = text[ty:ty + (y2 - y1), tx:tx + (x2 - x1)]
+        th, tw = visible_text.shape[:2]
+        roi, scratch = roi[:th, :tw], scratch[:th, :tw]
+        cv2.bitwise_not(roi, dst=scratch)
+        cv2.multiply(scratch, visible_text, dst=scratch, scale=1 / 255)
+        cv2.add(roi, scratch, dst=roi)
+
+        # Bars change every frame, draw them directly
+        dominant = dominant_emotion.lower()
+        for i, emo_name in enumerate(EMOTION_ORDER):
+            emo_val = emotions.get(emo_name, 0.0)
+            bar_length = int(min(emo_val, 100) / 100 * self.bar_max_length)
+            top_y = panel_y + self.bar_top + i * (self.bar_height + self.bar_gap)
+            color = DOMINANT_BAR_COLOR if emo_name == dominant else BAR_COLOR
+            cv2.rectangle(frame, (panel_x + self.bar_left, top_y),
+                          (panel_x + self.bar_left + bar_length, top_y + self.bar_height), color, -1)
+
+    def _scratch_for(self, height, width):
+        if height > self._scratch.shape[0] or width > self._scratch.shape[1]:
+            self._scratch = np.empty((max(height, self._scratch.shape[0]),
+                                      max(width, self._scratch.shape[1]), 3), dtype=np.uint8)
+        return self._scratch[:height, :width]
+
+    def draw(self, frame, faces):
+        """
+        Draws several faces.
+
+        Args:
+            frame: BGR image, modified in place.
+            faces (list): (box, label, emotions, dominant_emotion) tuples.
+
+        Returns:
+            The same frame, for convenience.
+        """
+        for box, label, emotions, dominant_emotion in faces:
+            self.draw_face(frame, box, label, emotions, dominant_emotion)
+        return frame
@@ -0,0 +1,318 @@
+"""
+Two-stage face analysis: detect faces, then classify emotion on the crops.
+
+DeepFace.analyze runs the detector on the full frame on every call, even when
+we already know where the faces are. EmotionPipeline splits the work so the
+expensive detector (retinaface/mtcnn) only runs every `detect_every` analyses,
+while the cheap emotion CNN runs on crops taken from a tracker or from the
+previous detection. Results have the same shape as DeepFace.analyze, so the
+overlay, tracker and CSV code can use either.
+"""
+
+import time
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+from deepface import DeepFace
+
+import metrics
+from model_registry import get_registry
+
+EMOTION_LABELS = ["angry", "disgust", "fear", "happy", "sad", "surprise", "neutral"]
+
+
+class StageTimer:
+    """
+    Collects wall-clock time per pipeline stage.
+
+    Usage:
+        with timer.stage('detect'):
+            ...
+    """
+
+    def __init__(self):
+        self.totals = {}
+        self.counts = {}
+        self.last = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        metrics.observe_stage(name, seconds)
+        self.totals[name] = self.totals.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+        self.last[name] = seconds
+
+    def summary(self):
+        """
+        Returns:
+            dict: stage name -> {'count', 'mean_ms', 'last_ms'}
+        """
+        return {
+            name: {
+                "count": self.counts[name],
+                "mean_ms": 1000 * self.totals[name] / self.counts[name],
+                "last_ms": 1000 * self.last[name],
+            }
+            for name in self.totals
+        }
+
+    def print_summary(self):
+        for name, s in self.summary().items():
+            print(f"{name}: {s['count']} calls, mean {s['mean_ms']:.1f} ms, last {s['last_ms']:.1f} ms")
+
+
+def _to_bgr_uint8(face):
+    """
+    DeepFace.extract_faces returns RGB floats in [0, 1]; the rest of the code works on BGR uint8.
+    """
+    if face.dtype != np.uint8:
+        face = np.clip(face * 255, 0, 255).astype(np.uint8)
+    return np.ascontiguousarray(face[:, :, ::-1])
+
+
+def downscale(frame, max_width):
+    """
+    Shrinks a frame to at most max_width pixels wide, keeping the aspect ratio.
+
+    Returns:
+        tuple: (image, scale) where scale is the factor from original to image coordinates.
+    """
+    height, width = frame.shape[:2]
+    if not max_width or width <= max_width:
+        return frame, 1.0
+    scale = max_width / width
+    small = cv2.resize(frame, (max_width, max(1, int(round(height * scale)))), interpolation=cv2.INTER_AREA)
+    return small, scale
+
+
+def detect_faces(frame, detector_backend='retinaface', align=True, detection_width=None):
+    """
+    Runs only the face detector.
+
+    Args:
+        frame: BGR image.
+        detector_backend (str): Any DeepFace detector ('retinaface', 'mtcnn', 'opencv', ...).
+        align (bool): Rotate the crops so the eyes are level.
+        detection_width (int): Detect on a copy downscaled to this width. Boxes are mapped
+            back to the original frame and the crops are cut from it at full resolution
+            (unaligned). None detects at full resolution.
+
+    Returns:
+        list: Dicts with 'box' (x, y, w, h) in original pixels, 'face' (BGR uint8 crop)
+        and 'confidence'.
+    """
+    image, scale = downscale(frame, detection_width)
+    faces = DeepFace.extract_faces(img_path=image, detector_backend=detector_backend,
+                                   enforce_detection=False, align=align)
+    detections = []
+    for face in faces:
+        # With enforce_detection=False DeepFace returns the whole frame when nothing is found
+        if face.get('confidence', 0) == 0:
+            continue
+        area = face['facial_area']
+        box = (area['x'], area['y'], area['w'], area['h'])
+        if scale == 1.0:
+            crop = _to_bgr_uint8(face['face'])
+        else:
+            # Back to original pixels, with a sharper crop from the full frame
+            crops = crop_faces(frame, [tuple(v / scale for v in box)])
+            if not crops:
+                continue
+            box, crop = crops[0]
+        detections.append({'box': box, 'face': crop, 'confidence': face['confidence']})
+    return detections
+
+
+def crop_faces(frame, boxes, margin=0.0):
+    """
+    Cuts face regions out of a frame, e.g. boxes from a tracker.
+
+    Args:
+        frame: BGR image.
+        boxes (list): (x, y, w, h) boxes, floats are fine.
+        margin (float): Extra border around each box, relative to its size.
+
+    Returns:
+        list: (box, crop) tuples with the box clipped to the frame. Boxes
+        outside the frame are left out.
+    """
+    height, width = frame.shape[:2]
+    crops = []
+    for box in boxes:
+        x, y, w, h = box
+        mx, my = w * margin, h * margin
+        x1, y1 = max(0, int(round(x - mx))), max(0, int(round(y - my)))
+        x2, y2 = min(width, int(round(x + w + mx))), min(height, int(round(y + h + my)))
+        if x2 - x1 < 2 or y2 - y1 < 2:
+            continue
+        crops.append(((x1, y1, x2 - x1, y2 - y1), frame[y1:y2, x1:x2]))
+    return crops
+
+
+def classify_emotion(face):
+    """
+    Runs only the emotion model on an already cropped face.
+
+    Args:
+        face: BGR crop of a single face.
+
+    Returns:
+        dict: 'emotion' (scores per label, in percent) and 'dominant_emotion'.
+    """
+    result = DeepFace.analyze(img_path=face, actions=['emotion'], detector_backend='skip',
+                              enforce_detection=False, silent=True)
+    return {'emotion': result[0]['emotion'], 'dominant_emotion': result[0]['dominant_emotion']}
+
+
+def _emotion_input(face):
+    """
+    Prepares a BGR crop the way DeepFace's emotion model expects it: padded to a
+    square, grayscale, 48x48 and scaled to [0, 1].
+    """
+    gray = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape
+    size = max(h, w)
+    square = np.zeros((size, size), dtype=np.uint8)
+    top, left = (size - h) // 2, (size - w) // 2
+    square[top:top + h, left:left + w] = gray
+    return cv2.resize(square, (48, 48)).astype(np.float32) / 255.0
+
+
+def classify_emotions(faces):
+    """
+    Classifies emotion for many face crops with a single forward pass.
+
+    Args:
+        faces (list): BGR crops, any size.
+
+    Returns:
+        list: One dict per crop with 'emotion' (scores per label, in percent) and
+        'dominant_emotion', like classify_emotion().
+    """
+    if not faces:
+        return []
+    batch = np.stack([_emotion_input(face) for face in faces])[..., np.newaxis]
+    model = get_registry().emotion_model().model
+    predictions = np.asarray(model(batch, training=False))
+
+    results = []
+    for scores in predictions:
+        scores = 100 * scores / scores.sum()
+        results.append({
+            'emotion': {label: float(score) for label, score in zip(EMOTION_LABELS, scores)},
+            'dominant_emotion': EMOTION_LABELS[int(np.argmax(scores))],
+        })
+    return results
+
+
+def build_result(box, confidence, emotion):
+    """
+    Combines a face box and its emotion into a DeepFace.analyze style dict.
+    """
+    x, y, w, h = (int(round(v)) for v in box)
+    return {
+        'region': {'x': x, 'y': y, 'w': w, 'h': h},
+        'emotion': emotion['emotion'],
+        'dominant_emotion': emotion['dominant_emotion'],
+        'face_confidence': confidence,
+    }
+
+
+class EmotionPipeline:
+    """
+    Detect-rarely, classify-often emotion analysis.
+
+    Args:
+        detector_backend (str): DeepFace detector used for the detection stage.
+        detect_every (int): Run the detector on every n:th analysis. In between, emotion is
+            classified on the boxes passed to analyze() or, if none are given, on the boxes
+            of the previous detection.
+        align (bool): Align crops from the detector (only at full detection resolution).
+        detection_width (int): Run the detector on a copy downscaled to this width, see detect_faces.
+        batched (bool): Classify all faces of a call in one forward pass instead of one
+            DeepFace.analyze call per face.
+    """
+
+    def __init__(self, detector_backend='retinaface', detect_every=1, align=True, detection_width=None,
+                 batched=True):
+        self.detector_backend = detector_backend
+        self.detect_every = max(1, detect_every)
+        self.align = align
+        self.detection_width = detection_width
+        self.batched = batched
+        self.timer = StageTimer()
+        self.faces_classified = 0
+        self.last_boxes = []
+        self._since_detection = None
+
+    def detection_due(self):
+        return self._since_detection is None or self._since_detection >= self.detect_every - 1
+
+    def locate(self, frame, boxes=None):
+        """
+        First stage: finds the faces of a frame, running the detector only when it is due.
+
+        Args:
+            frame: BGR image.
+            boxes (list): Optional (x, y, w, h) face boxes, e.g. from FaceTracker, used when
+                no detection is due.
+
+        Returns:
+            list: (box, crop, confidence) tuples. confidence is None for faces that were
+            not detected in this frame.
+        """
+        if self.detection_due():
+            with self.timer.stage('detect'):
+                detections = detect_faces(frame, self.detector_backend, self.align, self.detection_width)
+            self.last_boxes = [d['box'] for d in detections]
+            self._since_detection = 0
+            return [(d['box'], d['face'], d['confidence']) for d in detections]
+
+        with self.timer.stage('crop'):
+            crops = crop_faces(frame, self.last_boxes if boxes is None else boxes)
+        self._since_detection += 1
+        return [(box, crop, None) for box, crop in crops]
+
+    def classify(self, faces):
+        """
+        Second stage: emotion for a list of crops, possibly from several frames.
+
+        Returns:
+            list: Dicts with 'emotion' and 'dominant_emotion', in the order of faces.
+        """
+        if not faces:
+            return []
+        with self.timer.stage('classify'):
+            if self.batched:
+                emotions = classify_emotions(faces)
+            else:
+                emotions = [classify_emotion(face) for face in faces]
+        self.faces_classified += len(faces)
+        return emotions
+
+    def analyze(self, frame, boxes=None):
+        """
+        Analyses one frame, see locate() for the arguments.
+
+        Returns:
+            list: One dict per face with 'region', 'emotion', 'dominant_emotion' and
+            'face_confidence', like DeepFace.analyze.
+        """
+        faces = self.locate(frame, boxes)
+        emotions = self.classify([crop for _, crop, _ in faces])
+        return [build_result(box, confidence, emotion)
+                for (box, _, confidence), emotion in zip(faces, emotions)]
+
+    def print_summary(self):
+        self.timer.print_summary()
+        classify_time = self.timer.totals.get('classify', 0.0)
+        if classify_time > 0:
+            print(f"Emotion throughput: {self.faces_classified / classify_time:.1f} faces/s")
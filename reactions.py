@@ -0,0 +1,117 @@
+"""
+Epi's reactions to the emotions it sees: mapped motions, idle motions and
+speaking the emotions out loud, each with its own cooldown. Shared by
+demo_mode(), where 'm' and 's' toggle them, and the headless service, where
+they are toggled through the HTTP API.
+"""
+
+import random
+import threading
+import time
+
+from ikaros import get_dispatcher
+
+# Motion mappings for recognized emotions
+MOTION_MAP = {
+    'happy':    [12, 15],
+    'angry':    [7, 16],
+    'surprise': [8, 14],
+    'sad':      [6, 13],
+    'neutral':  [5, 9, 10, 11]
+}
+# If no emotions for a while => random idle motion from this list
+IDLE_MOTIONS = [2, 3, 4, 17, 18, 19]
+
+
+class EpiReactions:
+    """
+    Decides when Epi moves or speaks, based on the dominant emotions in view.
+
+    Args:
+        dispatcher (IkarosDispatcher): Where commands are sent, defaults to the shared one.
+        motion_cooldown (float): Seconds after any motion before the next one.
+        speech_cooldown (float): Seconds after speaking before speaking again.
+        idle_after (float): Seconds without any emotion before an idle motion.
+        motion_enabled, speech_enabled (bool): Initial toggle states.
+    """
+
+    def __init__(self, dispatcher=None, motion_cooldown=10.0, speech_cooldown=10.0, idle_after=10.0,
+                 motion_enabled=False, speech_enabled=False):
+        self.dispatcher = dispatcher
+        self.motion_cooldown = motion_cooldown
+        self.speech_cooldown = speech_cooldown
+        self.idle_after = idle_after
+        self.motion_enabled = motion_enabled
+        self.speech_enabled = speech_enabled
+
+        # Toggles may be flipped from another thread (the service API)
+        self._lock = threading.Lock()
+        self.time_last_motion = 0.0           # Last time we triggered ANY motion
+        self.time_last_emotion = time.time()  # Last time we detected at least one face's emotion
+        self.time_last_speech = 0.0           # Last time we triggered speech
+        self.last_motion = None
+        self.last_speech = None
+
+    def _dispatcher(self):
+        return self.dispatcher if self.dispatcher is not None else get_dispatcher()
+
+    def set_motion(self, enabled=None):
+        """Turns motion on or off, or toggles it when `enabled` is None. Returns the new state."""
+        with self._lock:
+            self.motion_enabled = not self.motion_enabled if enabled is None else bool(enabled)
+            return self.motion_enabled
+
+    def set_speech(self, enabled=None):
+        """Turns speech on or off, or toggles it when `enabled` is None. Returns the new state."""
+        with self._lock:
+            self.speech_enabled = not self.speech_enabled if enabled is None else bool(enabled)
+            return self.speech_enabled
+
+    def update(self, emotions, now=None):
+        """
+        Call once per frame with the dominant emotions in view.
+
+        Args:
+            emotions (set): Distinct dominant emotions, lower case.
+            now (float): Current time, defaults to time.time().
+
+        Returns:
+            tuple: (motion, phrase) sent in this call, None for each that wasn't.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            motion_enabled, speech_enabled = self.motion_enabled, self.speech_enabled
+
+        # If at least one face/emotion is found, update `time_last_emotion`
+        if emotions:
+            self.time_last_emotion = now
+
+        motion = None
+        if motion_enabled and (now - self.time_last_motion) >= self.motion_cooldown:
+            if emotions:
+                # Pick one motion among those mapped to any of the emotions
+                possible_motions = []
+                for emo in emotions:
+                    possible_motions.extend(MOTION_MAP.get(emo, []))
+                if possible_motions:
+                    motion = random.choice(possible_motions)
+            elif (now - self.time_last_emotion) >= self.idle_after:
+                motion = random.choice(IDLE_MOTIONS)
+                # Reset "last emotion" too, so the next idle motion waits again
+                self.time_last_emotion = now
+            if motion is not None:
+                self._dispatcher().trigger_motion(motion)
+                print(f"Triggered motion: {motion}")
+                self.time_last_motion = now
+                self.last_motion = motion
+
+        phrase = None
+        if speech_enabled and emotions and (now - self.time_last_speech) >= self.speech_cooldown:
+            # Build a phrase from distinct emotions, e.g. "happy, sad"
+            phrase = ", ".join(sorted(emotions))
+            self._dispatcher().say(phrase)
+            print(f"Epi says: {phrase}")
+            self.time_last_speech = now
+            self.last_speech = phrase
+
+        return motion, phrase
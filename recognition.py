@@ -3,15 +3,28 @@ import matplotlib.pyplot as plt
 import cv2
 import pandas as pd
 import os
-import requests
 import time
 import json
-import random
+import metrics
+import tracing
+from capture import LatestFrameReader
+from inference import InferenceWorker
+from tracker import FaceTracker, detections_from_analysis, region_to_box
+from pipeline import EmotionPipeline, detect_faces
+from model_registry import warm_up_models
+from scheduler import AnalysisScheduler
+from motion_gate import ChangeDetector
+from emotion_log import EmotionLog
+from ikaros import get_dispatcher
+from overlay import OverlayRenderer
+from face_index import FaceIndex, embed_image, represent_face
+from identity import TrackIdentifier
+from reactions import EpiReactions
 
 #%% Improved function for camera movement calculation with limits
 
 # Function to adjust camera movement based on pixel coordinates
-def coordinate_modification(x, y, current_pan, current_tilt):
+def coordinate_modification(x, y, current_pan, current_tilt, video_width=640, video_height=480):
     '''
 
     Parameters
@@ -20,6 +33,8 @@ def coordinate_modification(x, y, current_pan, current_tilt):
     y : y value of item to track
     current_pan : Epi's current pan position 
     current_tilt : Epi's current tilt position 
+    video_width : width in pixels of the frame x was measured in
+    video_height : height in pixels of the frame y was measured in
 
     Returns
     -------
@@ -28,10 +43,6 @@ def coordinate_modification(x, y, current_pan, current_tilt):
 
     '''
     
-    # Video stream dimensions
-    video_width = 640
-    video_height = 480
-    
     # Camera sensor field of view in degrees
     sensor_fov_width = 62.2
     sensor_fov_height = 48.8
@@ -215,9 +226,17 @@ def verify_faces():
    
 
 
-def find_faces():
-    result = DeepFace.find(img_path='face-db/ruben-tapptorp/ruben4.jpg', db_path= 'face-db/')
-   
+def find_faces(img_path='face-db/ruben-tapptorp/ruben4.jpg', db_path='db', model_name=models[1]):
+    # Looks the face up in the embedding index (face_index.py) instead of DeepFace.find,
+    # which rescans the folder and compares against every image on each call
+    index = FaceIndex(db_path, model_name)
+    index.sync()  # Embeds folders that are not indexed yet
+    embedding = embed_image(img_path, model_name)
+    if embedding is None:
+        print("No face found in", img_path)
+        return
+    result = index.search(embedding, k=5)[0]
+
     print(result)
 
 
@@ -233,36 +252,54 @@ def analyze_faces():
     #pd.DataFrame(race, index=[0]).T.plot(kind="bar") #Index verkar bara förklara vad den blåa stapeln är?
     #plt.show()
 
-def streaming():
-    DeepFace.stream(db_path='face-db/', source= 0)  #source='http://righteye.local:8080/stream/video.mjpeg' för epi
+def streaming(source=0, db_path='db', model_name=models[1], detector_backend='opencv'):
+    # Live identification against the embedding index, replaces DeepFace.stream.
+    # source='http://righteye.local:8080/stream/video.mjpeg' för epi. Press 'q' to exit.
+    index = FaceIndex(db_path, model_name)
+    warm_up_models(detector_backend=detector_backend, emotion=False, recognition_model=model_name)
+    reader = LatestFrameReader(source)
+    if not reader.start():
+        return
 
-# Send HTTP GET requests to control Epi
+    try:
+        while True:
+            ret, frame = reader.read()
+            if not ret:
+                break
+            for face in detect_faces(frame, detector_backend, align=False):
+                identity, distance = index.identify(represent_face(face['face'], model_name))
+                x, y, w, h = (int(v) for v in face['box'])
+                label = f"{identity} ({distance:.2f})" if identity else "Unknown"
+                cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+                cv2.putText(frame, label, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+            cv2.imshow('Face Recognition', frame)
+            reader.mark_displayed()
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    finally:
+        reader.release()
+        cv2.destroyAllWindows()
+
+# Send HTTP GET requests to control Epi. The requests are queued on the
+# Ikaros dispatcher (ikaros.py) and sent from a background thread, so none
+# of these functions wait for the network.
 
 
 def control_epi():
-    urls = [
-        "http://localhost:8000/control/SR.positions/0/0/20",
-        "http://localhost:8000/control/SR.positions/1/0/10",
-        "http://localhost:8000/control/SR.positions/4/0/15",
-        "http://localhost:8000/control/SR.positions/5/0/15"
+    positions = [
+        (0, 0, 20),
+        (1, 0, 10),
+        (4, 0, 15),
+        (5, 0, 15)
     ]
-    
-    for url in urls:
-        response = requests.get(url)
-        if response.status_code == 200:
-            print(f"Response received from {url}: {response.json()}")
-        else:
-            print(f"Failed to retrieve data from {url}. Status code: {response.status_code}")
+
+    for servo, position, value in positions:
+        get_dispatcher().set_position(servo, position, value)
 
 
 def control_epi2(id, position, value):
-    url = f"http://localhost:8000/control/SR.positions/{id}/{position}/{value}"
-    response = requests.get(url)
-    
-    if response.status_code == 200:
-        print(f"Response received from {url}: {response.json()}")
-    else:
-        print(f"Failed to retrieve data from {url}. Status code: {response.status_code}")
+    # Only the newest value per servo is sent if commands pile up
+    get_dispatcher().set_position(id, position, value)
 
 
 
@@ -277,8 +314,8 @@ def temp_main ():
         x_values_list = []
         y_values_list = []
 
-        # Set up the timer for a 5-second interval
-        last_capture_time = time.time()
+        # Analyse often while people move, at most every 5 seconds when nothing happens
+        scheduler = AnalysisScheduler(cpu_budget=0.5, max_interval=5.0)
 
         #EPI KOLLAR KONSTANT, därav detta borde vara main?
         while True: 
@@ -288,12 +325,15 @@ def temp_main ():
                 print("Failed to retrieve frame from the stream.")
                 break
 
-            # Check if 5 seconds have passed since the last capture
+            # Check if the scheduler wants a new analysis
             current_time = time.time()
-            if current_time - last_capture_time >= 5:
-                # Process the frame to detect faces every 5 seconds
+            if scheduler.due(current_time):
+                scheduler.mark_started(current_time)
                 # gammalt från faces = DeepFace.extract_faces(img_path=frame, detector_backend="retinaface")
+                start = time.perf_counter()
                 faces = extract_faces(frame)
+                scheduler.record_latency(time.perf_counter() - start)
+                scheduler.observe_boxes([region_to_box(face["facial_area"]) for face in faces or []])
 
                 # Extract the X coordinates using the get_face_x function
                 x_values = get_face_x(faces)
@@ -316,11 +356,6 @@ def temp_main ():
 
                 control_epi2(0,0, (y_values[0]/50))  #ska vara actual_movement istället för y_values[0]/50
 
-            
-
-                # Update the last capture time
-                last_capture_time = current_time
-
             # Optional: Display the frame in real-time (press 'q' to quit)
             cv2.imshow('Live Stream', frame)
             if cv2.waitKey(1) & 0xFF == ord('q'):
@@ -343,6 +378,9 @@ def write_to_json(file_path, people_data):
     """
     Appends face emotion analysis data to a JSON file.
 
+    This rewrites the whole file on every call; the live loop uses the
+    append-only EmotionLog instead.
+
     Args:
         file_path (str): The path to the JSON file.
         people_data (list): A list of dictionaries containing the analysis data.
@@ -364,38 +402,79 @@ def write_to_json(file_path, people_data):
     except Exception as e:
         print(f"An error occurred while writing to the JSON file: {e}")
 
-def analyze_emotion_live(source='stream'):
+def analyze_emotion_live(source='stream', detector_backend='opencv', detect_every=1,
+                         cpu_budget=0.5, max_interval=2.0, detection_width=640, metrics_port=None,
+                         metrics_interval=None):
     """
-    Analyzes emotions live from a video source and writes the results to a JSON file.
+    Analyzes emotions live from a video source and appends the results to a JSON Lines
+    log (people.jsonl), see emotion_log.py.
 
     Args:
-        source (str): 'stream' for camera URL or 'webcam' for webcam feed.
+        source (str): 'stream' for camera URL, 'webcam' for webcam feed or "bus:<name>" for a frame bus.
+        detector_backend (str): Face detector used by the detection stage.
+        detect_every (int): Run the detector every n:th analysis and reuse its boxes in between.
+        cpu_budget (float): Share of the time analysis may use, see AnalysisScheduler.
+        max_interval (float): Longest time in seconds between analyses of a static scene.
+        detection_width (int): Larger frames are downscaled to this width for face detection.
+        metrics_port (int): Serve per-stage latencies on http://127.0.0.1:<port>/metrics, see metrics.py.
+        metrics_interval (float): Print a metrics summary line every this many seconds.
     """
+    if metrics_port or metrics_interval:
+        metrics.enable(port=metrics_port, summary_interval=metrics_interval)
     camera_url = 'http://righteye.local:8080/stream/video.mjpeg'
-    video_source = 0 if source == 'webcam' else camera_url  # 0 for the default webcam
-    output_file = "people.json"  # File to store JSON data
+    # 0 for the default webcam; anything else (a file, URL or "bus:<name>") is used as is
+    video_source = {'webcam': 0, 'stream': camera_url}.get(source, source)
+    output_file = "people.jsonl"  # Append-only log, read it with emotion_log.tail_records
+    log = EmotionLog(output_file)
 
     try:
-        # Initialize video capture with the chosen source
-        cap = cv2.VideoCapture(video_source)
+        # Load models before opening the camera so the first frame doesn't stall
+        warm_up_models(detector_backend=detector_backend)
+
+        # Read frames on a separate thread so analysis never works on stale frames
+        reader = LatestFrameReader(video_source)
+        if not reader.start():
+            return
 
-        # Set up the timer for an interval
-        last_capture_time = time.time()
+        # Detection and emotion classification run as separate stages
+        pipeline = EmotionPipeline(detector_backend=detector_backend, detect_every=detect_every,
+                                   detection_width=detection_width)
+
+        # Analysis rate follows inference cost and scene activity
+        scheduler = AnalysisScheduler(cpu_budget=cpu_budget, max_interval=max_interval)
+
+        # Skips analyses (and identical JSON entries) while the picture doesn't change
+        gate = ChangeDetector()
 
         while True:
-            # Capture each frame from the video source
-            ret, frame = cap.read()
+            # Get the newest frame from the video source
+            ret, frame = reader.read()
             if not ret:
-                print("Failed to retrieve frame from the video source.")
                 break
 
-            # Check if X seconds have passed since the last analysis
+            # Check if the scheduler wants a new analysis
             current_time = time.time()
-            if current_time - last_capture_time >= 1:  # Interval in seconds
+            metrics.inc('frames_processed')
+            tracing.frame(reader.frames_displayed)
+            analyze_now = scheduler.due(current_time)
+            if not analyze_now:
+                metrics.inc('frames_not_analyzed')
+            else:
+                scheduler.mark_started(current_time)
+                # Keep the previous result if nothing changed in the picture
+                if not gate.should_analyze(frame):
+                    scheduler.observe(0.0)
+                    analyze_now = False
+
+            if analyze_now:
                 try:
                     # Analyze the frame for emotion
-                    result = DeepFace.analyze(img_path=frame, actions=['emotion'], enforce_detection=False)
-                
+                    start = time.perf_counter()
+                    result = pipeline.analyze(frame)
+                    scheduler.record_latency(time.perf_counter() - start)
+                    scheduler.observe_boxes([region_to_box(face['region']) for face in result])
+                    metrics.observe('faces_per_frame', len(result))
+
                     if result:
                         # Prepare data for each detected face
                         people_data = []
@@ -415,26 +494,34 @@ def analyze_emotion_live(source='stream'):
                                 "Face Position Y": face_position_y
                             })
 
-                        # Write to the JSON file
-                        write_to_json(output_file, people_data)
+                        # Append to the log, written to disk in batches
+                        log.append(people_data)
 
                 except Exception as e:
                     print(f"An error occurred while analyzing the frame: {e}")
 
-                # Update the last capture time
-                last_capture_time = current_time
-
             # Optional: Display the frame in real-time (press 'q' to quit)
-            cv2.imshow('Live Stream', frame)
-            if cv2.waitKey(1) & 0xFF == ord('q'):
+            with metrics.timer('display'):
+                cv2.imshow('Live Stream', frame)
+                key = cv2.waitKey(1) & 0xFF
+            reader.mark_displayed()
+            if key == ord('q'):
                 break
 
         # Release the video capture and close windows when done
-        cap.release()
+        tracing.frame(None)
+        reader.release()
+        reader.print_stats()
+        pipeline.print_summary()
+        scheduler.print_stats()
+        gate.print_stats()
+        metrics.print_summary()
         cv2.destroyAllWindows()
 
     except Exception as e:
         print("An error occurred during live streaming:", e)
+    finally:
+        log.close()
 
 
 
@@ -499,206 +586,171 @@ def analyze_emotion_live(source='stream'):
     '''
 
 
-def demo_mode(source='stream', detector_backend='mtcnn'):
+def demo_mode(source='stream', detector_backend='mtcnn', detect_every=3, cpu_budget=0.5, max_interval=2.0,
+              detection_width=640, identify=True, db_path='db', metrics_port=None, metrics_interval=None):
     """
     Demonstrates real-time emotion analysis with bounding boxes and overlays.
     Adds toggles for motion (m) and speech (s).
     Press 'q' to exit the demo.
+
+    The face detector runs on every `detect_every`:th analysis; in between only
+    the emotion model runs, on the boxes from the tracker. How often analyses
+    run is set by an AnalysisScheduler with the given `cpu_budget` and `max_interval`.
+    Frames wider than `detection_width` are downscaled for detection only.
+    With `identify`, faces are labelled with their name from the contact registry,
+    looked up once per track in the face index in `db_path`.
+    With `metrics_port` and/or `metrics_interval`, per-stage latencies and frame counters
+    are served on http://127.0.0.1:<metrics_port>/metrics and/or printed every
+    `metrics_interval` seconds, see metrics.py.
     """
+    if metrics_port or metrics_interval:
+        metrics.enable(port=metrics_port, summary_interval=metrics_interval)
 
     # URL for Epi's camera
     camera_url = 'http://righteye.local:8080/stream/video.mjpeg'
-    video_source = 0 if source == 'webcam' else camera_url  # 0 uses default webcam
-
-    # Motion mappings for recognized emotions
-    motion_map = {
-        'happy':    [12, 15],
-        'angry':    [7, 16],
-        'surprise': [8, 14],
-        'sad':      [6, 13],
-        'neutral':  [5, 9, 10, 11]
-    }
-    # If no emotions for 10 seconds => random idle from this list:
-    idle_motions = [2, 3, 4, 17, 18, 19]
+    # 0 for the default webcam; anything else (a file, URL or "bus:<name>") is used as is
+    video_source = {'webcam': 0, 'stream': camera_url}.get(source, source)
 
     try:
-        # Initialize video capture
-        cap = cv2.VideoCapture(video_source)
-        if not cap.isOpened():
-            print(f"Could not open video source: {video_source}")
+        # Load models before opening the camera so the first frame doesn't stall
+        warm_up_models(detector_backend=detector_backend, recognition_model=models[1] if identify else None)
+
+        # Initialize threaded video capture, only the newest frame is kept
+        reader = LatestFrameReader(video_source)
+        if not reader.start():
             return
 
-        # Timers and toggles
-        last_capture_time = time.time()      # For DeepFace analysis
-        faces_current_analysis = None        # Latest deepface result
+        # Analysis runs on a worker thread so the display keeps camera rate
+        pipeline = EmotionPipeline(detector_backend=detector_backend, detect_every=detect_every,
+                                   detection_width=detection_width)
+        worker = InferenceWorker(pipeline.analyze).start()
+
+        # Boxes follow the faces between analyses and keep a stable id per person
+        tracker = FaceTracker()
+
+        # Analysis rate follows inference cost and how much the faces move
+        scheduler = AnalysisScheduler(cpu_budget=cpu_budget, max_interval=max_interval)
+
+        # Skips analyses while the picture doesn't change
+        gate = ChangeDetector()
+
+        # Face boxes and emotion panels
+        renderer = OverlayRenderer()
 
-        motion_enabled = False
-        speech_enabled = False
+        # Names for the tracked faces, identified once per track on a worker thread
+        identifier = TrackIdentifier(db_path, models[1]).start() if identify else None
 
-        time_last_motion = 0.0      # Last time we triggered ANY motion
-        time_last_emotion = time.time()  # Last time we detected at least one face's emotion
-        motion_cooldown = 10.0      # 10-second cooldown after triggering motion
+        last_result = None                   # Latest deepface result fed to the tracker
+        waited = False                       # The due analysis was counted as skipped
 
-        time_last_speech = 0.0      # Last time we triggered speech
-        speech_cooldown = 10.0      # 10-second cooldown after speaking
+        # Motion and speech, with a 10-second cooldown each, toggled with 'm' and 's'
+        reactions = EpiReactions()
 
         while True:
-            ret, frame = cap.read()
+            ret, frame = reader.read()
             if not ret:
-                print("Failed to retrieve frame from the video source.")
                 break
 
             current_time = time.time()
-
-            # 1) PERIODIC EMOTION ANALYSIS (like before)
-            if current_time - last_capture_time >= 1:  # Adjust interval if needed
-                try:
-                    result = DeepFace.analyze(
-                        img_path=frame,
-                        actions=['emotion'],
-                        detector_backend=detector_backend,
-                        enforce_detection=False  # set True if you want strict detection
-                    )
-                    faces_current_analysis = result
-                except Exception as e:
-                    # Keep the old faces_current_analysis if an error occurs
-                    print(f"An error occurred during DeepFace analysis: {e}")
-                last_capture_time = current_time
+            metrics.inc('frames_processed')
+            tracing.frame(reader.frames_displayed)
+
+            # 1) SCHEDULED EMOTION ANALYSIS, submitted to the worker without waiting
+            analysis_due = scheduler.due(current_time)
+            if analysis_due and not worker.busy:
+                waited = False
+                if not gate.should_analyze(frame):
+                    # Static scene, the tracker keeps showing the previous result
+                    scheduler.mark_started(current_time)
+                    scheduler.observe(0.0)
+                else:
+                    # Copy, since the overlay below draws on the frame. Tracked boxes
+                    # are classified directly when no detection is due.
+                    boxes = [t.box for t in tracker.tracks if t.misses == 0]
+                    if worker.submit(frame.copy(), boxes=boxes or None):
+                        scheduler.mark_started(current_time)
+            elif metrics.enabled:
+                if analysis_due and not waited:
+                    # The analysis waits for the worker, count that once and not every frame
+                    metrics.inc('inferences_skipped', reason='busy')
+                    waited = True
+                else:
+                    metrics.inc('frames_not_analyzed')
+
+            # 1b) TRACKING: move boxes with the image on every frame and
+            # re-anchor them whenever the worker finishes a new analysis.
+            # The worker keeps the old result if an analysis fails.
+            with metrics.timer('track'):
+                tracker.predict(frame)
+                latest = worker.latest()
+                if latest is not None and latest is not last_result:
+                    last_result = latest
+                    detections = detections_from_analysis(latest.result)
+                    tracker.update(detections)
+                    scheduler.record_latency(latest.duration)
+                    scheduler.observe_boxes([box for box, _ in detections])
+
+            # Tracks not seen in the latest analysis are not shown
+            visible = [track for track in tracker.tracks if track.misses == 0]
+            metrics.observe('faces_per_frame', len(visible))
+
+            # 1c) IDENTITIES: only new tracks and stale identities cost anything.
+            # Before the overlay, since the face is cropped from this frame.
+            if identifier is not None:
+                identifier.update(frame, visible, current_time)
 
             # 2) OVERLAY RESULTS IF AVAILABLE
             distinct_emotions_in_frame = set()
-            if faces_current_analysis:
-                # DeepFace might return a single dict or a list of dicts
-                if isinstance(faces_current_analysis, dict):
-                    faces_to_draw = [faces_current_analysis]
-                else:
-                    faces_to_draw = faces_current_analysis
-
-                for idx, face_data in enumerate(faces_to_draw):
-                    # -- 2a) Draw bounding box
-                    region = face_data.get('region', {})
-                    x = region.get('x', 0)
-                    y = region.get('y', 0)
-                    w = region.get('w', 0)
-                    h = region.get('h', 0)
-                    cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-
-                    # -- 2b) Label above face box
-                    label_text = f"Person {idx}"
-                    cv2.putText(frame, label_text, (x, y - 10),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-
-                    # -- 2c) Emotions
+            with metrics.timer('render'):
+                for track in visible:
+                    face_data = track.data
+
                     dom_emotion = face_data.get('dominant_emotion', '').lower()
                     if dom_emotion:
                         distinct_emotions_in_frame.add(dom_emotion)
 
-                    emotions = face_data.get('emotion', {})
-
-                    # -- 2d) Draw overlay box
-                    overlay_x1 = x + w + 10
-                    overlay_y1 = y
-                    overlay_width = 210
-                    overlay_height = 240
-                    overlay_x2 = overlay_x1 + overlay_width
-                    overlay_y2 = overlay_y1 + overlay_height
-
-                    overlay = frame.copy()
-                    cv2.rectangle(overlay, (overlay_x1, overlay_y1),
-                                  (overlay_x2, overlay_y2), (0, 0, 0), -1)
-                    alpha = 0.5
-                    frame = cv2.addWeighted(overlay, alpha, frame, 1 - alpha, 0)
-
-                    # Dominant emotion text
-                    cv2.putText(frame, f"Dominant: {dom_emotion}",
-                                (overlay_x1 + 5, overlay_y1 + 20),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-
-                    # Draw bar chart for known emotions
-                    bar_left = overlay_x1 + 80
-                    bar_top_start = overlay_y1 + 40
-                    bar_height = 12
-                    gap = 15
-                    emotion_order = ["angry", "disgust", "fear", "happy", "sad", "surprise", "neutral"]
-
-                    for i, emo_name in enumerate(emotion_order):
-                        emo_val = emotions.get(emo_name, 0.0)
-                        bar_length = int(min(emo_val, 100) / 100 * 100)
-
-                        top_y = bar_top_start + i * (bar_height + gap)
-                        if dom_emotion == emo_name:
-                            bar_color = (0, 255, 255)
-                        else:
-                            bar_color = (255, 255, 255)
-
-                        cv2.putText(frame, f"{emo_name}",
-                                    (overlay_x1 + 5, top_y + bar_height - 2),
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
-                        cv2.rectangle(frame, (bar_left, top_y),
-                                      (bar_left + bar_length, top_y + bar_height),
-                                      bar_color, -1)
-
-            # 3) MOTION LOGIC (if motion_enabled)
-            # If at least one face/emotion is found, update `time_last_emotion`
-            if len(distinct_emotions_in_frame) > 0:
-                time_last_emotion = current_time
-
-            if motion_enabled:
-                # Check if we are outside the motion cooldown
-                if (current_time - time_last_motion) >= motion_cooldown:
-                    # If we have at least one recognized emotion, trigger the mapped motion
-                    if distinct_emotions_in_frame:
-                        # Build a combined list of possible motions
-                        possible_motions = []
-                        for emo in distinct_emotions_in_frame:
-                            if emo in motion_map:
-                                possible_motions.extend(motion_map[emo])
-                        # If we found at least one possible motion, pick one randomly
-                        if possible_motions:
-                            chosen = random.choice(possible_motions)
-                            trigger_motion(chosen)
-                            time_last_motion = current_time
-                    else:
-                        # If NO emotion for 10 seconds => random idle motion
-                        # Check how long it's been since we last saw any emotion
-                        if (current_time - time_last_emotion) >= 10.0:
-                            chosen = random.choice(idle_motions)
-                            trigger_motion(chosen)
-                            # Reset both motion and "last emotion" timers
-                            time_last_motion = current_time
-                            time_last_emotion = current_time
-
-            # 4) SPEECH LOGIC (if speech_enabled)
-            # Every 10s, speak the distinct emotions if we see any faces
-            if speech_enabled:
-                if (current_time - time_last_speech) >= speech_cooldown:
-                    if len(distinct_emotions_in_frame) > 0:
-                        # Build a phrase from distinct emotions, e.g. "happy, sad"
-                        # Convert spaces to underscores
-                        # (DeepFace often has "fear" / "angry" etc. which are single words, but let's be safe)
-                        phrase = ", ".join(distinct_emotions_in_frame)
-                        phrase = phrase.replace(" ", "_")
-                        trigger_speech(phrase)
-                        time_last_speech = current_time
+                    # Box, label and emotion panel, drawn in place
+                    label_text = f"Person {track.id}"
+                    if identifier is not None:
+                        label_text = identifier.label(track, label_text)
+                    renderer.draw_face(frame, track.int_box(), label_text,
+                                       face_data.get('emotion', {}), dom_emotion)
+
+            # 3) MOTION AND SPEECH LOGIC (if enabled)
+            # Mapped motion for the emotions in view, or an idle motion after 10 seconds
+            # without any; every 10 seconds speak the distinct emotions.
+            reactions.update(distinct_emotions_in_frame, current_time)
 
             # 5) DISPLAY FRAME
-            cv2.imshow('Demo Mode Stream', frame)
-            key = cv2.waitKey(1) & 0xFF
+            with metrics.timer('display'):
+                cv2.imshow('Demo Mode Stream', frame)
+                key = cv2.waitKey(1) & 0xFF
+            reader.mark_displayed()
 
             if key == ord('q'):
                 # Quit
                 break
             elif key == ord('m'):
                 # Toggle motion
-                motion_enabled = not motion_enabled
-                print(f"Motion enabled: {motion_enabled}")
+                print(f"Motion enabled: {reactions.set_motion()}")
             elif key == ord('s'):
                 # Toggle speech
-                speech_enabled = not speech_enabled
-                print(f"Speech enabled: {speech_enabled}")
+                print(f"Speech enabled: {reactions.set_speech()}")
 
         # Cleanup
-        cap.release()
+        tracing.frame(None)
+        worker.stop()
+        if identifier is not None:
+            identifier.stop()
+            identifier.print_stats()
+        reader.release()
+        reader.print_stats()
+        worker.print_stats()
+        pipeline.print_summary()
+        scheduler.print_stats()
+        gate.print_stats()
+        get_dispatcher().print_stats()
+        metrics.print_summary()
         cv2.destroyAllWindows()
 
     except Exception as e:
@@ -707,28 +759,21 @@ def demo_mode(source='stream', detector_backend='mtcnn'):
 
 def trigger_motion(sequence_number):
     """
-    Sends an HTTP request to trigger a motion in Ikaros via:
+    Queues an HTTP request to trigger a motion in Ikaros via:
     http://127.0.0.1:8000/command/SR.trig/{sequence_number}/0/0
+    Errors are reported by the dispatcher thread.
     """
-    url = f"http://127.0.0.1:8000/command/SR.trig/{sequence_number}/0/0"
-    try:
-        requests.get(url, timeout=1.0)  # 1-second timeout just to be safe
-        print(f"Triggered motion: {sequence_number}")
-    except Exception as ex:
-        print(f"Error triggering motion ({sequence_number}): {ex}")
+    get_dispatcher().trigger_motion(sequence_number)
+    print(f"Triggered motion: {sequence_number}")
 
 
 def trigger_speech(text):
     """
-    Sends an HTTP request for Epi to speak the given text:
+    Queues an HTTP request for Epi to speak the given text:
     http://127.0.0.1:8000/command/EpiSpeech.say/0/0/...
     Spaces should be replaced with underscores or properly URL-encoded.
     """
     # Replace any spaces with underscores, if still present
     text = text.replace(" ", "_")
-    url = f"http://127.0.0.1:8000/command/EpiSpeech.say/0/0/{text}"
-    try:
-        requests.get(url, timeout=2.0)
-        print(f"Epi says: {text}")
-    except Exception as ex:
-        print(f"Error triggering speech ({text}): {ex}")
\ No newline at end of file
+    get_dispatcher().say(text)
+    print(f"Epi says: {text}")
\ No newline at end of file
@@ -0,0 +1,133 @@
+"""
+Adaptive analysis scheduling for the live loops.
+
+Instead of analysing on a fixed interval, AnalysisScheduler decides when the
+next analysis should start from three things:
+
+- how long inference actually takes (exponential moving average),
+- the CPU budget, i.e. the share of wall time inference may use,
+- scene activity. While faces move, analyses run back-to-back (within the
+  budget). While the scene is static the interval backs off towards
+  max_interval.
+"""
+
+import time
+
+import numpy as np
+
+
+def box_activity(previous_boxes, boxes):
+    """
+    Measures how much the faces moved between two analyses.
+
+    Args:
+        previous_boxes (list): (x, y, w, h) boxes from the previous analysis.
+        boxes (list): (x, y, w, h) boxes from the latest analysis.
+
+    Returns:
+        float: Largest centre displacement relative to the face size, or 1.0 if
+        the number of faces changed.
+    """
+    if len(previous_boxes) != len(boxes):
+        return 1.0
+    if not boxes:
+        return 0.0
+    prev = np.asarray(previous_boxes, dtype=np.float32)
+    curr = np.asarray(boxes, dtype=np.float32)
+    # Compare in sorted order so list order doesn't matter
+    prev = prev[np.lexsort((prev[:, 1], prev[:, 0]))]
+    curr = curr[np.lexsort((curr[:, 1], curr[:, 0]))]
+    shift = np.hypot((curr[:, 0] + curr[:, 2] / 2) - (prev[:, 0] + prev[:, 2] / 2),
+                     (curr[:, 1] + curr[:, 3] / 2) - (prev[:, 1] + prev[:, 3] / 2))
+    size = np.maximum(np.maximum(curr[:, 2], curr[:, 3]), 1)
+    return float(np.max(shift / size))
+
+
+class AnalysisScheduler:
+    """
+    Decides when the next analysis should run.
+
+    Args:
+        cpu_budget (float): Share of wall time inference may use, in (0, 1]. 1.0 allows
+            back-to-back analyses, 0.5 waits as long as the last analysis took.
+        min_interval (float): Shortest interval in seconds between analysis starts.
+        max_interval (float): Longest interval in seconds when the scene is static, i.e. the
+            worst-case age of a result. The CPU budget takes precedence if inference is slower.
+        activity_threshold (float): Activity (see box_activity) above which the scene counts as active.
+        backoff (float): Factor the interval grows by for every analysis of a static scene.
+    """
+
+    def __init__(self, cpu_budget=0.5, min_interval=0.0, max_interval=2.0,
+                 activity_threshold=0.05, backoff=1.5):
+        self.cpu_budget = min(1.0, max(0.01, cpu_budget))
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.activity_threshold = activity_threshold
+        self.backoff = backoff
+
+        self.latency = None      # Moving average of inference time
+        self.activity = 1.0      # Assume something is happening until we know better
+        self.interval = min_interval
+        self.last_start = 0.0
+        self._last_boxes = None
+
+        self.analyses = 0
+
+    def budget_interval(self):
+        """
+        Shortest interval between analysis starts that keeps inference within the CPU budget.
+        """
+        if self.latency is None:
+            return self.min_interval
+        return max(self.min_interval, self.latency / self.cpu_budget)
+
+    def record_latency(self, seconds, smoothing=0.3):
+        """
+        Feeds the measured duration of a finished analysis into the moving average.
+        """
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency = smoothing * seconds + (1 - smoothing) * self.latency
+
+    def observe(self, activity):
+        """
+        Updates scene activity and recomputes the interval. Call once per finished analysis.
+
+        Args:
+            activity (float): 0 for a static scene, larger values for more motion.
+        """
+        self.activity = activity
+        budget = self.budget_interval()
+        if activity > self.activity_threshold:
+            # Something moves: analyse as often as the budget allows
+            self.interval = budget
+        else:
+            # Static scene: back off, but never beyond max_interval
+            self.interval = max(budget, min(self.max_interval, max(self.interval, budget) * self.backoff))
+
+    def observe_boxes(self, boxes):
+        """
+        Like observe(), with the activity computed from the face boxes of the latest analysis.
+        """
+        boxes = [tuple(b) for b in boxes]
+        activity = 1.0 if self._last_boxes is None else box_activity(self._last_boxes, boxes)
+        self._last_boxes = boxes
+        self.observe(activity)
+
+    def due(self, now=None):
+        """
+        Returns:
+            bool: True if the next analysis should start now.
+        """
+        now = time.time() if now is None else now
+        return now - self.last_start >= self.interval
+
+    def mark_started(self, now=None):
+        self.last_start = time.time() if now is None else now
+        self.analyses += 1
+
+    def print_stats(self):
+        latency_ms = 1000 * self.latency if self.latency is not None else 0.0
+        print(f"Scheduler: {self.analyses} analyses, mean inference {latency_ms:.0f} ms, "
+              f"current interval {self.interval:.2f} s")
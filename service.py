@@ -0,0 +1,432 @@
+"""
+Headless live analysis for the machine next to Epi.
+
+The live functions in recognition.py need a window (cv2.imshow/waitKey), and
+other programs had to poll people.json for results. The service runs the same
+pipeline (threaded capture, scheduled analysis, tracking, identities, Epi's
+reactions) without any GUI and publishes the results over a local HTTP API:
+
+    GET  /api/state     Snapshot of the current faces, toggles and statistics (JSON)
+    GET  /api/events    Server-Sent Events stream: a "frame" event per processed frame and
+                        a "reaction" event whenever Epi moves or speaks
+    GET  /api/health    {"ok": true} while frames are coming in
+    POST /api/motion    {"enabled": true|false}, or no body to toggle
+    POST /api/speech    {"enabled": true|false}, or no body to toggle
+    GET  /metrics       Per-stage latencies and counters as Prometheus text, with --metrics
+
+Usage:
+    python service.py [--source stream|webcam|bus:<name>] [--port 8765] [--motion] [--speech] [--metrics]
+
+    curl http://127.0.0.1:8765/api/state
+    curl -N http://127.0.0.1:8765/api/events
+    curl -X POST -d '{"enabled": true}' http://127.0.0.1:8765/api/motion
+"""
+
+import argparse
+import json
+import queue
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from capture import LatestFrameReader
+from emotion_log import EmotionLog
+from identity import TrackIdentifier
+from ikaros import get_dispatcher
+import metrics
+import tracing
+from inference import InferenceWorker
+from model_registry import warm_up_models
+from motion_gate import ChangeDetector
+from pipeline import EmotionPipeline
+from reactions import EpiReactions
+from scheduler import AnalysisScheduler
+from tracker import FaceTracker, detections_from_analysis
+
+CAMERA_URL = 'http://righteye.local:8080/stream/video.mjpeg'
+
+
+class EventHub:
+    """
+    Fans published events out to any number of SSE clients. Each client has a
+    small queue; a client that falls behind loses its oldest events rather than
+    slowing down the pipeline.
+
+    Args:
+        client_queue (int): Events buffered per client.
+    """
+
+    def __init__(self, client_queue=10):
+        self.client_queue = client_queue
+        self._lock = threading.Lock()
+        self._clients = []
+
+    def subscribe(self):
+        client = queue.Queue(maxsize=self.client_queue)
+        with self._lock:
+            self._clients.append(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+
+    @property
+    def has_clients(self):
+        with self._lock:
+            return bool(self._clients)
+
+    def publish(self, event, data):
+        """
+        Args:
+            event (str): SSE event name.
+            data (dict): Sent as JSON, serialized once for all clients.
+        """
+        with self._lock:
+            clients = list(self._clients)
+        if not clients:
+            return
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+        for client in clients:
+            while True:
+                try:
+                    client.put_nowait(message)
+                    break
+                except queue.Full:
+                    try:
+                        client.get_nowait()
+                    except queue.Empty:
+                        pass
+
+
+class EmotionService:
+    """
+    The live pipeline without a window, plus the HTTP API.
+
+    Args:
+        source: 'stream', 'webcam', "bus:<name>", or anything cv2.VideoCapture accepts.
+        detector_backend (str): DeepFace face detector.
+        detect_every (int): Run the detector every n:th analysis, see EmotionPipeline.
+        cpu_budget (float): Share of the time analysis may use, see AnalysisScheduler.
+        max_interval (float): Longest time in seconds between analyses of a static scene.
+        detection_width (int): Frames are downscaled to this width for detection.
+        identify (bool): Label faces with contact names, see identity.py.
+        db_path (str): Face database for identification.
+        log_path (str): Also append results to this JSON Lines log, None to skip.
+        host, port: Where the HTTP API listens.
+        motion_enabled, speech_enabled (bool): Initial state of Epi's reactions.
+    """
+
+    def __init__(self, source='stream', detector_backend='opencv', detect_every=3, cpu_budget=0.5,
+                 max_interval=2.0, detection_width=640, identify=True, db_path='db', log_path=None,
+                 host='127.0.0.1', port=8765, motion_enabled=False, speech_enabled=False):
+        self.source = {'webcam': 0, 'stream': CAMERA_URL}.get(source, source)
+        self.detector_backend = detector_backend
+        self.identify = identify
+        self.host = host
+        self.port = port
+
+        self.pipeline = EmotionPipeline(detector_backend=detector_backend, detect_every=detect_every,
+                                        detection_width=detection_width)
+        self.scheduler = AnalysisScheduler(cpu_budget=cpu_budget, max_interval=max_interval)
+        self.gate = ChangeDetector()
+        self.tracker = FaceTracker()
+        self.reactions = EpiReactions(motion_enabled=motion_enabled, speech_enabled=speech_enabled)
+        self.hub = EventHub()
+        self.db_path = db_path
+        self.log = EmotionLog(log_path) if log_path else None
+        self.worker = None
+        self.identifier = None
+        self.reader = None
+
+        self._state_lock = threading.Lock()
+        self._state = {"frame": 0, "time": None, "faces": []}
+        self._stop = threading.Event()
+        self._server = None
+        self.started_at = None
+
+    # -- Pipeline
+
+    def _faces(self, tracks):
+        faces = []
+        for track in tracks:
+            data = track.data
+            x, y, w, h = track.int_box()
+            name = self.identifier.label(track) if self.identifier is not None else None
+            faces.append({
+                "track_id": track.id,
+                "name": name,
+                "box": {"x": x, "y": y, "w": w, "h": h},
+                "dominant_emotion": data.get('dominant_emotion'),
+                "emotion": {k: round(float(v), 2) for k, v in data.get('emotion', {}).items()},
+            })
+        return faces
+
+    def run(self):
+        """
+        Runs until stop() is called, the source ends or Ctrl+C.
+        """
+        warm_up_models(detector_backend=self.detector_backend,
+                       recognition_model="Facenet" if self.identify else None)
+        self.reader = LatestFrameReader(self.source)
+        if not self.reader.start():
+            return
+        self.worker = InferenceWorker(self.pipeline.analyze).start()
+        if self.identify:
+            self.identifier = TrackIdentifier(self.db_path).start()
+        self.start_api()
+        self.started_at = time.time()
+
+        last_result = None
+        frame_index = 0
+        waited = False  # The due analysis was counted as skipped
+        try:
+            while not self._stop.is_set():
+                ret, frame = self.reader.read(timeout=1.0)
+                if not ret:
+                    if self.reader.failed:
+                        break
+                    continue  # No frame within a second, check for stop() and wait again
+                now = time.time()
+                frame_index += 1
+                metrics.inc('frames_processed')
+                tracing.frame(frame_index)
+
+                # Scheduled analysis on the worker thread. Nothing draws on the frame,
+                # so it can be handed over without a copy.
+                analysis_due = self.scheduler.due(now)
+                if analysis_due and not self.worker.busy:
+                    waited = False
+                    if not self.gate.should_analyze(frame):
+                        self.scheduler.mark_started(now)
+                        self.scheduler.observe(0.0)
+                    else:
+                        boxes = [t.box for t in self.tracker.tracks if t.misses == 0]
+                        if self.worker.submit(frame, boxes=boxes or None):
+                            self.scheduler.mark_started(now)
+                elif metrics.enabled:
+                    if analysis_due and not waited:
+                        # The analysis waits for the worker, count that once and not every frame
+                        metrics.inc('inferences_skipped', reason='busy')
+                        waited = True
+                    else:
+                        metrics.inc('frames_not_analyzed')
+
+                self.tracker.predict(frame)
+                latest = self.worker.latest()
+                new_analysis = latest is not None and latest is not last_result
+                if new_analysis:
+                    last_result = latest
+                    detections = detections_from_analysis(latest.result)
+                    self.tracker.update(detections)
+                    self.scheduler.record_latency(latest.duration)
+                    self.scheduler.observe_boxes([box for box, _ in detections])
+
+                visible = [track for track in self.tracker.tracks if track.misses == 0]
+                metrics.observe('faces_per_frame', len(visible))
+                if self.identifier is not None:
+                    self.identifier.update(frame, visible, now)
+
+                emotions = {t.data.get('dominant_emotion', '').lower() for t in visible} - {''}
+                motion, phrase = self.reactions.update(emotions, now)
+
+                faces = self._faces(visible)
+                state = {"frame": frame_index, "time": now, "faces": faces}
+                with self._state_lock:
+                    self._state = state
+                self.hub.publish("frame", state)
+                if motion is not None or phrase is not None:
+                    self.hub.publish("reaction", {"time": now, "motion": motion, "speech": phrase})
+
+                if self.log is not None and new_analysis and faces:
+                    self.log.append([{
+                        "Name": face["name"] or str(face["track_id"]),
+                        "Dominant Emotion": face["dominant_emotion"],
+                        "Emotion Scores": face["emotion"],
+                        "Face Position X": face["box"]["x"],
+                        "Face Position Y": face["box"]["y"],
+                    } for face in faces])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            tracing.frame(None)
+            self.shutdown()
+
+    def stop(self):
+        """Asks run() to return; safe to call from any thread or a signal handler."""
+        self._stop.set()
+
+    def shutdown(self):
+        self.stop_api()
+        if self.worker is not None:
+            self.worker.stop()
+        if self.identifier is not None:
+            self.identifier.stop()
+        if self.reader is not None:
+            self.reader.release()
+        if self.log is not None:
+            self.log.close()
+        self.print_stats()
+
+    # -- API
+
+    def snapshot(self):
+        with self._state_lock:
+            state = dict(self._state)
+        state["motion_enabled"] = self.reactions.motion_enabled
+        state["speech_enabled"] = self.reactions.speech_enabled
+        state["stats"] = self.stats()
+        return state
+
+    def stats(self):
+        uptime = time.time() - self.started_at if self.started_at else 0.0
+        reader = self.reader.stats() if self.reader is not None else {}
+        worker = self.worker.stats() if self.worker is not None else {}
+        return {
+            "uptime": round(uptime, 1),
+            "frames_captured": reader.get("frames_captured", 0),
+            "frames_dropped": reader.get("frames_dropped", 0),
+            "analyses": worker.get("completed", 0),
+            "analysis_errors": worker.get("errors", 0),
+            "last_analysis_ms": round(1000 * worker.get("last_duration", 0.0), 1),
+        }
+
+    def print_stats(self):
+        if self.reader is not None:
+            self.reader.print_stats()
+        if self.worker is not None:
+            self.worker.print_stats()
+        self.pipeline.print_summary()
+        self.scheduler.print_stats()
+        self.gate.print_stats()
+        if self.identifier is not None:
+            self.identifier.print_stats()
+        get_dispatcher().print_stats()
+        metrics.print_summary()
+
+    def start_api(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send_json(self, data, status=200):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_json(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if not length:
+                    return {}
+                return json.loads(self.rfile.read(length))
+
+            def do_GET(self):
+                if self.path == "/api/state":
+                    self._send_json(service.snapshot())
+                elif self.path == "/api/health":
+                    reader = service.reader
+                    ok = reader is not None and not reader.failed and time.time() - reader.frame_time < 5.0
+                    self._send_json({"ok": ok}, 200 if ok else 503)
+                elif self.path == "/api/events":
+                    self._stream_events()
+                elif self.path == "/metrics" and metrics.enabled:
+                    body = metrics.registry.render().encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                else:
+                    self._send_json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                try:
+                    enabled = self._read_json().get("enabled")
+                except (ValueError, AttributeError):
+                    self._send_json({"error": "body must be JSON like {\"enabled\": true}"}, 400)
+                    return
+                # This moves the robot, only a real boolean turns it on or off; missing or null toggles
+                if enabled is not None and not isinstance(enabled, bool):
+                    self._send_json({"error": "\"enabled\" must be true, false or null"}, 400)
+                    return
+                if self.path == "/api/motion":
+                    self._send_json({"motion_enabled": service.reactions.set_motion(enabled)})
+                elif self.path == "/api/speech":
+                    self._send_json({"speech_enabled": service.reactions.set_speech(enabled)})
+                else:
+                    self._send_json({"error": "not found"}, 404)
+
+            def _stream_events(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                client = service.hub.subscribe()
+                try:
+                    while not service._stop.is_set():
+                        try:
+                            message = client.get(timeout=15.0)
+                        except queue.Empty:
+                            message = b": keep-alive\n\n"
+                        self.wfile.write(message)
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # Client went away
+                finally:
+                    service.hub.unsubscribe(client)
+                    self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass  # Keep the console quiet
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="service-api", daemon=True).start()
+        print(f"Service API on http://{self.host}:{self.port}/api/state")
+
+    def stop_api(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the live emotion analysis headless with an HTTP API.")
+    parser.add_argument("--source", default="stream",
+                        help="'stream' for Epi's camera, 'webcam', bus:<name> or a URL/file.")
+    parser.add_argument("--detector_backend", default="opencv", help="DeepFace face detector.")
+    parser.add_argument("--detect_every", type=int, default=3, help="Run the detector every n:th analysis.")
+    parser.add_argument("--cpu_budget", type=float, default=0.5, help="Share of the time analysis may use.")
+    parser.add_argument("--no-identify", dest="identify", action="store_false",
+                        help="Don't label faces with contact names.")
+    parser.add_argument("--log", default=None, help="Also append results to this JSON Lines file.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address the API listens on.")
+    parser.add_argument("--port", type=int, default=8765, help="Port of the API.")
+    parser.add_argument("--motion", action="store_true", help="Start with motion enabled.")
+    parser.add_argument("--speech", action="store_true", help="Start with speech enabled.")
+    parser.add_argument("--metrics", action="store_true", help="Record per-stage latencies, served on /metrics.")
+    parser.add_argument("--metrics_interval", type=float, default=None,
+                        help="Print a metrics summary line every this many seconds.")
+    tracing.add_arguments(parser)
+    args = parser.parse_args()
+
+    tracing.enable_from_args(args)
+    if args.metrics or args.metrics_interval:
+        metrics.enable(summary_interval=args.metrics_interval)
+
+    service = EmotionService(source=args.source, detector_backend=args.detector_backend,
+                             detect_every=args.detect_every, cpu_budget=args.cpu_budget,
+                             identify=args.identify, log_path=args.log, host=args.host, port=args.port,
+                             motion_enabled=args.motion, speech_enabled=args.speech)
+    # Stop cleanly when run as a service (systemd, launchd, kill)
+    signal.signal(signal.SIGTERM, lambda signum, frame: service.stop())
+    service.run()
@@ -0,0 +1,250 @@
+"""
+Timeline profiling in the Chrome trace event format, for Perfetto (ui.perfetto.dev)
+or chrome://tracing.
+
+metrics.py says how long each stage takes on average; a trace shows what
+happened when. Every stage timed through metrics.py (capture, decode, detect,
+classify, render, display, Ikaros requests, logging, ...) becomes a span on
+the thread that ran it, the live loops add one span per frame, and the
+inference worker adds one span per analysis. A stutter in the live window
+then shows up as a long frame with whatever was blocking it underneath.
+
+    import tracing
+    tracing.enable("trace.json")        # or: python app.py --profile trace.json
+    ...
+    with tracing.span("load"):
+        ...
+
+The trace is written when the process exits. Processes started from a traced
+process (e.g. frame_bus.py started by `esep_program.py --profile`) are traced
+too: they inherit the EPI_TRACE environment variables, write trace.<pid>.json, and the
+parent merges those files into its own trace when it exits. A process started
+by hand can be traced with EPI_TRACE=trace.json, and files can be merged with
+`python tracing.py merge trace.json trace.*.json`.
+
+For long sessions, record only `sample_window` seconds out of every
+`sample_period` seconds. The window follows the wall clock, so all threads and
+processes sample the same moments. At most `max_events` spans are kept per
+process, child processes included; older ones are dropped first.
+"""
+
+import argparse
+import atexit
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+ENV_PATH = "EPI_TRACE"
+ENV_PERIOD = "EPI_TRACE_PERIOD"
+ENV_WINDOW = "EPI_TRACE_WINDOW"
+ENV_MAX_EVENTS = "EPI_TRACE_MAX_EVENTS"
+MAX_EVENTS = 200_000
+
+active = False
+
+_events = deque(maxlen=MAX_EVENTS)
+_thread_names = {}
+_local = threading.local()
+_config = {"path": None, "sample_period": None, "sample_window": None, "child": False}
+_clock_offset = time.time() - time.perf_counter()  # perf_counter -> wall clock, aligns processes
+
+
+def _sampled(start):
+    period = _config["sample_period"]
+    if not period:
+        return True
+    return (start + _clock_offset) % period < _config["sample_window"]
+
+
+def complete(name, start, duration, **args):
+    """
+    Records a finished span.
+
+    Args:
+        name (str): Shown on the span, e.g. the stage name.
+        start (float): time.perf_counter() when it started.
+        duration (float): Seconds.
+        **args: Shown in the span's details.
+    """
+    if not active or not _sampled(start):
+        return
+    tid = threading.get_ident()
+    if tid not in _thread_names:
+        _thread_names[tid] = threading.current_thread().name
+    _events.append((name, (start + _clock_offset) * 1e6, duration * 1e6, tid, args or None))
+
+
+@contextmanager
+def span(name, **args):
+    """Records the block as a span."""
+    if not active:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        complete(name, start, time.perf_counter() - start, **args)
+
+
+def frame(index=None):
+    """
+    Call at the top of a per-frame loop. Ends the previous frame's span on this thread
+    and starts the next one; index=None only ends it.
+    """
+    if not active:
+        return
+    now = time.perf_counter()
+    previous = getattr(_local, "frame", None)
+    if previous is not None:
+        start, previous_index = previous
+        complete("frame", start, now - start, frame=previous_index)
+    _local.frame = None if index is None else (now, index)
+
+
+def enable(path="trace.json", sample_period=None, sample_window=1.0, max_events=MAX_EVENTS):
+    """
+    Starts recording. The trace is written to `path` when the process exits.
+
+    Args:
+        path (str): Trace file to write.
+        sample_period (float): Record `sample_window` seconds out of every `sample_period`
+            seconds. None records everything.
+        sample_window (float): Seconds recorded per period.
+        max_events (int): Spans kept in memory, the oldest are dropped first.
+    """
+    global active, _events
+    _config.update(path=path, sample_period=sample_period, sample_window=sample_window, child=False)
+    _events = deque(_events, maxlen=max_events)
+    if not active:
+        atexit.register(dump)
+    active = True
+
+    # Processes started from here trace themselves into files next to ours
+    os.environ[ENV_PATH] = os.path.abspath(path)
+    os.environ[ENV_MAX_EVENTS] = str(max_events)
+    if sample_period:
+        os.environ[ENV_PERIOD] = str(sample_period)
+        os.environ[ENV_WINDOW] = str(sample_window)
+    else:
+        os.environ.pop(ENV_PERIOD, None)
+        os.environ.pop(ENV_WINDOW, None)
+
+
+def _child_path(path, pid):
+    base, ext = os.path.splitext(path)
+    return f"{base}.{pid}{ext or '.json'}"
+
+
+def _child_files(path):
+    base, ext = os.path.splitext(path)
+    ext = ext or ".json"
+    files = []
+    for candidate in glob.glob(f"{glob.escape(base)}.*{glob.escape(ext)}"):
+        if candidate[len(base) + 1:len(candidate) - len(ext)].isdigit():
+            files.append(candidate)
+    return files
+
+
+def _trace_events():
+    pid = os.getpid()
+    process_name = multiprocessing.current_process().name
+    if process_name == "MainProcess":
+        process_name = os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else "python"
+    events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": process_name}}]
+    for tid, name in list(_thread_names.items()):
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}})
+    for name, ts, dur, tid, args in list(_events):
+        event = {"name": name, "cat": "epi", "ph": "X", "ts": round(ts, 1), "dur": round(dur, 1),
+                 "pid": pid, "tid": tid}
+        if args:
+            event["args"] = args
+        events.append(event)
+    return events
+
+
+def _write(path, events):
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def dump(path=None):
+    """
+    Writes the trace now. The main process also merges the traces that child
+    processes have written so far, and removes their files.
+    """
+    path = path or _config["path"]
+    if not path:
+        return
+    if _config["child"]:
+        _write(_child_path(path, os.getpid()), _trace_events())
+        return
+
+    events = _trace_events()
+    for child_file in _child_files(path):
+        try:
+            with open(child_file) as f:
+                events.extend(json.load(f)["traceEvents"])
+            os.remove(child_file)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not merge trace {child_file}: {e}")
+    _write(path, events)
+    spans = sum(1 for e in events if e.get("ph") == "X")
+    print(f"Trace with {spans} spans written to {path}, open it in https://ui.perfetto.dev")
+
+
+def merge(output, paths):
+    """Combines trace files, e.g. from processes that were started by hand."""
+    events = []
+    for path in paths:
+        with open(path) as f:
+            events.extend(json.load(f)["traceEvents"])
+    _write(output, events)
+    print(f"Merged {len(paths)} traces into {output}")
+
+
+def add_arguments(parser):
+    """Adds --profile, --profile_period and --profile_window to a command line parser."""
+    parser.add_argument("--profile", nargs="?", const="trace.json", default=None, metavar="TRACE",
+                        help="Record a Chrome trace (open it in ui.perfetto.dev), default file trace.json.")
+    parser.add_argument("--profile_period", type=float, default=None,
+                        help="Trace only --profile_window seconds out of every this many seconds.")
+    parser.add_argument("--profile_window", type=float, default=1.0,
+                        help="Seconds traced per --profile_period.")
+
+
+def enable_from_args(args):
+    if args.profile:
+        enable(args.profile, sample_period=args.profile_period, sample_window=args.profile_window)
+
+
+def _enable_from_env():
+    global active, _events
+    path = os.environ.get(ENV_PATH)
+    if not path:
+        return
+    period = os.environ.get(ENV_PERIOD)
+    _config.update(path=path, sample_period=float(period) if period else None,
+                   sample_window=float(os.environ.get(ENV_WINDOW, 1.0)), child=True)
+    _events = deque(maxlen=int(os.environ.get(ENV_MAX_EVENTS, MAX_EVENTS)))
+    active = True
+    atexit.register(dump)
+
+
+_enable_from_env()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chrome trace files.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    merge_parser = subparsers.add_parser("merge", help="Combine trace files into one.")
+    merge_parser.add_argument("output", help="Trace file to write.")
+    merge_parser.add_argument("traces", nargs="+", help="Trace files to combine.")
+    args = parser.parse_args()
+    merge(args.output, args.traces)
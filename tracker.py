@@ -0,0 +1,215 @@
+"""
+Lightweight multi-face tracker.
+
+Between two DeepFace analyses the faces keep moving, and the list order that
+DeepFace returns says nothing about who is who. FaceTracker moves each box
+along with the image using sparse optical flow on every frame, and matches new
+detections to existing tracks by overlap (IoU), falling back to centre distance
+for fast motion. Each track keeps a stable id for as long as it is matched.
+"""
+
+import cv2
+import numpy as np
+
+
+def region_to_box(region):
+    """
+    Converts a DeepFace 'region'/'facial_area' dict to an (x, y, w, h) tuple.
+    """
+    return (region.get('x', 0), region.get('y', 0), region.get('w', 0), region.get('h', 0))
+
+
+def detections_from_analysis(result):
+    """
+    Turns a DeepFace.analyze result into tracker detections.
+
+    DeepFace returns the whole frame as one 'face' with zero confidence when
+    enforce_detection=False and nothing was found; those entries are dropped.
+
+    Returns:
+        list: (box, face_data) tuples.
+    """
+    if not result:
+        return []
+    if isinstance(result, dict):
+        result = [result]
+    detections = []
+    for face in result:
+        if face.get('face_confidence', 1) == 0:
+            continue
+        detections.append((region_to_box(face.get('region', {})), face))
+    return detections
+
+
+def iou(a, b):
+    """
+    Intersection over union of two (x, y, w, h) boxes.
+    """
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
+
+
+def centre_distance(a, b):
+    """
+    Distance between the centres of two boxes, relative to the size of the first.
+    """
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    dx = (ax + aw / 2) - (bx + bw / 2)
+    dy = (ay + ah / 2) - (by + bh / 2)
+    return np.hypot(dx, dy) / max(aw, ah, 1)
+
+
+class Track:
+    """
+    One tracked face.
+
+    Attributes:
+        id (int): Stable track id.
+        box (tuple): Current (x, y, w, h) as floats.
+        data: Payload of the last matched detection, e.g. the DeepFace face dict.
+        hits (int): Number of detections matched to this track.
+        misses (int): Consecutive updates without a matching detection.
+    """
+
+    def __init__(self, track_id, box, data=None):
+        self.id = track_id
+        self.box = tuple(float(v) for v in box)
+        self.data = data
+        self.hits = 1
+        self.misses = 0
+
+    def int_box(self):
+        return tuple(int(round(v)) for v in self.box)
+
+
+class FaceTracker:
+    """
+    Associates detections over time and propagates boxes between detections.
+
+    Call predict(frame) on every frame and update(detections) whenever a new
+    detection result is available.
+
+    Args:
+        iou_threshold (float): Minimum overlap for a detection to continue a track.
+        max_distance (float): Centre distance (in box sizes) accepted when the overlap is too small.
+        max_misses (int): Updates a track may go unmatched before it is removed.
+        use_flow (bool): Move boxes with optical flow in predict(). If False predict() only
+            remembers the frame.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_distance=0.5, max_misses=2, use_flow=True):
+        self.iou_threshold = iou_threshold
+        self.max_distance = max_distance
+        self.max_misses = max_misses
+        self.use_flow = use_flow
+        self.tracks = []
+        self._next_id = 1
+        self._prev_gray = None
+
+    def predict(self, frame):
+        """
+        Moves every track along with the image content since the previous frame.
+
+        Args:
+            frame: BGR image.
+
+        Returns:
+            list: The current tracks.
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        prev = self._prev_gray
+        if self.use_flow and prev is not None and prev.shape == gray.shape:
+            for track in self.tracks:
+                self._propagate(track, prev, gray)
+        self._prev_gray = gray
+        return self.tracks
+
+    def _propagate(self, track, prev, gray):
+        height, width = gray.shape
+        x, y, w, h = track.int_box()
+        x1, y1 = max(0, x), max(0, y)
+        x2, y2 = min(width, x + w), min(height, y + h)
+        if x2 - x1 < 8 or y2 - y1 < 8:
+            return
+
+        # Only look for features inside the face box
+        points = cv2.goodFeaturesToTrack(prev[y1:y2, x1:x2], maxCorners=30,
+                                         qualityLevel=0.01, minDistance=3)
+        if points is None:
+            return
+        points = points + np.array([x1, y1], dtype=np.float32)
+
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(prev, gray, points, None,
+                                                    winSize=(15, 15), maxLevel=2)
+        ok = status.reshape(-1) == 1
+        if not ok.any():
+            return
+        dx, dy = np.median((moved - points).reshape(-1, 2)[ok], axis=0)
+        bx, by, bw, bh = track.box
+        track.box = (bx + float(dx), by + float(dy), bw, bh)
+
+    def update(self, detections, frame=None):
+        """
+        Matches detections to tracks, starts new tracks and drops lost ones.
+
+        Args:
+            detections (list): (box, data) tuples with boxes as (x, y, w, h).
+            frame: Optional frame the detections came from, used as the reference for
+                the next predict() call.
+
+        Returns:
+            list: The Track for each detection, in the same order as detections.
+        """
+        candidates = []
+        for t_idx, track in enumerate(self.tracks):
+            for d_idx, (box, _) in enumerate(detections):
+                overlap = iou(track.box, box)
+                distance = centre_distance(track.box, box)
+                if overlap >= self.iou_threshold or distance <= self.max_distance:
+                    candidates.append((overlap + max(0.0, 1.0 - distance), t_idx, d_idx))
+
+        # Greedy assignment, best matches first
+        candidates.sort(reverse=True)
+        matched_tracks = set()
+        assigned = [None] * len(detections)
+        for _, t_idx, d_idx in candidates:
+            if t_idx in matched_tracks or assigned[d_idx] is not None:
+                continue
+            track = self.tracks[t_idx]
+            box, data = detections[d_idx]
+            track.box = tuple(float(v) for v in box)
+            track.data = data
+            track.hits += 1
+            track.misses = 0
+            matched_tracks.add(t_idx)
+            assigned[d_idx] = track
+
+        survivors = []
+        for t_idx, track in enumerate(self.tracks):
+            if t_idx not in matched_tracks:
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    continue
+            survivors.append(track)
+
+        for d_idx, (box, data) in enumerate(detections):
+            if assigned[d_idx] is None:
+                track = Track(self._next_id, box, data)
+                self._next_id += 1
+                survivors.append(track)
+                assigned[d_idx] = track
+
+        self.tracks = survivors
+        if frame is not None:
+            self._prev_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return assigned
+
+    def reset(self):
+        self.tracks = []
+        self._prev_gray = None